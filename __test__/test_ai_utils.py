@@ -0,0 +1,240 @@
+import os
+import sys
+import asyncio
+import threading
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock, AsyncMock
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import ai_utils
+from ai_utils import ClientPool
+from rate_limiter import PriorityRateLimiter
+from context_cache import ContextCacheRegistry
+from cancellation import CancellationToken, TurnCancelled
+
+class TestClientPool:
+    @pytest.fixture
+    def pool(self):
+        with patch.object(ai_utils.genai, 'Client', side_effect=lambda **kwargs: MagicMock()):
+            yield ClientPool(max_size=2, idle_timeout=60)
+
+    def test_reuses_client_for_same_key(self, pool):
+        """Test that the same API key gets the same client"""
+        with pool.lease("key-a") as first:
+            pass
+        with pool.lease("key-a") as second:
+            pass
+        assert first is second
+        assert len(pool) == 1
+
+    def test_evicts_least_recently_used(self, pool):
+        """Test that the pool never grows beyond max_size"""
+        with pool.lease("key-a") as client_a:
+            pass
+        with pool.lease("key-b"):
+            pass
+        with pool.lease("key-c"):
+            pass
+        assert len(pool) == 2
+        client_a.close.assert_called_once()
+
+    def test_evicted_client_closed_after_lease(self, pool):
+        """Test that a client in use is only closed once released"""
+        with pool.lease("key-a") as client:
+            pool.evict("key-a")
+            client.close.assert_not_called()
+        client.close.assert_called_once()
+
+    def test_idle_clients_are_closed(self, pool):
+        """Test that idle clients are evicted on the next lease"""
+        with pool.lease("key-a") as client:
+            pass
+        with patch.object(ai_utils.time, 'monotonic', return_value=ai_utils.time.monotonic() + 120):
+            with pool.lease("key-b"):
+                pass
+        client.close.assert_called_once()
+        assert len(pool) == 1
+
+    def test_remove_api_key_evicts_client(self):
+        """Test that disconnecting a session drops its pooled client"""
+        ai_utils.update_api_key("session-1", "session-key")
+        with patch.object(ai_utils.client_pool, 'evict') as evict:
+            ai_utils.remove_api_key("session-1")
+        evict.assert_called_once_with("session-key")
+
+class TestAsyncGateway:
+    @pytest.fixture
+    def fake_client(self):
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(return_value=MagicMock(function_calls=None))
+        unlimited = PriorityRateLimiter(rate_per_minute=60000, capacity=1000)
+        with patch.object(ai_utils.client_pool, 'lease') as lease, patch.object(ai_utils, 'rate_limiter', unlimited):
+            lease.return_value.__enter__.return_value = client
+            yield client
+
+    def test_sync_shim_returns_response(self, fake_client):
+        """Test that generate_response waits for the async gateway"""
+        response = ai_utils.generate_response("Hello", api_key="test-key")
+        assert response is fake_client.aio.models.generate_content.return_value
+        fake_client.aio.models.generate_content.assert_awaited_once()
+
+    def test_positional_arguments_keep_baseline_order(self, fake_client):
+        """Test that generate_response(prompt, temperature, tools, api_key) still binds positionally"""
+        with patch.object(ai_utils, '_resolve_api_key', wraps=ai_utils._resolve_api_key) as resolve:
+            ai_utils.generate_response("Hello", 0.7, None, "positional-key")
+        assert resolve.call_args_list[0].args == ("positional-key",)
+        config = fake_client.aio.models.generate_content.call_args.kwargs["config"]
+        assert config.temperature == 0.7
+
+    def test_streamed_response_accumulates_deltas(self, fake_client):
+        """Test that on_delta gets every text chunk and the response holds the whole reply"""
+        call = SimpleNamespace(name="remember_information", args={"information": "The bard owes us gold"})
+
+        def chunk(*parts, usage=None):
+            return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=list(parts)))],
+                                   usage_metadata=usage)
+
+        chunks = [
+            chunk(SimpleNamespace(text="Follow ", function_call=None)),
+            chunk(SimpleNamespace(text="me!", function_call=None)),
+            chunk(SimpleNamespace(text=None, function_call=call),
+                  usage=SimpleNamespace(prompt_token_count=7, candidates_token_count=3, cached_content_token_count=None)),
+        ]
+
+        async def stream():
+            for item in chunks:
+                yield item
+
+        fake_client.aio.models.generate_content_stream = AsyncMock(return_value=stream())
+        deltas = []
+        response = ai_utils.generate_response("Hello", api_key="stream-key", on_delta=deltas.append)
+
+        assert deltas == ["Follow ", "me!"]
+        assert response.text == "Follow me!"
+        assert response.function_calls == [call]
+        assert response.usage_metadata.prompt_token_count == 7
+        fake_client.aio.models.generate_content.assert_not_awaited()
+
+    def test_concurrency_is_bounded_per_key(self, fake_client):
+        """Test that no more than LLM_MAX_CONCURRENCY requests run at once"""
+        in_flight = 0
+        max_in_flight = 0
+
+        async def slow_generate(**kwargs):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+            return MagicMock(function_calls=None)
+
+        fake_client.aio.models.generate_content = slow_generate
+        futures = [ai_utils.submit_generate_response("Hello", api_key="bounded-key")
+                   for _ in range(ai_utils.LLM_MAX_CONCURRENCY * 2)]
+        for future in futures:
+            future.result(timeout=5)
+        assert max_in_flight == ai_utils.LLM_MAX_CONCURRENCY
+
+    def test_cancel_aborts_request(self, fake_client):
+        """Test that cancelling the future cancels the pending request"""
+        started = threading.Event()
+
+        async def hanging_generate(**kwargs):
+            started.set()
+            await asyncio.sleep(10)
+
+        fake_client.aio.models.generate_content = hanging_generate
+        future = ai_utils.submit_generate_response("Hello", api_key="cancel-key")
+        assert started.wait(timeout=5)
+        assert future.cancel()
+
+    def test_cancel_token_aborts_request(self, fake_client):
+        """Test that cancelling the turn token aborts a blocking generate_response"""
+        started = threading.Event()
+
+        async def hanging_generate(**kwargs):
+            started.set()
+            await asyncio.sleep(10)
+
+        fake_client.aio.models.generate_content = hanging_generate
+        token = CancellationToken()
+        threading.Thread(target=lambda: started.wait(5) and token.cancel()).start()
+        with pytest.raises(TurnCancelled):
+            ai_utils.generate_response("Hello", api_key="cancel-key", cancel_token=token)
+
+    def test_call_is_recorded_per_stage(self, fake_client):
+        """Test that gateway calls are recorded with stage and token counts"""
+        fake_client.aio.models.generate_content.return_value.usage_metadata = SimpleNamespace(
+            prompt_token_count=12, candidates_token_count=3, cached_content_token_count=None)
+        ai_utils.llm_metrics.clear()
+        ai_utils.generate_response("Hello", api_key="test-key", stage="scene")
+        summary = ai_utils.llm_metrics.summary()["scene"]
+        assert summary["window_calls"] == 1
+        assert summary["input_tokens"]["p50"] == 12
+        assert summary["prompt_chars"]["p50"] == 5
+
+    def test_response_schema_requests_json(self, fake_client):
+        """Test that a response schema switches the request to structured output"""
+        schema = ai_utils.genai.types.Schema(type="OBJECT", properties={"message": ai_utils.genai.types.Schema(type="STRING")})
+        ai_utils.generate_response("Hello", api_key="test-key", response_schema=schema)
+        config = fake_client.aio.models.generate_content.call_args.kwargs["config"]
+        assert config.response_mime_type == "application/json"
+        assert config.response_schema == schema
+
+class TestContextCache:
+    @pytest.fixture
+    def client(self):
+        client = MagicMock()
+        client.aio.caches.create = AsyncMock(side_effect=lambda **kwargs: SimpleNamespace(name=f"cachedContents/{client.aio.caches.create.await_count}"))
+        client.aio.caches.delete = AsyncMock()
+        return client
+
+    def test_prefix_is_cached_once(self, client):
+        """Test that an unchanged prefix reuses the cached context"""
+        registry = ContextCacheRegistry(ttl=3600)
+
+        async def scenario():
+            first = await registry.get_cache_name(client, "key", "character-elara", "model", "Lore")
+            second = await registry.get_cache_name(client, "key", "character-elara", "model", "Lore")
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        assert first == second == "cachedContents/1"
+        client.aio.caches.create.assert_awaited_once()
+
+    def test_changed_prefix_replaces_cache(self, client):
+        """Test that editing the lore re-creates the cached context"""
+        registry = ContextCacheRegistry(ttl=3600)
+
+        async def scenario():
+            await registry.get_cache_name(client, "key", "character-elara", "model", "Lore")
+            await registry.get_cache_name(client, "key", "character-elara", "model", "New lore")
+
+        asyncio.run(scenario())
+        assert client.aio.caches.create.await_count == 2
+        client.aio.caches.delete.assert_awaited_once()
+
+    def test_failed_creation_falls_back_inline(self, client):
+        """Test that a prefix too small to cache is sent inline and not retried"""
+        client.aio.caches.create = AsyncMock(side_effect=Exception("Cached content is too small"))
+        registry = ContextCacheRegistry(ttl=3600)
+
+        async def scenario():
+            first = await registry.get_cache_name(client, "key", "character-elara", "model", "Lore")
+            second = await registry.get_cache_name(client, "key", "character-elara", "model", "Lore")
+            return first, second
+
+        assert asyncio.run(scenario()) == (None, None)
+        client.aio.caches.create.assert_awaited_once()
+
+def test_run_tools_matches_declared_names():
+    """Test that function calls are matched by declared name as well as Python name"""
+    add_intention = MagicMock(__name__="add_intention")
+    declaration = ai_utils.genai.types.Tool(function_declarations=[
+        ai_utils.genai.types.FunctionDeclaration(name="addIntention")])
+    ai_utils.run_tools([ai_utils.FunctionCall(name="addIntention", args={"intention": "Find the map"})],
+                       [(add_intention, declaration)])
+    add_intention.assert_called_once_with(intention="Find the map")
@@ -2,6 +2,7 @@ import os
 import sys
 import pytest
 import json
+import glob
 import unittest
 from unittest.mock import patch, MagicMock
 
@@ -142,9 +143,9 @@ class TestGameState:
         assert dialog_history[0].sender == "Test"
         assert dialog_history[0].message == "Test save message"
         
-        # Clean up
-        if os.path.exists(expected_file_path):
-            os.remove(expected_file_path)
+        # Clean up the save and its memory and embedding sidecars
+        for path in glob.glob(f"{os.path.splitext(expected_file_path)[0]}.*"):
+            os.remove(path)
 
 if __name__ == "__main__":
     pytest.main(["-v", "__test__/test_app.py"]) 
\ No newline at end of file
@@ -0,0 +1,95 @@
+import os
+import sys
+import numpy as np
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from campaign_memory import CampaignMemory, MemoryView
+
+WORDS = ["sword", "goblin", "stranger", "tavern"]
+
+def fake_encoder(texts):
+    """One dimension per known word, normalized"""
+    vectors = np.array([[1.0 if word in text.lower() else 0.0 for word in WORDS] + [0.1] for text in texts],
+                       dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+class TestCampaignMemory:
+    def test_shared_memory_is_stored_once(self):
+        """Test that a memory known by the whole party is one pool entry"""
+        pool = CampaignMemory(encoder=fake_encoder)
+        pool.add("Found a magical sword", ["ragnar", "elara", "thorne"])
+        pool.add("Found a magical sword", ["ragnar"])
+        assert len(pool) == 1
+        assert all(len(MemoryView(pool, char_id)) == 1 for char_id in ["ragnar", "elara", "thorne"])
+
+    def test_views_keep_set_api(self):
+        """Test that a character view behaves like the old per-character set"""
+        pool = CampaignMemory(encoder=fake_encoder)
+        ragnar, elara = MemoryView(pool, "ragnar"), MemoryView(pool, "elara")
+        pool.add("Met a mysterious stranger", ["ragnar", "elara"])
+        ragnar.add("Defeated a goblin camp")
+        assert "Defeated a goblin camp" in ragnar
+        assert "Defeated a goblin camp" not in elara
+        ragnar.discard("Met a mysterious stranger")
+        assert list(ragnar) == ["Defeated a goblin camp"]
+        assert list(elara) == ["Met a mysterious stranger"]
+        ragnar.clear()
+        assert len(ragnar) == 0
+        # Nobody knows the goblin camp anymore, so it leaves the pool
+        assert list(pool) == ["Met a mysterious stranger"]
+
+    def test_recall_is_scored_once(self):
+        """Test that the pool is encoded and searched once for every character"""
+        calls = []
+
+        def counting_encoder(texts):
+            calls.append(list(texts))
+            return fake_encoder(texts)
+
+        pool = CampaignMemory(encoder=counting_encoder)
+        pool.add("Found a magical sword", ["ragnar", "elara"])
+        pool.add("Defeated a goblin camp", ["ragnar"])
+        messages = ["Where is my sword?", "The goblin attacks"]
+        assert set(MemoryView(pool, "ragnar").recall(messages, 0.9)) == {"Found a magical sword", "Defeated a goblin camp"}
+        assert set(MemoryView(pool, "elara").recall(messages, 0.9)) == {"Found a magical sword"}
+        # One batch for the pool and one for the messages
+        assert len(calls) == 2
+
+        pool.add("Slept in the tavern", ["elara"])
+        MemoryView(pool, "elara").recall(messages, 0.9)
+        assert len(calls) == 4
+
+    def test_retrieve_is_bounded(self):
+        """Test that retrieval keeps the top k and prefers important memories"""
+        pool = CampaignMemory(encoder=fake_encoder)
+        for index in range(20):
+            pool.add(f"Sword number {index}", ["ragnar"])
+        pool.add("Sword of the king", ["ragnar"], importance=1.0)
+        memory = MemoryView(pool, "ragnar")
+        retrieved = memory.retrieve(["Where is my sword?"], {"top_k": 3, "importance_weight": 0.5})
+        assert len(retrieved) == 3
+        assert retrieved[0] == "Sword of the king"
+        # Among equally similar memories the newest come first
+        assert retrieved[1:] == ["Sword number 19", "Sword number 18"]
+
+    def test_retain_characters(self):
+        """Test that removing a character drops what only they knew"""
+        pool = CampaignMemory(encoder=fake_encoder)
+        pool.add("Found a magical sword", ["ragnar", "elara"])
+        pool.add("Defeated a goblin camp", ["thorne"])
+        pool.retain_characters(["ragnar", "elara"])
+        assert list(pool) == ["Found a magical sword"]
+        assert len(MemoryView(pool, "thorne")) == 0
+
+    def test_save_round_trip(self):
+        """Test that to_dict and load restore memories with their visibility"""
+        pool = CampaignMemory(encoder=fake_encoder)
+        pool.add("Found a magical sword", ["ragnar", "elara"])
+        pool.add("Defeated a goblin camp", ["thorne"], importance=0.75)
+        restored = CampaignMemory(encoder=fake_encoder)
+        restored.load(pool.to_dict())
+        assert restored.to_dict() == pool.to_dict()
+        assert restored.knows("elara", "Found a magical sword")
+        assert not restored.knows("elara", "Defeated a goblin camp")
@@ -0,0 +1,48 @@
+import os
+import sys
+from concurrent.futures import Future
+from unittest.mock import MagicMock
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from cancellation import CancellationToken, TurnCancelled, cancel_turns, start_turn
+
+class TestCancellationToken:
+    def test_cancel_cancels_tracked_futures(self):
+        """Test that cancelling the token cancels pending futures"""
+        token = CancellationToken()
+        future = token.track(Future())
+        token.cancel()
+        assert future.cancelled()
+        with pytest.raises(TurnCancelled):
+            token.raise_if_cancelled()
+
+    def test_track_after_cancel(self):
+        """Test that a future tracked by a cancelled token is cancelled right away"""
+        token = CancellationToken()
+        token.cancel()
+        assert token.track(Future()).cancelled()
+
+    def test_callbacks_run_once(self):
+        """Test that stop callbacks run on the first cancel only, unless removed"""
+        token = CancellationToken()
+        stop = MagicMock()
+        removed = MagicMock()
+        token.add_callback(stop)
+        token.add_callback(removed)
+        token.remove_callback(removed)
+        token.cancel()
+        token.cancel()
+        stop.assert_called_once()
+        removed.assert_not_called()
+
+def test_cancel_turns_cancels_started_turns():
+    """Test that cancel_turns cancels every live turn token"""
+    cancel_turns()
+    first = start_turn()
+    second = start_turn()
+    assert cancel_turns() == 2
+    assert first.cancelled and second.cancelled
+    assert cancel_turns() == 0
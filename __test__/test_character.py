@@ -70,6 +70,13 @@ class TestCharacter:
         sample_character.clear_memories()
         assert len(sample_character.memory) == 0
     
+    def test_from_dict_drops_invalid_memory_settings(self, sample_character):
+        """Test that bad memory settings in a save are dropped when the character is loaded"""
+        data = sample_character.export_to_dict()
+        data["memory_settings"] = {"top_k": "abc", "budget": 800}
+        loaded = Character.from_dict(data)
+        assert loaded.memory_settings == {"budget": 800}
+        
     def test_avatar_management(self, sample_character, tmp_path):
         """Test avatar setting and getting"""
         # Test default avatar
@@ -3,6 +3,7 @@
 import os
 import sys
 import json
+import glob
 import pytest
 
 # Add the parent directory to sys.path for imports
@@ -73,10 +74,10 @@ def test_save_load_characters_to_file():
     
     print("Character save/load test passed!")
     
-    # Clean up test file
-    if os.path.exists(test_save_path):
-        os.remove(test_save_path)
-        print(f"Removed test file: {test_save_path}")
+    # Clean up test file and its memory and embedding sidecars
+    for path in glob.glob(f"{os.path.splitext(test_save_path)[0]}.*"):
+        os.remove(path)
+        print(f"Removed test file: {path}")
 
 if __name__ == "__main__":
     test_save_load_characters_to_file() 
\ No newline at end of file
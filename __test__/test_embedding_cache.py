@@ -0,0 +1,91 @@
+import os
+import sys
+import numpy as np
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import embedding_cache as embedding_cache_module
+from embedding_cache import KEY_SIZE, EmbeddingCache, PersistedEmbeddings, sidecar_path, text_key, write_embeddings
+
+def vector(value, dimension=4):
+    return np.full(dimension, value, dtype=np.float32)
+
+class TestEmbeddingCache:
+    def test_hits_and_misses_are_counted(self):
+        """Test that lookups update the counters"""
+        cache = EmbeddingCache(max_entries=10, max_bytes=0)
+        assert cache.get("hello") is None
+        cache.put("hello", vector(1.0))
+        assert np.array_equal(cache.get("hello"), vector(1.0))
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_rate'] == 0.5
+
+    def test_least_recently_used_is_evicted(self):
+        """Test that the entry limit evicts the oldest unused entry"""
+        cache = EmbeddingCache(max_entries=2, max_bytes=0)
+        cache.put("a", vector(1.0))
+        cache.put("b", vector(2.0))
+        cache.get("a")
+        cache.put("c", vector(3.0))
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.stats()['evictions'] == 1
+
+    def test_byte_limit(self):
+        """Test that the byte limit bounds the stored vectors"""
+        entry_bytes = vector(1.0, 384).nbytes + KEY_SIZE
+        cache = EmbeddingCache(max_entries=0, max_bytes=3 * entry_bytes)
+        for index in range(10):
+            cache.put(f"message {index}", vector(index, 384))
+        assert len(cache) == 3
+        assert cache.stats()['bytes'] == 3 * entry_bytes
+
+    def test_texts_are_not_kept(self):
+        """Test that keys are content hashes, not the texts"""
+        cache = EmbeddingCache()
+        text = "The goblin hides behind the barrel " * 50
+        cache.put(text, vector(1.0))
+        assert all(len(key) == KEY_SIZE for key in cache._entries)
+        assert cache.stats()['bytes'] == vector(1.0).nbytes + KEY_SIZE
+
+class TestPersistedEmbeddings:
+    def test_lookups_fall_back_to_sidecar(self, tmp_path):
+        """Test that the LRU misses are served from the mapped sidecar"""
+        path = str(tmp_path / "game.embeddings.model.npy")
+        write_embeddings(path, {text_key("hello"): vector(1.0), text_key("world"): vector(2.0)})
+        cache = EmbeddingCache()
+        cache.attach(PersistedEmbeddings(path))
+        embedding = cache.get("world")
+        assert np.array_equal(embedding, vector(2.0))
+        # Rows are views into the mapped file, not copies
+        assert isinstance(embedding.base, np.memmap) or isinstance(embedding, np.memmap)
+        assert cache.get("missing") is None
+        assert cache.stats()['persisted_hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_missing_sidecar_is_empty(self, tmp_path):
+        """Test that a save without a sidecar just misses"""
+        persisted = PersistedEmbeddings(str(tmp_path / "none.npy"))
+        assert persisted.get(text_key("hello")) is None
+        assert len(persisted) == 0
+
+    def test_save_and_load_with_model_in_name(self, tmp_path, monkeypatch):
+        """Test the round trip and that another model's sidecar is replaced"""
+        cache = EmbeddingCache()
+        monkeypatch.setattr(embedding_cache_module, 'embedding_cache', cache)
+        save_path = str(tmp_path / "game_state.json")
+        old_model_path = sidecar_path(save_path, "old-model")
+        write_embeddings(old_model_path, {text_key("hello"): vector(9.0)})
+
+        cache.put("hello", vector(1.0))
+        embedding_cache_module.save_embeddings(save_path, ["hello", "unknown"])
+        assert not os.path.exists(old_model_path)
+
+        restored = EmbeddingCache()
+        monkeypatch.setattr(embedding_cache_module, 'embedding_cache', restored)
+        embedding_cache_module.load_embeddings(save_path)
+        assert np.array_equal(restored.get("hello"), vector(1.0))
+        assert restored.get("unknown") is None
@@ -3,6 +3,7 @@
 import os
 import sys
 import json
+import glob
 import pytest
 import tempfile
 from unittest.mock import patch, mock_open
@@ -98,10 +99,10 @@ def test_game_save_load_with_characters():
     
     print("Game save/load with characters test passed!")
     
-    # Clean up test file
-    if os.path.exists(test_save_path):
-        os.remove(test_save_path)
-        print(f"Removed test file: {test_save_path}")
+    # Clean up test file and its memory and embedding sidecars
+    for path in glob.glob(f"{os.path.splitext(test_save_path)[0]}.*"):
+        os.remove(path)
+        print(f"Removed test file: {path}")
 
 # Run test
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import os
 import sys
 import json
+import glob
 import pytest
 import tempfile
 from unittest.mock import patch, mock_open
@@ -101,9 +102,9 @@ class TestGameState:
             assert save_data["base_lore"] == "This is a test lore entry"
             assert len(save_data["dialogue_history"]) == 3
         
-        # Clean up
-        if os.path.exists(expected_file_path):
-            os.remove(expected_file_path)
+        # Clean up the save and its memory and embedding sidecars
+        for path in glob.glob(f"{os.path.splitext(expected_file_path)[0]}.*"):
+            os.remove(path)
     
     def test_load_game(self, reset_state, tmp_path):
         """Test loading game from file"""
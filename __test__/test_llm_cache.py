@@ -0,0 +1,97 @@
+import asyncio
+import os
+import sys
+import threading
+import pytest
+from unittest.mock import patch
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import llm_cache
+from llm_cache import CachedResponse, ResponseCache, make_cache_key
+
+class TestResponseCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return ResponseCache(max_entries=2, directory=tmp_path, max_disk_bytes=10_000)
+
+    def test_key_depends_on_prompt_and_temperature(self):
+        """Test that different inputs produce different keys"""
+        key = make_cache_key("model", "prompt", 0.5)
+        assert key == make_cache_key("model", "prompt", 0.5)
+        assert key != make_cache_key("model", "other prompt", 0.5)
+        assert key != make_cache_key("model", "prompt", 0.7)
+        assert key != make_cache_key("other-model", "prompt", 0.5)
+
+    def test_memory_hit_and_miss(self, cache):
+        """Test that a stored response is returned and counted"""
+        assert cache.get("key", ttl=60) is None
+        cache.put("key", CachedResponse("Hello"))
+        assert cache.get("key", ttl=60).text == "Hello"
+        stats = cache.stats()
+        assert stats["misses"] == 1
+        assert stats["memory_hits"] == 1
+
+    def test_disk_tier_survives_memory_eviction(self, cache):
+        """Test that entries evicted from the LRU are read back from disk"""
+        for key in ("a", "b", "c"):
+            cache.put(key, CachedResponse(key.upper()))
+        assert cache.stats()["memory_entries"] == 2
+        assert cache.get("a", ttl=60).text == "A"
+        assert cache.stats()["disk_hits"] == 1
+
+    def test_expired_entries_are_ignored(self, cache):
+        """Test that entries older than the stage TTL miss"""
+        cache.put("key", CachedResponse("Hello"))
+        with patch.object(llm_cache.time, 'time', return_value=llm_cache.time.time() + 120):
+            assert cache.get("key", ttl=60) is None
+
+    def test_async_disk_reads_leave_the_loop_free(self, cache):
+        """Test that a slow disk lookup runs in a worker thread while memory hits are served"""
+        cache.put("hot", CachedResponse("Hot"))
+        cache.put("cold", CachedResponse("Cold"))
+        del cache._memory["cold"]
+        release = threading.Event()
+        read_disk = cache._read_disk
+        readers = []
+
+        def slow_read(*args):
+            readers.append(threading.current_thread())
+            release.wait(timeout=5)
+            return read_disk(*args)
+
+        cache._read_disk = slow_read
+
+        async def lookups():
+            cold = asyncio.create_task(cache.get_async("cold", ttl=60))
+            await asyncio.sleep(0.05)
+            hot = await cache.get_async("hot", ttl=60)
+            release.set()
+            return hot, await cold
+
+        hot, cold = asyncio.run(lookups())
+        assert hot.text == "Hot"
+        assert cold.text == "Cold"
+        assert readers and readers[0] is not threading.main_thread()
+
+    def test_async_put_writes_both_tiers(self, cache, tmp_path):
+        """Test that put_async stores the response in memory and on disk"""
+        asyncio.run(cache.put_async("key", CachedResponse("Hello")))
+        assert cache._memory["key"][1].text == "Hello"
+        assert (tmp_path / "key.json").exists()
+
+    def test_disk_size_is_bounded(self, tmp_path):
+        """Test that the oldest files are removed when the store grows too big"""
+        cache = ResponseCache(max_entries=1, directory=tmp_path, max_disk_bytes=300)
+        for index in range(10):
+            cache.put(f"key-{index}", CachedResponse("x" * 50))
+        assert sum(path.stat().st_size for path in tmp_path.glob("*.json")) <= 300
+
+    def test_function_calls_round_trip(self, cache):
+        """Test that cached function calls can be replayed"""
+        cache.put("key", CachedResponse(None, [llm_cache.FunctionCall(name="request_character_response", args={"character_id": "elara"})]))
+        cache._memory.clear()
+        cached = cache.get("key", ttl=60)
+        assert cached.function_calls[0].name == "request_character_response"
+        assert cached.function_calls[0].args == {"character_id": "elara"}
@@ -0,0 +1,46 @@
+import os
+import sys
+import pytest
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from llm_metrics import CallRecord, LLMMetrics, percentile, prompt_length
+
+class TestLLMMetrics:
+    def test_percentiles(self):
+        """Test nearest-rank percentiles"""
+        values = [float(value) for value in range(1, 101)]
+        assert percentile(values, 0.50) == 50.0
+        assert percentile(values, 0.95) == 95.0
+        assert percentile(values, 0.99) == 99.0
+        assert percentile([], 0.5) == 0.0
+
+    def test_summary_per_stage(self):
+        """Test that calls are grouped by stage"""
+        metrics = LLMMetrics(window=10)
+        for wall_time in (1.0, 2.0, 3.0):
+            metrics.record(CallRecord("character", wall_time, 0.0, 1000, input_tokens=250, output_tokens=40))
+        metrics.record(CallRecord("scene", 0.5, 0.25, 400, error=True))
+
+        summary = metrics.summary()
+        assert summary["character"]["window_calls"] == 3
+        assert summary["character"]["wall_time"]["p50"] == 2.0
+        assert summary["character"]["input_tokens"]["mean"] == 250
+        assert summary["scene"]["errors"] == 1
+        assert summary["scene"]["queue_wait"]["max"] == 0.25
+        assert summary["scene"]["input_tokens"] is None
+
+    def test_window_is_rolling(self):
+        """Test that only the last window calls are kept"""
+        metrics = LLMMetrics(window=2)
+        for wall_time in (10.0, 1.0, 1.0):
+            metrics.record(CallRecord("analyzer", wall_time, 0.0, 10))
+        summary = metrics.summary()["analyzer"]
+        assert summary["total_calls"] == 3
+        assert summary["wall_time"]["max"] == 1.0
+
+    def test_prompt_length_of_parts(self):
+        """Test that only text parts count towards the prompt size"""
+        assert prompt_length("abc") == 3
+        assert prompt_length(["abc", object(), "de"]) == 5
@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import threading
+import numpy as np
+import pytest
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import memory_store
+from memory_index import ExactIndex, IVFIndex, exact_scores, exact_search
+from memory_store import MemoryStore
+
+def clustered_vectors(count, dimension=32, clusters=50, seed=1):
+    """Normalized vectors grouped around random centers, like topics of memories"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension))
+    vectors = centers[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, dimension))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def vector_encoder(vectors):
+    """Encoder for items named by their row in vectors"""
+    return lambda texts: vectors[[int(text) for text in texts]]
+
+class TestIVFIndex:
+    def test_exact_below_min_size(self):
+        """Test that small stores are searched exactly without training"""
+        vectors = clustered_vectors(100)
+        index = IVFIndex(min_size=1000)
+        result = index.search(vectors, vectors[:3], 0.8)
+        assert np.array_equal(result, exact_search(vectors, vectors[:3], 0.8))
+        assert index.centroids is None
+
+    def test_recall_against_exact(self):
+        """Test that the clustered search finds nearly all exact matches"""
+        vectors = clustered_vectors(20000)
+        index = IVFIndex(min_size=1000, nprobe=8)
+        index.train(vectors)
+        queries = clustered_vectors(20, seed=2)
+        expected = set(exact_search(vectors, queries, 0.8))
+        found = set(index.search(vectors, queries, 0.8))
+        assert found <= expected
+        assert len(found) >= 0.9 * len(expected)
+
+    def test_incremental_add_and_remove(self):
+        """Test that rows added or removed after training are searched correctly"""
+        vectors = clustered_vectors(3000)
+        index = IVFIndex(min_size=1000)
+        index.search(vectors[:2000], vectors[:1], 0.8)
+        index.wait()
+        for row in range(2000, 3000):
+            index.add(row, vectors[row])
+        assert 2500 in index.search(vectors, vectors[2500:2501], 0.99)
+        index.remove(2500)
+        assert 2500 not in index.search(vectors, vectors[2500:2501], 0.99)
+
+    def test_trains_in_background(self):
+        """Test that searches don't wait for training and changes made meanwhile are kept"""
+        vectors = clustered_vectors(3000)
+        index = IVFIndex(min_size=1000)
+        release = threading.Event()
+        fit = index._fit
+
+        def slow_fit(matrix, size):
+            release.wait(timeout=5)
+            return fit(matrix, size)
+
+        index._fit = slow_fit
+        # Searched exactly while the clusters are trained
+        assert np.array_equal(index.search(vectors[:2000], vectors[:3], 0.8), exact_search(vectors[:2000], vectors[:3], 0.8))
+        assert index.centroids is None
+        # Discard row 5 the way the store does, by moving the last row into it
+        matrix = vectors.copy()
+        matrix[5] = matrix[1999]
+        index.remove(5)
+        index.move(1999, 5)
+        for row in range(2000, 3000):
+            index.add(row, matrix[row])
+        release.set()
+        index.wait()
+
+        assert index.trained_size == 2000
+        assert list(index.search(matrix, vectors[1999:2000], 0.99)) == [5]
+        assert 2500 in index.search(matrix, vectors[2500:2501], 0.99)
+        assert sum(len(rows) for rows in index.lists) == 2999
+
+class TestMemoryStoreIndex:
+    def test_discard_keeps_index_aligned(self, monkeypatch):
+        """Test that the swap on discard moves the row in the index too"""
+        monkeypatch.setattr(memory_store, 'create_index', lambda: IVFIndex(min_size=500))
+        vectors = clustered_vectors(1000)
+        store = MemoryStore([str(row) for row in range(1000)], encoder=vector_encoder(vectors))
+        store.search(vectors[:1], 0.99)
+        store.discard("10")
+        assert store.search(vectors[999:1000], 0.99) == {"999"}
+        assert store.search(vectors[10:11], 0.99) == set()
+
+    def test_save_and_load(self, tmp_path, monkeypatch):
+        """Test that a loaded store searches without encoding again"""
+        monkeypatch.setattr(memory_store, 'create_index', lambda: IVFIndex(min_size=500))
+        vectors = clustered_vectors(1000)
+        items = [str(row) for row in range(1000)]
+        store = MemoryStore(items, encoder=vector_encoder(vectors))
+        store.search(vectors[:1], 0.99)
+        store._index.wait()
+        path = str(tmp_path / "ragnar.memory.npz")
+        store.save(path)
+
+        def fail_encoder(texts):
+            raise AssertionError("loaded memories were encoded again")
+
+        loaded = MemoryStore(reversed(items), encoder=fail_encoder)
+        assert loaded.load(path)
+        assert loaded.search(vectors[42:43], 0.99) == {"42"}
+
+        outdated = MemoryStore(items[:-1], encoder=fail_encoder)
+        assert not outdated.load(path)
+
+    def test_load_rejects_other_model(self, tmp_path):
+        """Test that embeddings of another model are not restored"""
+        vectors = clustered_vectors(10)
+        items = [str(row) for row in range(10)]
+        store = MemoryStore(items, encoder=vector_encoder(vectors))
+        path = str(tmp_path / "ragnar.memory.npz")
+        store.save(path, "old-model")
+        assert not MemoryStore(items, encoder=vector_encoder(vectors)).load(path, "new-model")
+        assert MemoryStore(items, encoder=vector_encoder(vectors)).load(path, "old-model")
+
+    def test_large_store_search_probes_few_rows(self, monkeypatch):
+        """Test that retrieval over 100k memories finds the matches while comparing with few rows"""
+        monkeypatch.setattr(memory_store, 'create_index', lambda: IVFIndex(min_size=2000))
+        vectors = clustered_vectors(100000, dimension=64, clusters=300)
+        store = MemoryStore([str(row) for row in range(100000)], encoder=vector_encoder(vectors))
+        queries = vectors[:10]
+        store.search(queries, 0.8)
+        store._index.wait()
+        result = store.search(queries, 0.8)
+
+        expected = {str(row) for row in exact_search(vectors, queries, 0.8)}
+        assert {str(row) for row in range(10)} <= result <= expected
+        assert len(result) >= 0.9 * len(expected)
+
+        # Every query is only compared with the rows of its own nprobe closest clusters
+        index = store._index
+        probed = np.argpartition(-(queries @ index.centroids.T), index.nprobe - 1, axis=1)[:, :index.nprobe]
+        scanned = [sum(len(index.lists[label]) for label in labels) for labels in probed]
+        assert max(scanned) < len(store) // 20
+
+    @pytest.mark.skipif(not os.getenv("MEMORY_BENCHMARK"), reason="set MEMORY_BENCHMARK=1 to time retrieval")
+    def test_large_store_search_benchmark(self, monkeypatch):
+        """Benchmark retrieval over 100k memories of the embedding model's size against exact search"""
+        monkeypatch.setattr(memory_store, 'create_index', lambda: IVFIndex(min_size=2000))
+        vectors = clustered_vectors(100000, dimension=384, clusters=300)
+        store = MemoryStore([str(row) for row in range(100000)], encoder=vector_encoder(vectors))
+        queries = clustered_vectors(10, dimension=384, clusters=300, seed=2)
+
+        started = time.perf_counter()
+        store.search(queries, 0.8)
+        first = time.perf_counter() - started
+        store._index.wait()
+
+        def average(search, repeats=20):
+            started = time.perf_counter()
+            for _ in range(repeats):
+                search()
+            return (time.perf_counter() - started) / repeats
+
+        indexed = average(lambda: store.score(queries, 0.8))
+        exact = average(lambda: exact_scores(vectors, queries, 0.8))
+        print(f"\n100k memories, 384 dimensions, 10 queries: indexed {indexed * 1000:.2f} ms, "
+              f"exact {exact * 1000:.2f} ms, first search while training {first * 1000:.0f} ms")
+
+class TestExactIndex:
+    def test_matches_exact_search(self):
+        """Test that the exact index compares with every row"""
+        vectors = clustered_vectors(50)
+        assert np.array_equal(ExactIndex().search(vectors, vectors[:2], 0.5), exact_search(vectors, vectors[:2], 0.5))
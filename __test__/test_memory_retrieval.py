@@ -0,0 +1,76 @@
+import os
+import sys
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from memory_retrieval import ITEM_OVERHEAD, load_settings, rank_memories, recency, resolve_settings, validate_settings
+
+def settings(**overrides):
+    return resolve_settings({"top_k": 10, "budget": 10000, "recency_weight": 0.0, "importance_weight": 0.0, **overrides})
+
+class TestRankMemories:
+    def test_top_k_by_similarity(self):
+        """Test that only the k most similar memories are kept, best first"""
+        candidates = [(f"memory {index}", index / 10, 0, 0.5) for index in range(10)]
+        assert rank_memories(candidates, settings(top_k=3)) == ["memory 9", "memory 8", "memory 7"]
+
+    def test_budget_bounds_prompt_size(self):
+        """Test that the selected memories fit into the character budget"""
+        candidates = [("a" * 100, 0.9, 0, 0.5), ("b" * 500, 0.8, 0, 0.5), ("c" * 50, 0.7, 0, 0.5)]
+        selected = rank_memories(candidates, settings(budget=200))
+        # The long memory is skipped, the shorter one below it still fits
+        assert selected == ["a" * 100, "c" * 50]
+        assert sum(len(item) + ITEM_OVERHEAD for item in selected) <= 200
+
+    def test_recency_and_importance_weights(self):
+        """Test that recent and important memories win close similarity ties"""
+        candidates = [("old", 0.70, 200, 0.5), ("new", 0.68, 0, 0.5), ("crucial", 0.66, 200, 1.0)]
+        assert rank_memories(candidates, settings())[0] == "old"
+        assert rank_memories(candidates, settings(recency_weight=0.1))[0] == "new"
+        assert rank_memories(candidates, settings(importance_weight=0.2))[0] == "crucial"
+
+    def test_recency_halves(self):
+        """Test the recency decay"""
+        assert recency(0) == 1.0
+        assert 0.49 < recency(50) < 0.51
+
+class TestResolveSettings:
+    def test_overrides_and_defaults(self):
+        """Test that per-character overrides replace only their keys"""
+        resolved = resolve_settings({"top_k": "5", "unknown": 1, "budget": None})
+        assert resolved["top_k"] == 5
+        assert "unknown" not in resolved
+        assert resolved["budget"] == resolve_settings()["budget"]
+
+class TestValidateSettings:
+    def test_coerces_known_keys(self):
+        """Test that valid overrides are coerced to the type of their default"""
+        assert validate_settings({"top_k": "5", "min_similarity": 0, "budget": None}) == {"top_k": 5, "min_similarity": 0.0}
+
+    @pytest.mark.parametrize("overrides", [
+        ["top_k"],
+        {"unknown": 1},
+        {"top_k": "many"},
+        {"top_k": True},
+        {"budget": -1},
+        {"recency_weight": float("nan")},
+    ])
+    def test_rejects_invalid_overrides(self, overrides):
+        """Test that unknown keys and values that aren't non-negative numbers are rejected"""
+        with pytest.raises(ValueError):
+            validate_settings(overrides)
+
+class TestLoadSettings:
+    def test_invalid_saved_entries_are_dropped(self):
+        """Test that bad values from a save are dropped instead of failing every retrieval"""
+        loaded = load_settings({"top_k": "abc", "budget": "500", "unknown": 1, "min_similarity": -1})
+        assert loaded == {"budget": 500}
+        assert resolve_settings(loaded)["top_k"] == resolve_settings()["top_k"]
+
+    def test_missing_or_malformed_settings(self):
+        """Test that saves without settings or with a non-object load as no overrides"""
+        assert load_settings(None) == {}
+        assert load_settings(["top_k", 5]) == {}
@@ -0,0 +1,62 @@
+import os
+import sys
+import numpy as np
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from memory_store import MemoryStore
+
+WORDS = ["sword", "goblin", "stranger", "tavern"]
+
+def fake_encoder(texts):
+    """One dimension per known word, normalized"""
+    vectors = np.array([[1.0 if word in text.lower() else 0.0 for word in WORDS] + [0.1] for text in texts],
+                       dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+class TestMemoryStore:
+    def test_set_like_api(self):
+        """Test that the store behaves like the set it replaces"""
+        store = MemoryStore(["Found a magical sword", "Met a mysterious stranger"], encoder=fake_encoder)
+        store.add("Found a magical sword")
+        assert len(store) == 2
+        assert "Met a mysterious stranger" in store
+        store.discard("Met a mysterious stranger")
+        store.discard("Never happened")
+        assert list(store) == ["Found a magical sword"]
+        store.clear()
+        assert len(store) == 0
+
+    def test_search_uses_matrix(self):
+        """Test that search returns the items similar to any query"""
+        store = MemoryStore(["Found a magical sword", "Defeated a goblin camp", "Met a stranger"], encoder=fake_encoder)
+        queries = fake_encoder(["Where is my sword?", "The goblin attacks"])
+        assert store.search(queries, 0.9) == {"Found a magical sword", "Defeated a goblin camp"}
+
+    def test_rows_follow_items_after_discard(self):
+        """Test that removing an item keeps every row aligned with its item"""
+        calls = []
+
+        def counting_encoder(texts):
+            calls.append(list(texts))
+            return fake_encoder(texts)
+
+        store = MemoryStore(["sword", "goblin", "stranger"], encoder=counting_encoder)
+        store.embeddings()
+        store.discard("sword")
+        store.add("tavern")
+        matrix = store.embeddings()
+        assert np.allclose(matrix, fake_encoder(list(store)))
+        # Existing rows are not encoded again
+        assert calls == [["sword", "goblin", "stranger"], ["tavern"]]
+
+    def test_discard_while_last_row_is_pending(self):
+        """Test that discarding moves a pending last row without touching the matrix"""
+        texts = [f"memory {index}" for index in range(32)]
+        store = MemoryStore(texts, encoder=fake_encoder)
+        store.embeddings()
+        store.add("new sword")
+        store.discard("memory 0")
+        assert "new sword" in store
+        assert np.allclose(store.embeddings(), fake_encoder(list(store)))
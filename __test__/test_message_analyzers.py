@@ -0,0 +1,223 @@
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import message_analyzers
+from cancellation import CancellationToken, TurnCancelled
+from message_analyzers import _Speculation, take_speculation
+
+def speculation(key=("history", "scene"), active=True, done=True):
+    """A speculation that chose an active (or inactive) character for key"""
+    result = _Speculation("spec-key")
+    result.key = key
+    result.character = SimpleNamespace(id="ragnar", active=active)
+    if done:
+        result.done.set()
+    return result
+
+class TestTakeSpeculation:
+    @pytest.fixture(autouse=True)
+    def turn_key(self, monkeypatch):
+        monkeypatch.setattr(message_analyzers, 'get_turn_key', lambda: ("history", "scene"))
+
+    def test_matching_speculation_is_used(self, monkeypatch):
+        """Test that a finished speculation for the current history is returned once"""
+        pending = speculation()
+        monkeypatch.setattr(message_analyzers, '_speculation', pending)
+        assert take_speculation() is pending
+        assert take_speculation() is None
+
+    def test_stale_key_is_dropped(self, monkeypatch):
+        """Test that a speculation for another history is cancelled and not used"""
+        stale = speculation(key=("older history", "scene"))
+        monkeypatch.setattr(message_analyzers, '_speculation', stale)
+        assert take_speculation() is None
+        assert stale.cancel_token.cancelled
+
+    def test_inactive_character_is_dropped(self, monkeypatch):
+        """Test that a speculation whose character was deactivated is not used"""
+        inactive = speculation(active=False)
+        monkeypatch.setattr(message_analyzers, '_speculation', inactive)
+        assert take_speculation() is None
+        assert inactive.cancel_token.cancelled
+
+    def test_running_speculation_is_awaited(self, monkeypatch):
+        """Test that a speculation still choosing the character is waited for"""
+        running = speculation(key=None, done=False)
+        monkeypatch.setattr(message_analyzers, '_speculation', running)
+
+        def finish():
+            running.key = ("history", "scene")
+            running.done.set()
+
+        timer = threading.Timer(0.1, finish)
+        timer.start()
+        assert take_speculation(CancellationToken()) is running
+        assert not running.cancel_token.cancelled
+        timer.join()
+
+    def test_cancel_during_wait_cancels_speculation(self, monkeypatch):
+        """Test that cancelling the turn stops the speculation it waits for"""
+        running = speculation(key=None, done=False)
+        monkeypatch.setattr(message_analyzers, '_speculation', running)
+        # The speculative calls end once their token is cancelled
+        threading.Thread(target=lambda: running.cancel_token.wait(5) and running.done.set(), daemon=True).start()
+        turn_token = CancellationToken()
+        threading.Timer(0.1, turn_token.cancel).start()
+
+        with pytest.raises(TurnCancelled):
+            take_speculation(turn_token)
+        assert running.cancel_token.cancelled
+        assert running.done.wait(timeout=5)
+
+class FakeCharacter:
+    """Character whose draft is given text, None for no reply, or an exception to raise"""
+
+    def __init__(self, char_id, draft=None, is_leader=False, events=None):
+        self.id = char_id
+        self.name = char_id.title()
+        self.is_leader = is_leader
+        self.active = True
+        self.draft = draft
+        self.events = events if events is not None else []
+
+    def draft_response(self, message_id=None, cancel_token=None, api_key=None):
+        if isinstance(self.draft, BaseException):
+            raise self.draft
+        return (SimpleNamespace(text=self.draft) if self.draft is not None else None), []
+
+    def handle_reply(self, text, function_calls=None, cancel_token=None, api_key=None):
+        self.events.append(("handle", self.id, text))
+
+@pytest.fixture
+def events(monkeypatch):
+    """Published replies and handled replies in the order they happened"""
+    events = []
+
+    def publish(character, text, message_id, cancel_token=None, api_key=None):
+        events.append(("publish", character.id, text))
+        return SimpleNamespace(sender=character.name, message=text)
+
+    monkeypatch.setattr(message_analyzers, 'publish_character_reply', publish)
+    return events
+
+def published(events):
+    return [(char_id, text) for kind, char_id, text in events if kind == "publish"]
+
+def use_characters(monkeypatch, *characters):
+    monkeypatch.setattr(message_analyzers, 'get_active_characters', lambda: {char.id: char for char in characters})
+
+class TestRunRound:
+    def test_leader_is_published_first(self, monkeypatch, events):
+        """Test that drafts are published in round order, leader first, each before it is voiced"""
+        use_characters(monkeypatch, FakeCharacter("bard", "A song!", events=events),
+                       FakeCharacter("ragnar", "Follow me!", is_leader=True, events=events))
+        message_analyzers.run_round(api_key="test-key")
+        assert events == [("publish", "ragnar", "Follow me!"), ("handle", "ragnar", "Follow me!"),
+                          ("publish", "bard", "A song!"), ("handle", "bard", "A song!")]
+
+    def test_revision_sees_earlier_replies(self, monkeypatch, events):
+        """Test that with ROUND_REVISE every reply after the first is revised against those before it"""
+        prompts = []
+
+        def revise(prompt, *args, **kwargs):
+            prompts.append(prompt)
+            return SimpleNamespace(text="A quieter song.")
+
+        monkeypatch.setattr(message_analyzers, 'ROUND_REVISE', "1")
+        monkeypatch.setattr(message_analyzers, 'generate_response', revise)
+        use_characters(monkeypatch, FakeCharacter("ragnar", "Follow me!", is_leader=True), FakeCharacter("bard", "A song!"))
+        message_analyzers.run_round(api_key="test-key")
+
+        assert published(events) == [("ragnar", "Follow me!"), ("bard", "A quieter song.")]
+        assert len(prompts) == 1
+        assert "Ragnar: Follow me!" in prompts[0]
+        assert "A song!" in prompts[0]
+
+    def test_failed_and_empty_drafts_are_skipped(self, monkeypatch, events):
+        """Test that a failed, missing or empty draft doesn't stop the others"""
+        use_characters(monkeypatch,
+                       FakeCharacter("ragnar", ValueError("model error"), is_leader=True),
+                       FakeCharacter("bard", None),
+                       FakeCharacter("rogue", ""),
+                       FakeCharacter("cleric", "Bless you."))
+        message_analyzers.run_round(api_key="test-key")
+        assert published(events) == [("cleric", "Bless you.")]
+
+    def test_cancelled_draft_cancels_round(self, monkeypatch, events):
+        """Test that TurnCancelled from a worker draft ends the round before that reply"""
+        use_characters(monkeypatch, FakeCharacter("ragnar", "Follow me!", is_leader=True), FakeCharacter("bard", TurnCancelled()))
+        with pytest.raises(TurnCancelled):
+            message_analyzers.run_round(api_key="test-key")
+        assert published(events) == [("ragnar", "Follow me!")]
+
+class TestSingleCallTurn:
+    @pytest.fixture
+    def characters(self, monkeypatch, events):
+        characters = [FakeCharacter("ragnar", is_leader=True, events=events), FakeCharacter("bard", events=events)]
+        use_characters(monkeypatch, *characters)
+        monkeypatch.setattr(message_analyzers, 'build_turn_prompt', lambda active_characters: ("rules", "history"))
+        return characters
+
+    def respond(self, monkeypatch, text):
+        monkeypatch.setattr(message_analyzers, 'generate_response', lambda *args, **kwargs: SimpleNamespace(text=text))
+
+    def test_reply_is_published_before_it_is_voiced(self, monkeypatch, characters, events):
+        """Test that the chosen character's reply is published, then handled"""
+        self.respond(monkeypatch, '{"character_id": "bard", "message": " A song! "}')
+        message_analyzers.resolve_turn_single_call(api_key="test-key")
+        assert events == [("publish", "bard", "A song!"), ("handle", "bard", "A song!")]
+
+    def test_unknown_character_falls_back_to_leader(self, monkeypatch, characters, events):
+        """Test that a reply for an unknown character id is given to the group leader"""
+        self.respond(monkeypatch, '{"character_id": "dragon", "message": "Roar"}')
+        message_analyzers.resolve_turn_single_call(api_key="test-key")
+        assert published(events) == [("ragnar", "Roar")]
+
+    def test_invalid_json_uses_analyzer(self, monkeypatch, characters, events):
+        """Test that an unparseable response falls back to the analyzer turn"""
+        fallback = []
+        monkeypatch.setattr(message_analyzers, 'decide_acting_character_for_master',
+                            lambda cancel_token=None, api_key=None: fallback.append(api_key))
+        self.respond(monkeypatch, 'The bard sings')
+        message_analyzers.resolve_turn_single_call(api_key="test-key")
+        assert fallback == ["test-key"]
+        assert events == []
+
+    def test_empty_reply_lets_character_speak(self, monkeypatch, characters, events):
+        """Test that a chosen character without a reply generates its own"""
+        processed = []
+        monkeypatch.setattr(message_analyzers, 'process_character',
+                            lambda character, cancel_token=None, api_key=None: processed.append(character.id))
+        self.respond(monkeypatch, '{"character_id": "bard", "message": "  "}')
+        message_analyzers.resolve_turn_single_call(api_key="test-key")
+        assert processed == ["bard"]
+        assert events == []
+
+def test_process_character_publishes_before_voicing(events):
+    """Test that a generated reply reaches history before its speech and tools start"""
+    character = FakeCharacter("bard", "A song!", events=events)
+    message_analyzers.process_character(character, api_key="test-key")
+    assert events == [("publish", "bard", "A song!"), ("handle", "bard", "A song!")]
+
+def test_streamed_reply_keeps_its_message_id(monkeypatch):
+    """Test that the final message reuses the id the streamed deltas were sent with"""
+    drafted, published_ids = [], []
+    character = FakeCharacter("bard", "A song!")
+    draft = character.draft_response
+
+    def draft_response(message_id=None, cancel_token=None, api_key=None):
+        drafted.append(message_id)
+        return draft(message_id, cancel_token, api_key)
+
+    character.draft_response = draft_response
+    monkeypatch.setattr(message_analyzers, 'publish_character_reply',
+                        lambda character, text, message_id, cancel_token=None, api_key=None: published_ids.append(message_id))
+    message_analyzers.process_character(character, api_key="test-key")
+    assert drafted[0]
+    assert published_ids == drafted
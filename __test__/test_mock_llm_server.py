@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import asyncio
+import random
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from mock_llm_server import LatencyModel, create_server, split_into_chunks
+
+ANALYZER_TOOLS = [{
+    "functionDeclarations": [{
+        "name": "request_character_response",
+        "parameters": {
+            "type": "OBJECT",
+            "properties": {"character_id": {"type": "STRING", "enum": ["ragnar", "elara"]}},
+            "required": ["character_id"]
+        }
+    }]
+}]
+
+def run_with_client(server, scenario):
+    async def runner():
+        async with TestClient(TestServer(server.build_app())) as client:
+            return await scenario(client)
+    return asyncio.run(runner())
+
+def request_body(text, **extra):
+    return {"contents": [{"role": "user", "parts": [{"text": text}]}], **extra}
+
+class TestLatencyModel:
+    def test_fixed_and_seeded_samples(self):
+        """Test that latency specs parse and seeded samples repeat"""
+        assert LatencyModel("fixed:0.5", random.Random()).sample() == 0.5
+        first = [LatencyModel("lognormal:-0.5,0.4", random.Random(7)).sample() for _ in range(3)]
+        second = [LatencyModel("lognormal:-0.5,0.4", random.Random(7)).sample() for _ in range(3)]
+        assert first == second
+
+    def test_invalid_spec(self):
+        """Test that an unknown distribution is rejected"""
+        with pytest.raises(ValueError):
+            LatencyModel("poisson:1", random.Random())
+
+class TestMockServer:
+    def test_function_call_for_declared_tool(self):
+        """Test that requests with tools get a function call built from the schema"""
+        async def scenario(client):
+            response = await client.post("/v1beta/models/gemini:generateContent",
+                                         json=request_body("Who acts?", tools=ANALYZER_TOOLS))
+            return await response.json()
+
+        data = run_with_client(create_server(seed=1), scenario)
+        call = data["candidates"][0]["content"]["parts"][1]["functionCall"]
+        assert call["name"] == "request_character_response"
+        assert call["args"]["character_id"] in ("ragnar", "elara")
+        assert data["usageMetadata"]["promptTokenCount"] > 0
+
+    def test_scripted_response(self, tmp_path):
+        """Test that scripted rules match against the prompt"""
+        script = tmp_path / "script.json"
+        script.write_text(json.dumps([{"match": "tavern", "text": "You see a bard."}]))
+
+        async def scenario(client):
+            response = await client.post("/v1beta/models/gemini:generateContent",
+                                         json=request_body("We enter the tavern"))
+            return await response.json()
+
+        data = run_with_client(create_server(script_path=str(script)), scenario)
+        assert data["candidates"][0]["content"]["parts"] == [{"text": "You see a bard."}]
+
+    def test_cached_content_is_part_of_prompt(self, tmp_path):
+        """Test that text registered with cachedContents is matched on later requests"""
+        script = tmp_path / "script.json"
+        script.write_text(json.dumps([{"match": "Agnir Peninsula", "text": "Lore seen"}]))
+
+        async def scenario(client):
+            created = await client.post("/v1beta/cachedContents", json={
+                "model": "models/gemini", "ttl": "600s",
+                "contents": [{"role": "user", "parts": [{"text": "The Agnir Peninsula"}]}]
+            })
+            name = (await created.json())["name"]
+            response = await client.post("/v1beta/models/gemini:generateContent",
+                                         json=request_body("Hello", cachedContent=name))
+            return await response.json()
+
+        data = run_with_client(create_server(script_path=str(script)), scenario)
+        assert data["candidates"][0]["content"]["parts"][0]["text"] == "Lore seen"
+
+    def test_stream_chunks(self):
+        """Test that streamed responses are sent as server-sent events"""
+        async def scenario(client):
+            response = await client.post("/v1beta/models/gemini:streamGenerateContent?alt=sse",
+                                         json=request_body("Hello"))
+            return await response.text()
+
+        body = run_with_client(create_server(chunk_chars=5), scenario)
+        events = [json.loads(line[len("data: "):]) for line in body.splitlines() if line.startswith("data: ")]
+        text = "".join(event["candidates"][0]["content"]["parts"][0]["text"] for event in events)
+        assert len(events) > 1
+        assert text == "Mock response 1."
+        assert "usageMetadata" in events[-1]
+
+def test_split_into_chunks_keeps_function_calls_last():
+    """Test that function calls are only sent with the last chunk"""
+    response = {"candidates": [{"content": {"parts": [
+        {"text": "abcdef"}, {"functionCall": {"name": "remember_information", "args": {}}}
+    ]}}]}
+    chunks = split_into_chunks(response, 4)
+    assert len(chunks) == 2
+    assert chunks[0]["candidates"][0]["content"]["parts"] == [{"text": "abcd"}]
+    assert chunks[1]["candidates"][0]["content"]["parts"][-1]["functionCall"]["name"] == "remember_information"
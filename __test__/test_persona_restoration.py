@@ -3,6 +3,7 @@
 import os
 import sys
 import json
+import glob
 import pytest
 
 # Add the parent directory to sys.path for imports
@@ -95,12 +96,13 @@ def test_persona_restoration():
     
     print("Persona restoration test passed!")
     
-    # Clean up test file
-    try:
-        os.remove(test_save_path)
-        print(f"Removed test file: {test_save_path}")
-    except Exception as e:
-        print(f"Could not remove test file: {str(e)}")
+    # Clean up test file and its memory and embedding sidecars
+    for path in glob.glob(f"{os.path.splitext(test_save_path)[0]}.*"):
+        try:
+            os.remove(path)
+            print(f"Removed test file: {path}")
+        except Exception as e:
+            print(f"Could not remove test file: {str(e)}")
     
     # Reset personas to original state
     set_personas(original_personas)
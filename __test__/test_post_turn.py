@@ -0,0 +1,68 @@
+import os
+import sys
+import threading
+from unittest.mock import patch
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import post_turn
+from post_turn import BackgroundQueue
+from cancellation import CancellationToken
+
+class TestBackgroundQueue:
+    def test_tasks_run_in_order(self):
+        """Test that tasks run one by one in submission order"""
+        background = BackgroundQueue("test")
+        order = []
+        with patch.object(post_turn, 'send_socket_message'):
+            for index in range(5):
+                background.submit("append", order.append, index)
+            background.join()
+        assert order == [0, 1, 2, 3, 4]
+        assert background.pending() == 0
+
+    def test_submit_does_not_wait(self):
+        """Test that submit returns while the task is still running"""
+        background = BackgroundQueue("test")
+        release = threading.Event()
+        with patch.object(post_turn, 'send_socket_message'):
+            background.submit("slow", release.wait, 5)
+            assert background.pending() == 1
+            release.set()
+            background.join()
+
+    def test_error_is_reported_and_worker_survives(self):
+        """Test that a failing task emits an error status and later tasks still run"""
+        background = BackgroundQueue("test")
+        done = []
+
+        def fail():
+            raise ValueError("scene update failed")
+
+        with patch.object(post_turn, 'send_socket_message') as send:
+            background.submit("scene", fail)
+            background.submit("tools", done.append, True)
+            background.join()
+
+        statuses = [call.args[1] for call in send.call_args_list]
+        error = next(status for status in statuses if status['status'] == 'error')
+        assert error['task'] == "scene"
+        assert error['error'] == "scene update failed"
+        assert done == [True]
+
+    def test_cancelled_tasks_are_skipped(self):
+        """Test that tasks of a cancelled turn don't run"""
+        background = BackgroundQueue("test")
+        release = threading.Event()
+        done = []
+        token = CancellationToken()
+        with patch.object(post_turn, 'send_socket_message') as send:
+            background.submit("slow", release.wait, 5)
+            background.submit("scene", done.append, True, cancel_token=token)
+            token.cancel()
+            release.set()
+            background.join()
+
+        assert done == []
+        assert any(call.args[1]['status'] == 'cancelled' for call in send.call_args_list)
@@ -0,0 +1,56 @@
+import os
+import sys
+import asyncio
+import pytest
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rate_limiter import PriorityRateLimiter, TokenBucket
+
+class TestTokenBucket:
+    def test_take_until_empty(self):
+        """Test that a bucket hands out at most capacity tokens at once"""
+        bucket = TokenBucket(rate_per_minute=60, capacity=2)
+        now = bucket.updated
+        assert bucket.try_take(now)
+        assert bucket.try_take(now)
+        assert not bucket.try_take(now)
+
+    def test_refill_over_time(self):
+        """Test that tokens refill at the configured rate"""
+        bucket = TokenBucket(rate_per_minute=60, capacity=1)
+        now = bucket.updated
+        assert bucket.try_take(now)
+        assert bucket.time_until(1, now) == pytest.approx(1.0)
+        assert bucket.try_take(now + 1.0)
+
+class TestPriorityRateLimiter:
+    def test_serves_higher_priority_first(self):
+        """Test that queued character replies go before scene updates"""
+        served = []
+        queued = []
+
+        async def scenario():
+            limiter = PriorityRateLimiter(rate_per_minute=600, capacity=1,
+                                          on_queued=lambda *args: queued.append(args))
+            await limiter.acquire("key")
+
+            async def request(stage):
+                await limiter.acquire("key", stage)
+                served.append(stage)
+
+            await asyncio.gather(request("scene"), request("tools"), request("character"))
+
+        asyncio.run(scenario())
+        assert served == ["character", "tools", "scene"]
+        assert [depth for _, _, depth, _ in queued] == [1, 2, 3]
+
+    def test_keys_have_separate_buckets(self):
+        """Test that one busy key does not block another"""
+        async def scenario():
+            limiter = PriorityRateLimiter(rate_per_minute=1, capacity=1)
+            await limiter.acquire("busy")
+            return await asyncio.wait_for(limiter.acquire("idle"), timeout=1)
+
+        assert asyncio.run(scenario()) == 0.0
@@ -0,0 +1,35 @@
+import os
+import sys
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scene_state import SceneState
+
+class TestSceneState:
+    def test_free_text_renders_unchanged(self):
+        """Test that a scene set as text is rendered back as the same text"""
+        assert SceneState(description="You are in the tavern of the city of Kadera.").render() == \
+            "You are in the tavern of the city of Kadera."
+
+    def test_move_clears_old_place(self):
+        """Test that moving drops the description, objects and characters of the old place"""
+        state = SceneState(description="Old tavern", objects=["a fireplace"], characters=["Innkeeper"])
+        assert state.apply({"op": "move", "location": "Kadera", "area": "market square"})
+        assert state.render() == "You are in Kadera, market square."
+
+    def test_objects_are_added_once_and_removed_by_name(self):
+        """Test that add is idempotent and remove ignores case"""
+        state = SceneState(location="Kadera")
+        assert state.apply({"op": "add_object", "name": "a wooden chest"})
+        assert not state.apply({"op": "add_object", "name": "A wooden chest"})
+        assert state.apply({"op": "add_character", "name": "Bard"})
+        assert state.render() == "You are in Kadera.\nHere you can see:\n- a wooden chest\nAlso here: Bard."
+        assert state.apply({"op": "remove_object", "name": "A Wooden Chest"})
+        assert not state.apply({"op": "remove_character", "name": "Guard"})
+        assert state.objects == []
+
+    def test_round_trip(self):
+        """Test that to_dict and from_dict keep every field"""
+        state = SceneState("Kadera", "tavern", ["a bard"], ["Innkeeper"], "Smoky")
+        assert SceneState.from_dict(state.to_dict()).to_dict() == state.to_dict()
@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from single_flight import SingleFlight
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_result(self):
+        """Test that callers joining an in-flight key don't run the function again"""
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def turn():
+            calls.append(1)
+            started.set()
+            release.wait(timeout=5)
+            return "reply"
+
+        leader = threading.Thread(target=lambda: results.append(flight.do("history", turn)))
+        leader.start()
+        assert started.wait(timeout=5)
+        follower = threading.Thread(target=lambda: results.append(flight.do("history", turn)))
+        follower.start()
+        assert flight._calls["history"].has_joiners.wait(timeout=5)
+        release.set()
+        leader.join(timeout=5)
+        follower.join(timeout=5)
+        assert not leader.is_alive() and not follower.is_alive()
+
+        assert len(calls) == 1
+        assert sorted(results, key=lambda result: result[1]) == [("reply", False), ("reply", True)]
+
+    def test_sequential_calls_run_again(self):
+        """Test that a finished call does not swallow the next one"""
+        flight = SingleFlight()
+        calls = []
+        flight.do("history", lambda: calls.append(1))
+        flight.do("history", lambda: calls.append(1))
+        assert len(calls) == 2
+        assert not flight.in_flight("history")
+
+    def test_errors_are_shared(self):
+        """Test that joined callers see the leader's exception"""
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        errors = []
+
+        def failing_turn():
+            calls.append(1)
+            started.set()
+            release.wait(timeout=5)
+            raise ValueError("analyzer failed")
+
+        def call():
+            try:
+                flight.do("history", failing_turn)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        assert started.wait(timeout=5)
+        follower = threading.Thread(target=call)
+        follower.start()
+        assert flight._calls["history"].has_joiners.wait(timeout=5)
+        release.set()
+        leader.join(timeout=5)
+        follower.join(timeout=5)
+        assert not leader.is_alive() and not follower.is_alive()
+
+        assert len(calls) == 1
+        assert len(errors) == 2
+        assert errors[0] is errors[1]
+        assert not flight.in_flight("history")
@@ -0,0 +1,69 @@
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from turn_selector import embedding_scores, name_scores, select_acting_character
+
+def make_character(char_id, name, race, char_class):
+    return SimpleNamespace(id=char_id, name=name, race=race, char_class=char_class, personality="", intentions=[])
+
+def make_message(text, character_id="0"):
+    return SimpleNamespace(message=text, character_id=character_id)
+
+CHARACTERS = [
+    make_character("ragnar", "Ragnar Ironfist", "Dwarf", "Fighter"),
+    make_character("elara", "Elara", "Elf", "Wizard"),
+    make_character("finn", "Finn", "Human", "Rogue"),
+]
+
+class TestTurnSelector:
+    def test_direct_address_selects_character(self):
+        """Test that naming a character picks it without the analyzer"""
+        history = [make_message("Ragnar, the door is locked. What do you do?")]
+        assert select_acting_character(history, CHARACTERS, embed=None).id == "ragnar"
+
+    def test_unique_class_alias(self):
+        """Test that a class shared by nobody else identifies the character"""
+        scores = name_scores("The wizard feels a strange pull", CHARACTERS)
+        assert scores == {"ragnar": 0.0, "elara": 0.6, "finn": 0.0}
+
+    def test_two_names_are_left_to_the_analyzer(self):
+        """Test that an ambiguous message returns None"""
+        history = [make_message("Elara and Finn hear footsteps")]
+        assert select_acting_character(history, CHARACTERS, embed=None) is None
+
+    def test_no_mention_is_left_to_the_analyzer(self):
+        """Test that a message addressing nobody returns None"""
+        history = [make_message("The rain keeps falling")]
+        assert select_acting_character(history, CHARACTERS, embed=None) is None
+
+    def test_speaker_does_not_answer_themselves(self):
+        """Test that a character naming itself is not chosen to reply"""
+        history = [make_message("I, Finn, will scout ahead", character_id="finn")]
+        assert select_acting_character(history, CHARACTERS, embed=None) is None
+
+    def test_name_is_matched_as_a_word(self):
+        """Test that names inside other words don't count"""
+        assert name_scores("Finnish soldiers", CHARACTERS)["finn"] == 0.0
+
+def test_embedding_scores_use_cached_encoder():
+    """Test that profiles are embedded through the cached batch encoder"""
+    calls = []
+
+    def encode_many(texts):
+        calls.append(texts)
+        return np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0], [0.6, 0.8]], dtype=np.float32)[:len(texts)]
+
+    with patch.dict(sys.modules, {"vector_compare": SimpleNamespace(encode_many=encode_many)}):
+        scores = embedding_scores("Someone casts a spell", CHARACTERS)
+    assert len(calls) == 1
+    assert calls[0][0] == "Someone casts a spell"
+    assert calls[0][1].startswith("Ragnar Ironfist")
+    assert scores == {"ragnar": 1.0, "elara": 0.0, "finn": pytest.approx(0.6)}
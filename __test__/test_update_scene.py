@@ -0,0 +1,92 @@
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import update_scene
+from update_scene import SceneUpdateBatcher, get_current_scene, set_current_scene
+from ai_utils import FunctionCall, run_tools
+from post_turn import post_turn_queue
+from cancellation import CancellationToken
+
+class TestSceneUpdateBatcher:
+    def run_batches(self, batcher, messages):
+        with patch.object(update_scene, '_apply_scene_update') as apply, \
+             patch('post_turn.send_socket_message'):
+            for sender, message, token, *api_key in messages:
+                batcher.add(sender, message, token, *api_key)
+            batcher.flush()
+            post_turn_queue.join()
+        return apply
+
+    def test_messages_are_coalesced(self):
+        """Test that messages within the window share one scene update"""
+        batcher = SceneUpdateBatcher(delay=60, max_messages=10, gate=lambda message: True)
+        apply = self.run_batches(batcher, [("Ragnar", "We go north", None), ("Elara", "I follow", None)])
+        apply.assert_called_once()
+        assert apply.call_args.args[0] == "Ragnar: We go north\nElara: I follow"
+
+    def test_full_batch_is_flushed_early(self):
+        """Test that reaching max_messages starts an update without waiting"""
+        batcher = SceneUpdateBatcher(delay=60, max_messages=2, gate=lambda message: True)
+        apply = self.run_batches(batcher, [("Ragnar", "One", None), ("Elara", "Two", None), ("Finn", "Three", None)])
+        assert [call.args[0] for call in apply.call_args_list] == ["Ragnar: One\nElara: Two", "Finn: Three"]
+
+    def test_gate_and_cancelled_turns_skip_messages(self):
+        """Test that irrelevant messages and cancelled turns don't reach the LLM"""
+        cancelled = CancellationToken()
+        cancelled.cancel()
+        batcher = SceneUpdateBatcher(delay=60, max_messages=10, gate=lambda message: "north" in message)
+        apply = self.run_batches(batcher, [("Ragnar", "Nice weather", None), ("Elara", "We go north", cancelled)])
+        apply.assert_not_called()
+
+    def test_update_uses_session_key(self):
+        """Test that the update runs with the key stored with the latest message"""
+        batcher = SceneUpdateBatcher(delay=60, max_messages=10, gate=lambda message: True)
+        apply = self.run_batches(batcher, [("Ragnar", "We go north", None, "key-a"), ("Elara", "I follow", None, "key-b")])
+        assert apply.call_args.args[2] == "key-b"
+
+def test_schedule_captures_request_key():
+    """Test that scheduling stores the caller's key, the timer thread has no request context"""
+    with patch.object(update_scene, 'get_request_api_key', return_value="session-key"), \
+         patch.object(update_scene.scene_batcher, 'add') as add:
+        update_scene.schedule_scene_update("Ragnar", "We go north")
+        update_scene.schedule_scene_update("Elara", "I follow", api_key="explicit-key")
+    assert [call.args[3] for call in add.call_args_list] == ["session-key", "explicit-key"]
+
+def test_patches_update_current_scene():
+    """Test that function calls from the scene request are applied as patches"""
+    def fake_generate_response(prompt, tools=None, **kwargs):
+        run_tools([FunctionCall(name="move_to", args={"location": "Kadera", "area": "market"}),
+                   FunctionCall(name="add_object", args={"name": "a fruit stall"})], tools)
+
+    set_current_scene("You are in the tavern.")
+    with patch.object(update_scene, 'generate_response', side_effect=fake_generate_response), \
+         patch.object(update_scene, 'send_socket_message') as send:
+        update_scene.do_update_scene("Ragnar", "We walk to the market")
+
+    assert get_current_scene() == "You are in Kadera, market.\nHere you can see:\n- a fruit stall"
+    updated = next(call.args[1] for call in send.call_args_list if call.args[0] == 'scene_updated')
+    assert [change["op"] for change in updated['patch']] == ["move", "add_object"]
+
+def test_scene_relevance_uses_cached_encoder():
+    """Test that the message and the scene change examples are embedded in one cached batch"""
+    calls = []
+
+    def encode_many(texts):
+        calls.append(texts)
+        vectors = np.zeros((len(texts), 2), dtype=np.float32)
+        vectors[:, 1] = 1.0
+        vectors[0] = [0.8, 0.6]
+        vectors[-1] = [1.0, 0.0]
+        return vectors
+
+    with patch.dict(sys.modules, {"vector_compare": SimpleNamespace(encode_many=encode_many)}):
+        relevance = update_scene.scene_relevance("We ride to the castle.")
+    assert calls == [update_scene.SCENE_CHANGE_EXAMPLES + ["We ride to the castle."]]
+    assert abs(relevance - 0.8) < 1e-6
@@ -1,24 +1,140 @@
 import os
 import time
-from collections import deque
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+from contextlib import contextmanager
+import httpx
 from google import genai
-from flask import request
+from flask import request, has_request_context
 from logger_config import setup_logger
 from google.genai.types import FunctionCall
 from app_socket import send_socket_message
+from rate_limiter import PriorityRateLimiter
+from llm_cache import LLM_CACHE, CachedResponse, get_stage_ttl, make_cache_key, response_cache
+from context_cache import CONTEXT_CACHE, context_caches
+from llm_metrics import CallRecord, llm_metrics, prompt_length
+from cancellation import CancellationToken, TurnCancelled
 
 # Setup logger
 logger = setup_logger(__name__)
 
-# Track the timestamps of recent API calls
-_request_timestamps: deque[float] = deque(maxlen=10)
-
 # Dictionary to store user-specific API keys
 api_keys: dict[str, str] = {}
 
 # Default API key from environment
 DEFAULT_GEMINI_API_KEY = None
 PREVENT_LLM_CALLS = os.getenv("PREVENT_LLM_CALLS", "")
+GEMINI_MODEL = 'gemini-2.5-flash-preview-04-17'
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "http://localhost:3069")
+CLIENT_POOL_MAX_SIZE = int(os.getenv("GEMINI_CLIENT_POOL_SIZE", "16"))
+CLIENT_IDLE_TIMEOUT = float(os.getenv("GEMINI_CLIENT_IDLE_TIMEOUT", "300"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "14"))
+LLM_BURST = int(os.getenv("LLM_BURST", "5"))
+LLM_METRICS_DEBUG = os.getenv("LLM_METRICS_DEBUG", "")
+
+# Event loop running all LLM requests, started lazily in a background thread
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+_key_semaphores: dict[str, asyncio.Semaphore] = {}
+
+class _PooledClient:
+    def __init__(self, client: genai.Client):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.leases = 0
+        self.evicted = False
+
+    def close(self):
+        # Older SDK versions have no close(); dropping the reference is enough there
+        close = getattr(self.client, "close", None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                logger.warning(f"Error closing Gemini client: {e}")
+
+class ClientPool:
+    """Reusable Gemini clients keyed by API key.
+
+    Clients keep their HTTP connections alive between calls. A client that has
+    been idle longer than idle_timeout is closed, and when more than max_size keys
+    are pooled the least recently used one is evicted. Evicted clients that are
+    still in use are closed once their last lease is released.
+    """
+
+    def __init__(self, max_size=CLIENT_POOL_MAX_SIZE, idle_timeout=CLIENT_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._entries: OrderedDict[str, _PooledClient] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _create_client(self, api_key) -> genai.Client:
+        limits = httpx.Limits(max_keepalive_connections=10, keepalive_expiry=self.idle_timeout)
+        return genai.Client(api_key=api_key, http_options={
+            "base_url": GEMINI_BASE_URL,
+            "client_args": {"limits": limits},
+            "async_client_args": {"limits": limits},
+        })
+
+    def _evict_entry(self, api_key):
+        # Must be called with the lock held
+        entry = self._entries.pop(api_key, None)
+        if entry is None:
+            return
+        entry.evicted = True
+        if entry.leases == 0:
+            entry.close()
+
+    def _evict_idle(self, now):
+        idle_keys = [key for key, entry in self._entries.items()
+                     if entry.leases == 0 and now - entry.last_used > self.idle_timeout]
+        for key in idle_keys:
+            self._evict_entry(key)
+
+    @contextmanager
+    def lease(self, api_key):
+        """Borrow the pooled client for api_key for the duration of a call"""
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+            entry = self._entries.get(api_key)
+            if entry is None:
+                entry = _PooledClient(self._create_client(api_key))
+                self._entries[api_key] = entry
+            self._entries.move_to_end(api_key)
+            entry.leases += 1
+            entry.last_used = now
+            while len(self._entries) > self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._evict_entry(oldest_key)
+        try:
+            yield entry.client
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                entry.last_used = time.monotonic()
+                if entry.evicted and entry.leases == 0:
+                    entry.close()
+
+    def evict(self, api_key):
+        """Drop the pooled client for api_key"""
+        with self._lock:
+            self._evict_entry(api_key)
+
+    def clear(self):
+        """Drop every pooled client"""
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self._evict_entry(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+client_pool = ClientPool()
 
 def set_default_api_key(api_key):
     global DEFAULT_GEMINI_API_KEY
@@ -31,14 +147,24 @@ def get_current_api_key():
 
 def update_api_key(session_id, api_key):
     """Update the API key for a session"""
+    old_api_key = api_keys.get(session_id)
     api_keys[session_id] = api_key
     logger.info(f"Updated API key for session {session_id}")
+    _release_unused_key(old_api_key)
 
 def remove_api_key(session_id):
     """Remove the API key for a session when it disconnects"""
     if session_id in api_keys:
-        del api_keys[session_id]
+        api_key = api_keys.pop(session_id)
         logger.info(f"Removed API key for session {session_id}")
+        _release_unused_key(api_key)
+
+def _release_unused_key(api_key):
+    """Evict the pooled client for a key no session or the server default uses anymore"""
+    if api_key and api_key != DEFAULT_GEMINI_API_KEY and api_key not in api_keys.values():
+        client_pool.evict(api_key)
+        # Context cache entries are only touched from the gateway loop
+        _get_loop().call_soon_threadsafe(context_caches.forget_api_key, api_key)
 
 def run_tools(function_calls: list[FunctionCall], tools):# Handle function calling responses
     for part in function_calls:
@@ -50,105 +176,283 @@ def run_tools(function_calls: list[FunctionCall], tools):# Handle function calli
         
         # Create a map of function names to their actual functions
         name_to_func = {func_tuple[0].__name__: func_tuple[0] for func_tuple in tools}
+        # Declared names can differ from the Python names (addIntention -> add_intention)
+        for func, declaration in tools:
+            for function_declaration in getattr(declaration, "function_declarations", None) or []:
+                name_to_func[function_declaration.name] = func
         
         # Find and execute the function
         if function_name in name_to_func:
             logger.info(f"Executing function: {function_name} with args: {args}")
             name_to_func[function_name](**args)
 
-def generate_response(prompt, temperature=0.5, tools=None, api_key=None, defer_tools=False, loggerOn=False):
+def _notify_rate_limit(api_key, stage, queue_depth, eta):
+    logger.info(f"Rate limit reached, {queue_depth} request(s) queued, {stage} request waits ~{eta:.2f} seconds")
+    send_socket_message('rate_limit_reached', {
+        'wait_time': eta,
+        'queue_depth': queue_depth,
+        'eta': eta,
+        'stage': stage
+    })
+
+# Token buckets per API key; queued requests are served by stage priority
+rate_limiter = PriorityRateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_BURST, on_queued=_notify_rate_limit)
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Return the gateway event loop, starting its background thread on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="llm-gateway", daemon=True)
+            thread.start()
+    return _loop
+
+def _get_key_semaphore(api_key) -> asyncio.Semaphore:
+    # Only called from the gateway loop, so no extra locking is needed
+    semaphore = _key_semaphores.get(api_key)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _key_semaphores[api_key] = semaphore
+    return semaphore
+
+def _resolve_api_key(api_key):
+    """Use the given key, the current session's key, or the default key"""
+    if api_key is not None:
+        return api_key
+    if has_request_context():
+        return get_current_api_key()
+    return DEFAULT_GEMINI_API_KEY
+
+def get_request_api_key():
+    """The key a request made now would use; resolve it before handing work to another thread"""
+    return _resolve_api_key(None)
+
+def _build_config(temperature, tools, cached_content=None, response_schema=None):
+    """Configure generation based on whether tools are provided"""
+    # Structured output: the reply is a JSON document matching the schema
+    structured = {"response_mime_type": "application/json", "response_schema": response_schema} if response_schema else {}
+    if tools and not cached_content:
+        # Extract the function declarations for the API
+        function_declarations = [tool_tuple[1] for tool_tuple in tools]
+        
+        return genai.types.GenerateContentConfig(
+            temperature=temperature,
+            top_p=0.95,
+            top_k=40,
+            tools=function_declarations,
+            **structured
+        )
+    # Standard text generation without tools, or with tools stored in the cached context
+    return genai.types.GenerateContentConfig(
+        temperature=temperature,
+        top_p=0.95,
+        top_k=40,
+        cached_content=cached_content,
+        **structured
+    )
+
+class StreamedResponse:
+    """Response assembled from streamed chunks, exposing the fields callers read"""
+
+    def __init__(self):
+        self._text_parts: list[str] = []
+        self.function_calls: list[FunctionCall] | None = None
+        self.usage_metadata = None
+        self.candidates = []
+
+    @property
+    def text(self):
+        return "".join(self._text_parts) if self._text_parts else None
+
+    def add_chunk(self, chunk):
+        """Append a chunk and return its text delta"""
+        delta = None
+        for candidate in chunk.candidates or []:
+            for part in (candidate.content.parts if candidate.content else None) or []:
+                if part.text:
+                    delta = (delta or "") + part.text
+                if part.function_call:
+                    self.function_calls = (self.function_calls or []) + [part.function_call]
+        if delta:
+            self._text_parts.append(delta)
+        if chunk.usage_metadata:
+            self.usage_metadata = chunk.usage_metadata
+        if chunk.candidates:
+            self.candidates = chunk.candidates
+        return delta
+
+def _finish_response(response, tools, defer_tools):
+    """Run the returned function calls unless the caller deferred them"""
+    if tools and not defer_tools and response.function_calls:
+        run_tools(response.function_calls, tools)
+    return response
+
+async def generate_response_async(prompt, temperature=0.5, tools=None, api_key=None, defer_tools=False, loggerOn=False, stage=None, on_delta=None, cache=None, static_prefix=None, cache_owner=None, response_schema=None):
     """
-    Generate a response using the Gemini model.
+    Generate a response using the Gemini model without blocking a thread.
+    
+    Each API key has a token bucket of LLM_REQUESTS_PER_MINUTE; requests
+    waiting for a token are queued by stage priority. At most
+    LLM_MAX_CONCURRENCY requests per API key are in flight at once.
+    Cancelling the awaiting task aborts the HTTP request.
     
     Args:
         prompt: The text prompt to send to the model
         tools: A list of (function, declaration) tuples to make available to the model (optional)
         api_key: The Gemini API key to use for this request (optional)
+        defer_tools: Return function calls without running them
+        stage: Pipeline stage label (character, analyzer, tools, scene) used for queue priority
+        on_delta: Stream the response and call on_delta(text) for every text chunk (optional)
+        cache: Look up and store the response in the LLM response cache; by default
+            only when LLM_CACHE is set and the stage has a TTL (optional)
+        static_prefix: Unchanging start of the prompt. With CONTEXT_CACHE set it is
+            registered once as a server-side cached context for cache_owner and only
+            prompt is sent; otherwise it is prepended to prompt (optional)
+        cache_owner: Identifies whose prefix this is, e.g. a character id (optional)
+        response_schema: Ask for a JSON reply matching this Schema; read it from response.text (optional)
     
     Returns:
-        The generated text response or function call result
-    
-    Raises:
-        RateLimitError: If rate limit is reached and wait=False
+        The Gemini response, or a StreamedResponse when on_delta is given
     """
 
     if PREVENT_LLM_CALLS:
         raise Exception("LLM calls are prevented")
 
-    # If no API key is provided, get it from the current session
-    if api_key is None:
-        api_key = get_current_api_key()
+    api_key = _resolve_api_key(api_key)
         
     # Log the input prompt
     if loggerOn:
         logger.info(f"Input prompt: {prompt}..." if len(prompt) > 100 else f"Input prompt: {prompt}")
-    
-    # Check if we've hit the rate limit (14 requests per minute)
-    current_time = time.time()
-    if len(_request_timestamps) >= 14:
-        # If the oldest request is less than 60 seconds old, we've hit the limit
-        time_since_oldest = current_time - _request_timestamps[0]
-        if time_since_oldest < 60:
-            sleep_time = 60 - time_since_oldest
-            if loggerOn:
-                logger.info(f"Rate limit reached, waiting for {sleep_time:.2f} seconds")
-            
-            # Emit rate limit reached event if socketio is available
-            send_socket_message('rate_limit_reached', {'wait_time': sleep_time})
-            
-            time.sleep(sleep_time)
-    
-    # Add the current timestamp to our tracking
-    _request_timestamps.append(current_time)
-    
-    # Create a client with the provided API key
-    if loggerOn:
-        logger.info("Using API key for this request")
-    
-    client = genai.Client(api_key=api_key, http_options={"base_url": "http://localhost:3069"})
-    
-    # Make the API call
-    if loggerOn:
-        print("sending request")
-    
-    # Configure generation based on whether tools are provided
-    config = None
-    if tools:
-        # Extract the function declarations for the API
-        function_declarations = [tool_tuple[1] for tool_tuple in tools]
-        
-        config = genai.types.GenerateContentConfig(
-            temperature=temperature,
-            top_p=0.95,
-            top_k=40,
-            tools=function_declarations
-        )
+
+    full_prompt = static_prefix + prompt if static_prefix else prompt
+
+    # Serve repeated deterministic prompts from the cache
+    cache_ttl = get_stage_ttl(stage)
+    use_cache = cache if cache is not None else bool(LLM_CACHE) and cache_ttl is not None
+    cache_key = make_cache_key(GEMINI_MODEL, full_prompt, temperature, tools, response_schema) if use_cache else None
+
+    started = time.perf_counter()
+    queue_wait = 0.0
+    response = None
+    cache_hit = False
+    failed = False
+    try:
+        if cache_key:
+            response = await response_cache.get_async(cache_key, cache_ttl if cache_ttl is not None else float("inf"))
+            cache_hit = response is not None
+        if not cache_hit:
+            # Wait for a rate limit token, higher priority stages are served first
+            queue_wait = await rate_limiter.acquire(api_key, stage)
+            response = await _call_model(api_key, prompt, full_prompt, temperature, tools, on_delta,
+                                         static_prefix, cache_owner or stage or "default", loggerOn, response_schema)
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _record_metrics(stage, time.perf_counter() - started, queue_wait, full_prompt, response, cache_hit, failed)
+
+    if cache_hit:
+        if loggerOn:
+            logger.info(f"Cached response: {response.text}")
+        if on_delta and response.text:
+            on_delta(response.text)
     else:
-        # Standard text generation without tools
-        config = genai.types.GenerateContentConfig(
-            temperature=temperature,
-            top_p=0.95,
-            top_k=40,
-        )
-        
-    response = client.models.generate_content(
-        model='gemini-2.5-flash-preview-04-17',
-        contents=prompt,
-        config=config
-    )
-    
-    if loggerOn:
-        logger.info(f"Output response: {response.candidates[0].content}")
+        if loggerOn:
+            logger.info(f"Output response: {response.text if on_delta else response.candidates[0].content}")
+        if cache_key and (response.text or response.function_calls):
+            await response_cache.put_async(cache_key, CachedResponse.from_response(response))
 
     # Process the response
-    if not tools:
-        return response
+    return _finish_response(response, tools, defer_tools)
 
-    text = response.text
+async def _call_model(api_key, prompt, full_prompt, temperature, tools, on_delta, static_prefix, cache_owner, loggerOn, response_schema=None):
+    """Send the request once a concurrency slot for the key is free"""
+    async with _get_key_semaphore(api_key):
+        # Make the API call
+        if loggerOn:
+            print("sending request")
 
-    if defer_tools:
-        return response
-    else:
-        if response.function_calls:
-            run_tools(response.function_calls, tools)
-        return response
\ No newline at end of file
+        # Reuse the pooled client for this API key
+        with client_pool.lease(api_key) as client:
+            # Send only the dynamic part when the static prefix is cached server-side
+            cached_content = None
+            if static_prefix and CONTEXT_CACHE:
+                function_declarations = [tool_tuple[1] for tool_tuple in tools] if tools else None
+                cached_content = await context_caches.get_cache_name(
+                    client, api_key, cache_owner, GEMINI_MODEL, static_prefix, function_declarations)
+            contents = prompt if cached_content else full_prompt
+            config = _build_config(temperature, tools, cached_content, response_schema)
+
+            if not on_delta:
+                return await client.aio.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=contents,
+                    config=config
+                )
+
+            response = StreamedResponse()
+            stream = await client.aio.models.generate_content_stream(
+                model=GEMINI_MODEL,
+                contents=contents,
+                config=config
+            )
+            async for chunk in stream:
+                delta = response.add_chunk(chunk)
+                if delta:
+                    on_delta(delta)
+            return response
+
+def _record_metrics(stage, wall_time, queue_wait, prompt, response, cache_hit, failed):
+    usage = getattr(response, "usage_metadata", None)
+    record = CallRecord(
+        stage or "default",
+        wall_time,
+        queue_wait,
+        prompt_length(prompt),
+        input_tokens=usage.prompt_token_count if usage else None,
+        output_tokens=usage.candidates_token_count if usage else None,
+        cached_tokens=usage.cached_content_token_count if usage else None,
+        cache_hit=cache_hit,
+        error=failed
+    )
+    llm_metrics.record(record)
+    if LLM_METRICS_DEBUG:
+        send_socket_message('llm_call_metrics', record.to_dict())
+
+def submit_generate_response(prompt, temperature=0.5, tools=None, api_key=None, defer_tools=False, loggerOn=False, **kwargs) -> Future:
+    """
+    Start generate_response_async on the gateway loop from synchronous code.
+    
+    Takes the same arguments as generate_response_async, the ones after
+    loggerOn as keywords. Returns a concurrent.futures.Future, so several
+    requests can run at the same time. Calling cancel() on it aborts the
+    request.
+    """
+    # Resolve the key here, the gateway loop has no request context
+    api_key = _resolve_api_key(api_key)
+    coroutine = generate_response_async(prompt, temperature, tools, api_key, defer_tools, loggerOn, **kwargs)
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+
+def generate_response(prompt, temperature=0.5, tools=None, api_key=None, defer_tools=False, loggerOn=False, *, cancel_token: CancellationToken | None = None, **kwargs):
+    """
+    Generate a response using the Gemini model.
+    
+    Synchronous shim over generate_response_async that blocks until the
+    response arrives. Takes the same arguments, the ones after loggerOn
+    (stage, on_delta, cache, static_prefix, cache_owner, response_schema) as
+    keywords. Cancelling cancel_token aborts the request and raises
+    TurnCancelled.
+    
+    Returns:
+        The generated text response or function call result
+    """
+    if cancel_token:
+        cancel_token.raise_if_cancelled()
+    future = submit_generate_response(prompt, temperature, tools, api_key, defer_tools, loggerOn, **kwargs)
+    if not cancel_token:
+        return future.result()
+    try:
+        return cancel_token.track(future).result()
+    except CancelledError:
+        raise TurnCancelled()
@@ -2,6 +2,7 @@ import os
 import time
 from flask import request, jsonify, url_for
 from app_socket import send_socket_message, app
+from memory_retrieval import validate_settings
 from character import Character, get_character_by_id, get_characters, set_characters, set_character_active, update_character
 
 def format_character_for_socket(character):
@@ -329,6 +330,19 @@ def register_character_socket_handlers(socketio):
             send_socket_response(request_id, response)
             return
         
+        # Reject invalid memory settings before changing any character,
+        # a bad value would otherwise break memory retrieval on every turn
+        for char_id, char_data in new_characters.items():
+            if 'memory_settings' in char_data:
+                try:
+                    char_data['memory_settings'] = validate_settings(char_data['memory_settings'])
+                except ValueError as e:
+                    send_socket_response(request_id, {
+                        'status': 'error',
+                        'error': f"Invalid memory settings for '{char_id}': {e}"
+                    })
+                    return
+
         # Get current characters dictionary
         characters = get_characters()
         
@@ -387,6 +401,10 @@ def register_character_socket_handlers(socketio):
         if 'skill_proficiencies' in char_data:
             character.skill_proficiencies = char_data['skill_proficiencies']
         
+        # Memory settings were validated by handle_update_characters
+        if 'memory_settings' in char_data:
+            character.memory_settings = char_data['memory_settings']
+        
         # Update hp values using class methods to ensure proper constraints
         if 'max_hp' in char_data:
             character.set_max_hp(char_data['max_hp'])
@@ -416,7 +434,8 @@ def register_character_socket_handlers(socketio):
             wisdom=ability_scores.get('wisdom', 10),
             charisma=ability_scores.get('charisma', 10),
             active=char_data.get('active', True),
-            voice_id=char_data.get('voice_id')
+            voice_id=char_data.get('voice_id'),
+            memory_settings=char_data.get('memory_settings')
         )
         
         # Set additional attributes
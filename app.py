@@ -9,11 +9,14 @@ from base_lore import get_base_lore, set_base_lore
 from dialog_history import DialogueMessage, append_to_dialog_history, get_dialogue_history, set_dialog_history
 from game_state import game_state
 from app_socket import send_socket_message, app, socketio
-from message_analyzers import decide_acting_character_for_master
+from message_analyzers import cancel_turn, continue_round, continue_turn, speculate_turn
 from update_scene import get_current_scene, set_current_scene
 from character import get_characters
 from gm_persona import get_personas, get_persona_by_id, create_persona, remove_persona, toggle_favorite, set_default_persona, get_default_persona, persona_manager
 from ai_utils import set_default_api_key, update_api_key, remove_api_key, generate_response
+from llm_cache import get_cache_stats
+from llm_metrics import get_llm_metrics, llm_metrics
+from embedding_cache import get_embedding_cache_stats
 from tts_manager import tts
 from api.characters_router import emit_characters_updated, register_character_rest_api, register_character_socket_handlers, send_socket_response
 import base64
@@ -112,6 +115,9 @@ def handle_gm_message(data):
                 
                 # Emit new message event
                 send_socket_message('new_message', gm_message.to_dict())
+
+                # Work on the next turn while the GM decides what to do
+                speculate_turn()
     
     except Exception as e:
         print(f"Error in handle_gm_message: {e}")
@@ -120,11 +126,28 @@ def handle_gm_message(data):
 def handle_gm_continue():
     send_socket_message('thinking_started')
     try:
-        decide_acting_character_for_master()
+        # Returns once the reply is published, tools and scene update run in post_turn queues
+        continue_turn()
     finally:
         send_socket_message('thinking_ended')
         
 
+@socketio.on('gm_round')
+def handle_gm_round(data=None):
+    """Let every active character (or the given character_ids) reply once"""
+    character_ids = (data or {}).get('character_ids')
+    send_socket_message('thinking_started')
+    try:
+        continue_round(character_ids)
+    finally:
+        send_socket_message('thinking_ended')
+
+@socketio.on('cancel_turn')
+def handle_cancel_turn():
+    """Stop the running turn, its LLM requests, scene update and speech"""
+    cancelled = cancel_turn()
+    send_socket_message('turn_cancelled', {'cancelled': cancelled})
+
 @socketio.on('update_api_key')
 def handle_update_api_key(data):
     api_key = data.get('api_key')
@@ -317,6 +340,40 @@ def emit_tts_voices():
         'voices': tts.get_available_voices()
     })
 
+@app.route('/api/llm_cache', methods=['GET'])
+def get_llm_cache_stats():
+    """Get LLM response cache hit/miss counters"""
+    return jsonify({
+        "status": "success",
+        "cache": get_cache_stats()
+    })
+
+def get_metrics_data():
+    """Collect LLM telemetry per stage and cache counters"""
+    return {
+        'llm': get_llm_metrics(),
+        'recent_calls': llm_metrics.recent(20),
+        'cache': get_cache_stats(),
+        'embedding_cache': get_embedding_cache_stats()
+    }
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Get per-stage LLM latency, queue wait, prompt size and token percentiles"""
+    return jsonify({
+        "status": "success",
+        "metrics": get_metrics_data()
+    })
+
+@socketio.on('get_llm_metrics')
+def handle_get_llm_metrics(data=None):
+    """Debug event: send the current LLM telemetry to the client"""
+    request_id = data.get('requestId') if data else None
+    if request_id:
+        send_socket_response(request_id, get_metrics_data())
+    else:
+        send_socket_message('llm_metrics', get_metrics_data())
+
 # New routes for GM Personas
 
 @app.route('/api/get_personas', methods=['GET'])
@@ -672,7 +729,8 @@ def handle_voice_transcription(data):
                         data=audio_bytes,
                         mime_type=mime_type
                     )
-                ]
+                ],
+                stage="transcription"
             )
             
             # Notify client that thinking has stopped
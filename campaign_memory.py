@@ -0,0 +1,184 @@
+"""
+Campaign memory: one deduplicated pool of memories for the whole party.
+
+Every memory text is stored and embedded once, together with the ids of the
+characters who know it, the order it was added in and its importance.
+Characters see the pool through a MemoryView, which keeps the set-like API of
+their old per-character store. Recall scores the pool once per set of recent
+messages and the result is shared by every character prompt until the
+messages or the pool change; memory_retrieval ranks it per character.
+"""
+
+import threading
+from collections import Counter
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from memory_retrieval import rank_memories, resolve_settings
+from memory_store import MemoryStore, _default_encoder
+
+DEFAULT_IMPORTANCE = 0.5
+
+class CampaignMemory:
+    def __init__(self, encoder: Optional[Callable[[list[str]], np.ndarray]] = None):
+        self._encoder = encoder or _default_encoder
+        self.store = MemoryStore(encoder=self._encoder)
+        # Memory text -> ids of the characters who know it
+        self._visibility: dict[str, set[str]] = {}
+        self._counts: Counter = Counter()
+        # Memory text -> position in the order memories were added
+        self._added: dict[str, int] = {}
+        self._importance: dict[str, float] = {}
+        self._sequence = 0
+        self._lock = threading.RLock()
+        self._version = 0
+        self._recalled = None
+
+    def add(self, item: str, character_ids: Iterable[str], importance: Optional[float] = None):
+        """Add a memory, or share an existing one, with the given characters"""
+        with self._lock:
+            known_by = self._visibility.get(item)
+            if known_by is None:
+                known_by = self._visibility[item] = set()
+                self.store.add(item)
+                self._added[item] = self._sequence
+                self._sequence += 1
+                self._version += 1
+            if importance is not None:
+                self._importance[item] = min(max(float(importance), 0.0), 1.0)
+            for character_id in character_ids:
+                if character_id not in known_by:
+                    known_by.add(character_id)
+                    self._counts[character_id] += 1
+
+    def hide(self, item: str, character_id: str):
+        """Remove a memory from one character; it is dropped when nobody knows it"""
+        with self._lock:
+            known_by = self._visibility.get(item)
+            if not known_by or character_id not in known_by:
+                return
+            known_by.discard(character_id)
+            self._counts[character_id] -= 1
+            if not known_by:
+                del self._visibility[item]
+                del self._added[item]
+                self._importance.pop(item, None)
+                self.store.discard(item)
+                self._version += 1
+
+    def forget_character(self, character_id: str):
+        with self._lock:
+            for item in [item for item, known_by in self._visibility.items() if character_id in known_by]:
+                self.hide(item, character_id)
+
+    def retain_characters(self, character_ids: Iterable[str]):
+        """Forget everything known only by characters that are not in character_ids"""
+        with self._lock:
+            for character_id in set(self._counts) - set(character_ids):
+                self.forget_character(character_id)
+                del self._counts[character_id]
+
+    def clear(self):
+        with self._lock:
+            self.store.clear()
+            self._visibility = {}
+            self._counts = Counter()
+            self._added = {}
+            self._importance = {}
+            self._sequence = 0
+            self._version += 1
+
+    def knows(self, character_id: str, item: str) -> bool:
+        return character_id in self._visibility.get(item, ())
+
+    def count(self, character_id: str) -> int:
+        return self._counts.get(character_id, 0)
+
+    def age(self, item: str) -> int:
+        """How many memories were added after item"""
+        return self._sequence - 1 - self._added.get(item, self._sequence - 1)
+
+    def importance(self, item: str) -> float:
+        return self._importance.get(item, DEFAULT_IMPORTANCE)
+
+    def visible_to(self, character_id: str) -> list[str]:
+        with self._lock:
+            return [item for item, known_by in self._visibility.items() if character_id in known_by]
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def recall(self, messages: list[str], threshold: float) -> dict[str, float]:
+        """Similarity of the memories above threshold to the messages, scored once for all characters"""
+        key = (tuple(messages), threshold)
+        with self._lock:
+            if self._recalled and self._recalled[0] == key and self._recalled[1] == self._version:
+                return self._recalled[2]
+            scores = {}
+            if messages and len(self.store):
+                scores = self.store.score(self._encoder(list(messages)), threshold)
+            self._recalled = (key, self._version, scores)
+            return scores
+
+    def to_dict(self):
+        with self._lock:
+            entries = []
+            for item in sorted(self._visibility, key=self._added.get):
+                entry = {"text": item, "characters": sorted(self._visibility[item])}
+                if item in self._importance:
+                    entry["importance"] = self._importance[item]
+                entries.append(entry)
+            return entries
+
+    def load(self, entries):
+        """Replace the pool with memories saved by to_dict(), oldest first"""
+        with self._lock:
+            self.clear()
+            for entry in entries:
+                self.add(entry["text"], entry.get("characters", []), entry.get("importance"))
+
+class MemoryView:
+    """The memories one character knows, with the set-like API of a memory store"""
+
+    def __init__(self, pool: CampaignMemory, character_id: str):
+        self.pool = pool
+        self.character_id = character_id
+
+    def add(self, item: str):
+        self.pool.add(item, [self.character_id])
+
+    def discard(self, item: str):
+        self.pool.hide(item, self.character_id)
+
+    def clear(self):
+        self.pool.forget_character(self.character_id)
+
+    def __contains__(self, item) -> bool:
+        return self.pool.knows(self.character_id, item)
+
+    def __len__(self) -> int:
+        return self.pool.count(self.character_id)
+
+    def __iter__(self):
+        return iter(self.pool.visible_to(self.character_id))
+
+    def __repr__(self):
+        return f"MemoryView({self.character_id!r}, {self.pool.visible_to(self.character_id)!r})"
+
+    def recall(self, messages: list[str], threshold: float) -> dict[str, float]:
+        """Similarity of the known memories above threshold to the messages"""
+        return {item: similarity for item, similarity in self.pool.recall(messages, threshold).items() if item in self}
+
+    def retrieve(self, messages: list[str], settings=None) -> list[str]:
+        """Best known memories for the messages within the top_k and budget of settings"""
+        settings = resolve_settings(settings)
+        recalled = self.recall(messages, settings["min_similarity"])
+        candidates = [(item, similarity, self.pool.age(item), self.pool.importance(item))
+                      for item, similarity in recalled.items()]
+        return rank_memories(candidates, settings)
+
+campaign_memory = CampaignMemory()
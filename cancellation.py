@@ -0,0 +1,96 @@
+"""
+Cancellation tokens for turns.
+
+Every turn gets a CancellationToken that is passed down to the analyzer, the
+character reply, the scene update and TTS. Cancelling it cancels the tracked
+LLM request futures (which aborts the HTTP requests), runs stop callbacks such
+as stopping audio playback, and makes the remaining steps return early.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+class TurnCancelled(Exception):
+    """Raised by a step of a turn that was cancelled"""
+
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._futures: set[Future] = set()
+        self._callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel tracked futures and run stop callbacks; later calls do nothing"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            futures = list(self._futures)
+            callbacks = list(self._callbacks)
+            self._futures.clear()
+            self._callbacks.clear()
+        for future in futures:
+            future.cancel()
+        for callback in callbacks:
+            callback()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TurnCancelled()
+
+    def track(self, future: Future) -> Future:
+        """Cancel future together with the token"""
+        with self._lock:
+            if not self._event.is_set():
+                self._futures.add(future)
+                future.add_done_callback(self._forget)
+                return future
+        future.cancel()
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def add_callback(self, callback):
+        """Call callback() on cancel, right away if already cancelled"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout=None) -> bool:
+        """Wait until cancelled; returns True if it was"""
+        return self._event.wait(timeout)
+
+# Tokens of recent turns; their post-turn work may still be running
+_recent_tokens: deque[CancellationToken] = deque(maxlen=16)
+_tokens_lock = threading.Lock()
+
+def start_turn() -> CancellationToken:
+    """Create the token for a new turn"""
+    token = CancellationToken()
+    with _tokens_lock:
+        _recent_tokens.append(token)
+    return token
+
+def cancel_turns() -> int:
+    """Cancel running turns and their pending post-turn work; returns how many were still live"""
+    with _tokens_lock:
+        tokens = [token for token in _recent_tokens if not token.cancelled]
+        _recent_tokens.clear()
+    for token in tokens:
+        token.cancel()
+    return len(tokens)
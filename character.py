@@ -1,6 +1,6 @@
+import functools
 import random
-import threading
-from ai_utils import generate_response, run_tools
+from ai_utils import generate_response, run_tools, submit_generate_response
 from google.genai.types import FunctionDeclaration, Tool, Schema
 
 from base_lore import get_base_lore
@@ -9,13 +9,17 @@ from dialog_history import DialogueMessage, DialogueMessageType, append_to_dialo
 from app_socket import send_socket_message
 import os
 from logger_config import logger as char_logger, logger as memory_logger
+from post_turn import post_turn_queue, speech_queue
+from cancellation import CancellationToken
 from tts_manager import tts
 from update_scene import get_current_scene
-from vector_compare import compare_with_base
+from campaign_memory import MemoryView, campaign_memory
+from memory_retrieval import load_settings
 from inventory import InventoryManager
 
 language = os.getenv("LANGUAGE")
 TTS_CHAT = os.getenv("TTS_CHAT")
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES")
 
 remember_information_declaration = Tool(function_declarations=[FunctionDeclaration(
     name="remember_information",
@@ -26,6 +30,10 @@ remember_information_declaration = Tool(function_declarations=[FunctionDeclarati
             "memory_item": Schema(
                 type="STRING",
                 description="Information you want to remember"
+            ),
+            "importance": Schema(
+                type="INTEGER",
+                description="How important it is for the story, from 1 (detail) to 5 (crucial)"
             )
         },
         required=["memory_item"]
@@ -65,7 +73,8 @@ removeIntention_declaration = Tool(function_declarations=[FunctionDeclaration(
 class Character:
     def __init__(self, char_id, name, char_class="", race="", personality="", background="", motivation="", avatar=None, is_leader=False,
                  strength=10, dexterity=10, constitution=10, intelligence=10, wisdom=10, charisma=10,
-                 max_hp=10, current_hp=10, armor_class=10, proficiency_bonus=2, memory: list[str] = [], intentions: list[str] = [], inventory: list[dict] = [], gold=0, active=True, voice_id=None):
+                 max_hp=10, current_hp=10, armor_class=10, proficiency_bonus=2, memory: list[str] = [], intentions: list[str] = [], inventory: list[dict] = [], gold=0, active=True, voice_id=None,
+                 memory_settings: dict | None = None):
         self.active = active
         self.id = char_id
         self.name = name
@@ -80,7 +89,12 @@ class Character:
             self.avatar = f"avatar.jpg"
         self.is_leader = is_leader
         self.memory_updated = False
-        self.memory = set(memory)
+        # Memories live in the shared campaign pool, this is the character's view of it
+        self.memory = MemoryView(campaign_memory, char_id)
+        for memory_item in memory:
+            self.memory.add(memory_item)
+        # Overrides of the memory_retrieval defaults (top_k, budget, min_similarity and weights)
+        self.memory_settings = dict(memory_settings or {})
         self.intentions = set(intentions)
         self.inventory = inventory if inventory else InventoryManager.initialize_inventory()
         self.gold = gold
@@ -143,12 +157,12 @@ class Character:
             "armor_class": self.armor_class,
             "proficiency_bonus": self.proficiency_bonus,
             "skill_proficiencies": self.skill_proficiencies,
-            "memory": list(self.memory),
             "active": self.active,
             "intentions": list(self.intentions),
             "inventory": self.inventory,
             "gold": self.gold,
-            "voice_id": self.voice_id
+            "voice_id": self.voice_id,
+            "memory_settings": self.memory_settings
         }
     
     @classmethod
@@ -174,12 +188,13 @@ class Character:
             current_hp=char_data["current_hp"],
             armor_class=char_data["armor_class"],
             proficiency_bonus=char_data["proficiency_bonus"],
-            memory=set(char_data["memory"]),
+            memory=char_data.get("memory", []),  # Old saves kept memories per character
             active=char_data.get("active", True),  # Default to True if not present
             intentions=set(char_data.get("intentions", [])),
             inventory=char_data.get("inventory", []),  # Get inventory or default to empty list
             gold=char_data.get("gold", 0),  # Get gold or default to 0
-            voice_id=char_data.get("voice_id")  # Get voice_id or default to None
+            voice_id=char_data.get("voice_id"),  # Get voice_id or default to None
+            memory_settings=load_settings(char_data.get("memory_settings"))
         )
         char.skill_proficiencies = char_data["skill_proficiencies"]
         return char
@@ -200,11 +215,11 @@ class Character:
     def say_to_chat(self, message):
         print(f"Say to chat: {message}")
     
-    def remember_information(self, memory_item: str):
-        """Add an item to character's memory"""
+    def remember_information(self, memory_item: str, importance: int | None = None):
+        """Add an item to the memory of the whole party, importance from 1 to 5"""
         memory_logger.info(f"Adding to memory for {self.name}: '{memory_item}'")
-        for character in get_characters().values():
-            character.memory.add(memory_item)
+        campaign_memory.add(memory_item, [*get_characters(), self.id],
+                            (importance - 1) / 4 if importance is not None else None)
         
         # Prepare memory data for UI display
         memory_logger.info(f"Memory size for {self.name}: {len(self.memory)} items")
@@ -267,47 +282,51 @@ class Character:
         return roll
 
     def get_short_memory(self):
+        """Best memories for the last 10 messages, bounded by the character's memory settings"""
         memory_logger.info(f"Getting short memory for {self.name}. Memory size: {len(self.memory)}")
         dialogue_history = get_dialogue_history(10)
-        short_memory = set()
+        messages = [dialog_item.message for dialog_item in dialogue_history if dialog_item.message]
+        if not len(self.memory) or not messages:
+            return []
         
         try:
-            for dialog_item in dialogue_history:
-                message = dialog_item.message
-                memory_logger.info(f"Processing message: {message[:50]}...")
-                for memory_item in self.memory:
-                    try:
-                        cosine_similarity = compare_with_base(memory_item, message)
-                        
-                        if cosine_similarity > 0.61:
-                            short_memory.add(memory_item)
-                    except Exception as e:
-                        memory_logger.error(f"Error processing memory item: {str(e)}", exc_info=True)
+            # The pool is scored once for these messages and shared by every character
+            short_memory = self.memory.retrieve(messages, self.memory_settings)
             
             memory_logger.info(f"Short memory size for {self.name}: {len(short_memory)} items")
             return short_memory
         except Exception as e:
             memory_logger.error(f"Error in get_short_memory: {str(e)}", exc_info=True)
-            return set()  # Return empty set on error
+            return []  # Return no memories on error
     
-    def generate_response(self):
-        global language
-        # Check if character is active
-        if not self.active:
-            char_logger.info(f"Character {self.name} is inactive, skipping response generation")
-            return None
-            
-        # Use the Character class method to generate response
-        dialogue_history = build_dialogue_messages_list()
-        char_logger.info(f"Generating response for {self.name}")
+    def build_role_prompt(self):
+        """Describe who the character is"""
+        return (
+            "# Your role:\n"
+            f"You are a RPG player controlling the character {self.name}, {self.race} {self.char_class}.\n"
+            f"{'Use Russian language for your response' if language == 'ru' else ''}\n"
+            f"Your personality: {self.personality}\n"
+            f"Your background: {self.background}\n"
+            f"Your motivation: {self.motivation}\n\n"
+            f"{'You are the group leader. You make decisions about group movement and announce them.' if self.is_leader else ''}\n\n"
+        )
+
+    def build_static_prompt(self):
+        """Build the part of the prompt that only changes when the character or the base lore is edited"""
+        return self.build_role_prompt() + build_table_rules_prompt() + build_tools_prompt()
+
+    def get_prompt_memory(self):
+        """Memories relevant to the recent messages, or an empty list on error"""
         try:
             short_memory = self.get_short_memory()
             char_logger.info(f"Retrieved {len(short_memory)} relevant memories for response generation")
+            return short_memory
         except Exception as e:
             char_logger.error(f"Error getting short memory: {str(e)}", exc_info=True)
-            short_memory = set()
+            return []
 
-        characters_list = '\n'.join([f'{char.name} ({char.race} {char.char_class}){" - not nearby" if not char.active else ""}' for char in get_characters().values()])
+    def build_state_prompt(self, short_memory):
+        """Describe what the character knows, plans and carries"""
         delimiter = "\n - "
 
         # Format inventory for prompt
@@ -318,35 +337,7 @@ class Character:
         else:
             inventory_text = "No items"
 
-        prompt = (
-            "# Your role:\n"
-            f"You are a RPG player controlling the character {self.name}, {self.race} {self.char_class}.\n"
-            f"{'Use Russian language for your response' if language == 'ru' else ''}\n"
-            f"Your personality: {self.personality}\n"
-            f"Your background: {self.background}\n"
-            f"Your motivation: {self.motivation}\n\n"
-            f"{'You are the group leader. You make decisions about group movement and announce them.' if self.is_leader else ''}\n\n"
-            "# Communication rules:\n"
-            "You are all friends sitting at the same table. Be casual.\n"
-            "You can include meta-game jokes, but not too often.\n"
-            "Speak about your character in first person.\n"
-            "State actions to do something. Express your intentions in affirmative form.\n"
-            "If your group is stuck, try to act differently.\n"
-            "Discuss your plans with the group before acting.\n"
-            "Be brief and concise.\n\n"
-
-            "\n# Game rules:\n"
-            "You must ask master to move somewhere in the game world.\n"
-            "If you want to address someone, use direct speech.\n"
-            "Don't make up things not mentioned in the context or message history. Ask the master for clarification about what's happening.\n"
-            "You can use items in your inventory. Mention them by name when you want to use them.\n"
-            "You have gold to buy items or services. Use it wisely.\n"
-
-            "# Context:\n"
-            "## Other characters in your group:\n"
-            f"{characters_list}\n\n"
-            "## Basic knowledge:\n"
-            f"{get_base_lore()}\n\n"
+        return (
             "## Your knowledge:\n"
             f"{delimiter.join(short_memory) if short_memory else '- No memories about topics in messages'}\n\n"
             "## Your were going to do:\n"
@@ -357,27 +348,102 @@ class Character:
             f"{inventory_text}\n\n"
             "## Your gold:\n"
             f"{self.gold} gold coins\n\n"
-            "## Current game context:\n"
-            f"{get_current_scene()}\n\n"
-            "## Message history:\n"
-            f"{dialogue_history}\n"
         )
-        
-        result = generate_response(prompt, temperature=0.85)
 
-        text = None
-        if result:
-            text = result.text
+    def generate_response(self, message_id=None, cancel_token: CancellationToken | None = None, api_key=None):
+        """Generate the character's reply.
 
-        if text:
-            # Use the character's voice if set in a separate thread
-            if TTS_CHAT:
-                threading.Thread(target=tts.speak_text, args=(text,), kwargs={"voice": self.voice_id}).start()
-            self.do_tools(text)
+        With STREAM_RESPONSES set, text deltas are sent as message_delta events
+        carrying message_id, which the final new_message reuses. Cancelling
+        cancel_token aborts the request and the speech and tools that follow.
+        api_key is the session's key when called outside its request context.
+        """
+        # Check if character is active
+        if not self.active:
+            char_logger.info(f"Character {self.name} is inactive, skipping response generation")
+            return None
+
+        result, function_calls = self.draft_response(message_id, cancel_token, api_key)
+        if result and result.text:
+            self.handle_reply(result.text, function_calls, cancel_token, api_key)
 
         return result
 
-    def do_tools(self, message):
+    def draft_response(self, message_id=None, cancel_token: CancellationToken | None = None, api_key=None):
+        """
+        Generate the reply without voicing it or running its tool calls.
+
+        Returns (response, function_calls); the caller passes both to
+        handle_reply once the reply is used.
+        """
+        global language
+        # Use the Character class method to generate response
+        dialogue_history = build_dialogue_messages_list()
+        char_logger.info(f"Generating response for {self.name}")
+        short_memory = self.get_prompt_memory()
+
+        prompt = (
+            "# Context:\n"
+            "## Other characters in your group:\n"
+            f"{build_group_prompt()}\n\n"
+            f"{self.build_state_prompt(short_memory)}"
+            "## Current game context:\n"
+            f"{get_current_scene()}\n\n"
+            "## Message history:\n"
+            f"{dialogue_history}\n"
+        )
+        
+        on_delta = None
+        if STREAM_RESPONSES and message_id:
+            def on_delta(delta):
+                send_socket_message('message_delta', {
+                    'id': message_id,
+                    'sender': self.name,
+                    'character_id': self.id,
+                    'avatar': self.avatar,
+                    'delta': delta
+                })
+
+        # The reply and the memory/intention tool calls come back in one response
+        result = generate_response(prompt, temperature=0.85, tools=self.get_reply_tools(), defer_tools=True,
+                                   stage="character", on_delta=on_delta, api_key=api_key, cancel_token=cancel_token,
+                                   static_prefix=self.build_static_prompt(), cache_owner=f"character-{self.id}")
+        function_calls = list(result.function_calls or []) if result else []
+
+        if result and not result.text:
+            # Only tool calls came back, ask once more for the reply itself
+            char_logger.info(f"No reply text from {self.name}, requesting text only")
+            result = generate_response(prompt, temperature=0.85, stage="character", on_delta=on_delta,
+                                       api_key=api_key, cancel_token=cancel_token, static_prefix=self.build_role_prompt() + build_table_rules_prompt(),
+                                       cache_owner=f"character-{self.id}-text")
+
+        return result, function_calls
+
+    def get_reply_tools(self):
+        """Tools the character can call alongside its reply"""
+        return [
+            (self.add_intention, addIntention_declaration),
+            (self.remove_intention, removeIntention_declaration),
+            (self.remember_information, remember_information_declaration),
+        ]
+
+    def handle_reply(self, text, function_calls=None, cancel_token: CancellationToken | None = None, api_key=None):
+        """
+        Voice the reply and update memory and intentions from it.
+
+        function_calls are the tool calls returned with the reply; without
+        them a separate tools request is made for the reply text.
+        """
+        # Speech and tool calls run in the background after the reply is shown
+        if TTS_CHAT:
+            speak = functools.partial(tts.speak_text, cancel_token=cancel_token)
+            speech_queue.submit("tts", speak, text, voice=self.voice_id, cancel_token=cancel_token)
+        if function_calls is None:
+            self.do_tools(text, cancel_token, api_key)
+        elif function_calls:
+            post_turn_queue.submit("tools", run_tools, function_calls, self.get_reply_tools(), cancel_token=cancel_token)
+
+    def do_tools(self, message, cancel_token: CancellationToken | None = None, api_key=None):
         # Check if character is active
         if not self.active:
             char_logger.info(f"Character {self.name} is inactive, skipping tools execution")
@@ -403,14 +469,19 @@ class Character:
             f"{message}\n"
         )
 
-        generate_response(prompt, temperature=0.70, tools=[
-            (self.add_intention, addIntention_declaration),
-            (self.remove_intention, removeIntention_declaration),
-            (self.remember_information, remember_information_declaration),
-        ])
+        # Don't wait for the tools, so they overlap with the scene update
+        future = submit_generate_response(prompt, api_key=api_key, temperature=0.70, tools=self.get_reply_tools(), stage="tools")
+        future.add_done_callback(self._log_tools_error)
+        if cancel_token:
+            cancel_token.track(future)
+        return future
+
+    def _log_tools_error(self, future):
+        if not future.cancelled() and future.exception():
+            char_logger.error(f"Error running tools for {self.name}: {future.exception()}")
 
     def clear_memories(self):
-        self.memory = set()
+        self.memory.clear()
 
     def add_item_to_inventory(self, item_name, item_description="", item_quantity=1, 
                              value=0, weight=0, type_="", rarity="common", equipped=False):
@@ -517,9 +588,46 @@ def get_active_characters() -> dict[str, Character]:
     """Return only active characters"""
     return {char_id: char for char_id, char in _characters.items() if char.active}
 
+def build_table_rules_prompt():
+    """Rules and lore shared by every character at the table"""
+    return (
+        "# Communication rules:\n"
+        "You are all friends sitting at the same table. Be casual.\n"
+        "You can include meta-game jokes, but not too often.\n"
+        "Speak about your character in first person.\n"
+        "State actions to do something. Express your intentions in affirmative form.\n"
+        "If your group is stuck, try to act differently.\n"
+        "Discuss your plans with the group before acting.\n"
+        "Be brief and concise.\n\n"
+
+        "\n# Game rules:\n"
+        "You must ask master to move somewhere in the game world.\n"
+        "If you want to address someone, use direct speech.\n"
+        "Don't make up things not mentioned in the context or message history. Ask the master for clarification about what's happening.\n"
+        "You can use items in your inventory. Mention them by name when you want to use them.\n"
+        "You have gold to buy items or services. Use it wisely.\n\n"
+
+        "# Basic knowledge:\n"
+        f"{get_base_lore()}\n\n"
+    )
+
+def build_tools_prompt():
+    """How to use the memory and intention tools offered with the reply"""
+    return (
+        "# Tools:\n"
+        "Always answer with your reply text. Call tools in addition to it, never instead of it.\n"
+        "- remember_information: Remember important moments in the game. For example: names of places, characters, events, descriptions of items, etc.\n"
+        "- manage things your character is going to do or tasks it accepts with addIntention and removeIntention\n\n"
+    )
+
+def build_group_prompt():
+    """One line per character in the group"""
+    return '\n'.join([f'{char.name} ({char.race} {char.char_class}){" - not nearby" if not char.active else ""}' for char in get_characters().values()])
+
 def set_characters(characters):
     global _characters
     _characters = characters
+    campaign_memory.retain_characters(_characters)
     for character in _characters.values():
         update_avatar(character)
 
@@ -0,0 +1,106 @@
+"""
+Server-side Gemini context caches for static prompt prefixes.
+
+A prompt prefix that rarely changes (base lore, a character's role and rules)
+is uploaded once with caches.create and later requests only send the dynamic
+suffix. The cache is keyed by API key and owner, and is re-created only when
+the prefix text or the tool set changes.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from typing import Optional
+
+from google import genai
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+CONTEXT_CACHE = os.getenv("CONTEXT_CACHE", "")
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+
+# Re-create caches a bit before the server expires them
+_EXPIRY_MARGIN = 60
+
+class _CacheEntry:
+    def __init__(self, prefix_hash: str, name: Optional[str], expires_at: float):
+        self.prefix_hash = prefix_hash
+        self.name = name
+        self.expires_at = expires_at
+
+class ContextCacheRegistry:
+    """Tracks the cached context registered for every (API key, owner) pair"""
+
+    def __init__(self, ttl=CONTEXT_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: dict[tuple[str, str], _CacheEntry] = {}
+        self._locks: dict[tuple[str, str], asyncio.Lock] = {}
+
+    @staticmethod
+    def _hash(model, prefix, function_declarations) -> str:
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        digest.update(prefix.encode("utf-8"))
+        for declaration in function_declarations or []:
+            digest.update(declaration.model_dump_json(exclude_none=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    async def get_cache_name(self, client: genai.Client, api_key: str, owner: str, model: str,
+                             prefix: str, function_declarations=None) -> Optional[str]:
+        """
+        Return the name of a cached context holding prefix, creating it if needed.
+
+        Returns None when the prefix could not be cached (for example because it
+        is below the model's minimum cacheable size); callers then send the
+        prefix inline. Must be called on the gateway loop.
+        """
+        key = (api_key, owner)
+        prefix_hash = self._hash(model, prefix, function_declarations)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry and entry.prefix_hash == prefix_hash and entry.expires_at > now:
+                return entry.name
+
+            if entry and entry.name:
+                await self._delete(client, entry.name)
+
+            name = await self._create(client, owner, model, prefix, function_declarations)
+            # A failed creation is remembered too, so it is not retried on every turn
+            self._entries[key] = _CacheEntry(prefix_hash, name, now + self.ttl - _EXPIRY_MARGIN)
+            return name
+
+    async def _create(self, client, owner, model, prefix, function_declarations) -> Optional[str]:
+        try:
+            cached_content = await client.aio.caches.create(
+                model=model,
+                config=genai.types.CreateCachedContentConfig(
+                    display_name=f"e-rpg-{owner}",
+                    contents=[prefix],
+                    tools=function_declarations or None,
+                    ttl=f"{self.ttl}s"
+                )
+            )
+            logger.info(f"Created context cache {cached_content.name} for {owner}")
+            return cached_content.name
+        except Exception as e:
+            logger.warning(f"Could not create context cache for {owner}, sending prefix inline: {e}")
+            return None
+
+    async def _delete(self, client, name):
+        try:
+            await client.aio.caches.delete(name=name)
+            logger.info(f"Deleted context cache {name}")
+        except Exception as e:
+            logger.warning(f"Error deleting context cache {name}: {e}")
+
+    def forget_api_key(self, api_key):
+        """Drop local entries for an API key; the server expires the caches by TTL"""
+        for key in [key for key in self._entries if key[0] == api_key]:
+            del self._entries[key]
+            self._locks.pop(key, None)
+
+context_caches = ContextCacheRegistry()
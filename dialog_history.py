@@ -71,6 +71,12 @@ def append_to_dialog_history(message: DialogueMessage) -> None:
     """Add a message to the dialogue history"""
     _dialogue_history.append(message)
 
+def get_dialogue_fingerprint() -> tuple[int, Optional[str]]:
+    """Identify the current history state by its length and last message id"""
+    if not _dialogue_history:
+        return (0, None)
+    return (len(_dialogue_history), _dialogue_history[-1].id)
+
 def clear_dialog_history() -> None:
     """Clear the dialogue history"""
     global _dialogue_history
@@ -0,0 +1,211 @@
+"""
+Bounded LRU cache for sentence embeddings.
+
+Entries are keyed by a hash of the text instead of the text itself, and the
+cache is limited both by entry count and by the bytes of the stored vectors,
+so long-running servers don't keep every message they ever embedded.
+
+Behind the LRU sits an optional persisted tier: a .npy sidecar next to the
+game save holding (hash, vector) records for one embedding model. It is
+memory-mapped on the first lookup, rows are returned as views, and the model
+name is part of the file name so a different model never reads stale vectors.
+"""
+
+import glob
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import numpy as np
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_CACHE_ENTRIES = int(os.getenv("EMBEDDING_CACHE_ENTRIES", "20000"))
+EMBEDDING_CACHE_BYTES = int(os.getenv("EMBEDDING_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+KEY_SIZE = 16
+
+def text_key(text: str) -> bytes:
+    """Content hash used as the cache key"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+def sidecar_path(save_path: str, model: str = EMBEDDING_MODEL) -> str:
+    """Embedding sidecar of a save file for one model"""
+    model_slug = re.sub(r"[^A-Za-z0-9_.-]+", "-", model)
+    return f"{os.path.splitext(save_path)[0]}.embeddings.{model_slug}.npy"
+
+class PersistedEmbeddings:
+    """Read-only, lazily memory-mapped embedding sidecar"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._records = None
+        self._rows: Optional[dict[bytes, int]] = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        with self._lock:
+            if self._rows is not None:
+                return
+            self._rows = {}
+            if not os.path.exists(self.path):
+                return
+            try:
+                self._records = np.load(self.path, mmap_mode="r")
+                self._rows = {key.tobytes(): row for row, key in enumerate(self._records["key"])}
+            except Exception as e:
+                logger.warning(f"Error reading embedding sidecar {self.path}: {e}")
+                self._records, self._rows = None, {}
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        self._open()
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        return self._records["vector"][row]
+
+    def __len__(self) -> int:
+        self._open()
+        return len(self._rows)
+
+    def close(self):
+        with self._lock:
+            self._records, self._rows = None, None
+
+def write_embeddings(path: str, embeddings: dict[bytes, np.ndarray]):
+    """Write (hash, vector) records as one .npy file, replacing the old one"""
+    dimension = len(next(iter(embeddings.values()))) if embeddings else 0
+    records = np.zeros(len(embeddings), dtype=[("key", "V%d" % KEY_SIZE), ("vector", np.float32, (dimension,))])
+    for row, (key, vector) in enumerate(embeddings.items()):
+        records[row] = (key, vector)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, records)
+    os.replace(temp_path, path)
+
+class EmbeddingCache:
+    """LRU of embeddings limited by max_entries and max_bytes (0 disables a limit)"""
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_ENTRIES, max_bytes=EMBEDDING_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.persisted: Optional[PersistedEmbeddings] = None
+        self.hits = 0
+        self.persisted_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def attach(self, persisted: Optional[PersistedEmbeddings]):
+        """Use a persisted sidecar for lookups the LRU misses"""
+        with self._lock:
+            if self.persisted is not None:
+                self.persisted.close()
+            self.persisted = persisted
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = text_key(text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+            embedding = self.persisted.get(key) if self.persisted is not None else None
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.persisted_hits += 1
+            return embedding
+
+    def export(self, texts: Iterable[str]) -> dict[bytes, np.ndarray]:
+        """Known embeddings of texts by key, without touching the counters or LRU order"""
+        embeddings = {}
+        with self._lock:
+            for text in texts:
+                key = text_key(text)
+                if key in embeddings:
+                    continue
+                embedding = self._entries.get(key)
+                if embedding is None and self.persisted is not None:
+                    embedding = self.persisted.get(key)
+                if embedding is not None:
+                    embeddings[key] = np.array(embedding, dtype=np.float32)
+        return embeddings
+
+    def put(self, text: str, embedding: np.ndarray):
+        key = text_key(text)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes + KEY_SIZE
+            self._entries[key] = embedding
+            self._bytes += embedding.nbytes + KEY_SIZE
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (
+                (self.max_entries and len(self._entries) > self.max_entries) or
+                (self.max_bytes and self._bytes > self.max_bytes)):
+            _, embedding = self._entries.popitem(last=False)
+            self._bytes -= embedding.nbytes + KEY_SIZE
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size"""
+        with self._lock:
+            hits = self.hits + self.persisted_hits
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "persisted_hits": self.persisted_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes
+            }
+
+embedding_cache = EmbeddingCache()
+
+def get_embedding_cache_stats():
+    return embedding_cache.stats()
+
+def save_embeddings(save_path: str, texts: Iterable[str]):
+    """Persist the known embeddings of texts next to a save and switch lookups to it"""
+    path = sidecar_path(save_path)
+    embeddings = embedding_cache.export(texts)
+    # Release the mapped old file before replacing it
+    embedding_cache.attach(None)
+    try:
+        write_embeddings(path, embeddings)
+    finally:
+        embedding_cache.attach(PersistedEmbeddings(path))
+    # Sidecars of other models can't be used anymore
+    prefix = f"{os.path.splitext(save_path)[0]}.embeddings."
+    for stale_path in glob.glob(f"{glob.escape(prefix)}*.npy"):
+        if os.path.normpath(stale_path) != os.path.normpath(path):
+            os.remove(stale_path)
+
+def load_embeddings(save_path: str):
+    """Serve embeddings from the sidecar of a save; the file is mapped on first use"""
+    embedding_cache.attach(PersistedEmbeddings(sidecar_path(save_path)))
@@ -5,8 +5,11 @@ import threading
 
 from base_lore import get_base_lore, set_base_lore
 from dialog_history import DialogueMessage, append_to_dialog_history, get_dialogue_history, set_dialog_history
-from update_scene import get_current_scene, set_current_scene
+from update_scene import get_current_scene, get_scene_state, set_current_scene, set_scene_state
+from scene_state import SceneState
 from character import get_characters, Character, reset_to_default_characters, set_characters
+from campaign_memory import campaign_memory
+from embedding_cache import EMBEDDING_MODEL, load_embeddings, save_embeddings
 from gm_persona import GMPersona, get_personas, set_personas, set_default_persona, get_default_persona
 
 language = os.getenv("LANGUAGE")
@@ -125,9 +128,11 @@ class GameState:
         # Create the game state dictionary
         game_data = {
             "current_scene": get_current_scene(),
+            "scene_state": get_scene_state().to_dict(),
             "dialogue_history": dialogue_history_data,
             "base_lore": get_base_lore(),
             "characters": characters_data,  # Add characters to the save data
+            "memories": campaign_memory.to_dict(),  # Shared by the characters, each entry lists who knows it
             "gm_personas": personas_data,  # Add GM personas to the save data
             "default_persona": get_default_persona()  # Save the default persona
         }
@@ -136,14 +141,49 @@ class GameState:
         try:
             with open(file_path, 'w', encoding='utf-8') as f:
                 json.dump(game_data, f, ensure_ascii=False, indent=2)
-            return True
         except Exception as e:
             print(f"Error saving game state: {e}")
             return False
+
+        self._save_memory_index(file_path)
+        self._save_embeddings(file_path)
+        return True
+
+    def _memory_index_path(self, file_path):
+        """Sidecar file with the campaign memory embeddings and index"""
+        return f"{os.path.splitext(file_path)[0]}.memory.npz"
+
+    def _save_memory_index(self, file_path):
+        # The JSON save stays the source of truth, a failed sidecar is only rebuilt later
+        try:
+            campaign_memory.store.save(self._memory_index_path(file_path), EMBEDDING_MODEL)
+        except Exception as e:
+            print(f"Error saving memory index: {e}")
+
+    def _save_embeddings(self, file_path):
+        """Keep the embeddings of memories and messages so a load doesn't encode them again"""
+        texts = list(campaign_memory)
+        texts += [message.message for message in get_dialogue_history() if message.message]
+        try:
+            save_embeddings(file_path, texts)
+        except Exception as e:
+            print(f"Error saving embeddings: {e}")
+
+    def _load_memory_index(self, file_path):
+        index_path = self._memory_index_path(file_path)
+        if not os.path.exists(index_path):
+            return
+        try:
+            if not campaign_memory.store.load(index_path, EMBEDDING_MODEL):
+                print("Memory index is outdated, it will be rebuilt")
+        except Exception as e:
+            print(f"Error loading memory index: {e}")
     
     def load_game(self):
         print("load_game")
         file_path = f"saves/{self._save_file_path}"
+        # Memories are restored below with the characters
+        campaign_memory.clear()
             
         if not os.path.exists(file_path):
             reset_to_default_characters()
@@ -153,8 +193,11 @@ class GameState:
             with open(file_path, 'r', encoding='utf-8') as f:
                 game_data = json.load(f)
                 
-            # Restore current scene
-            set_current_scene(game_data.get("current_scene", ""))
+            # Restore current scene, saves without scene_state only have its text
+            if game_data.get("scene_state"):
+                set_scene_state(SceneState.from_dict(game_data["scene_state"]))
+            else:
+                set_current_scene(game_data.get("current_scene", ""))
             
             # Restore dialogue history
             set_dialog_history([])
@@ -171,6 +214,10 @@ class GameState:
                 loaded_characters[char_data["id"]] = Character.from_dict(char_data)
 
             set_characters(loaded_characters)
+            if "memories" in game_data:
+                campaign_memory.load(game_data["memories"])
+            load_embeddings(file_path)
+            self._load_memory_index(file_path)
                 
             # Restore GM personas
             personas_data = game_data.get("gm_personas", [])
@@ -0,0 +1,253 @@
+"""
+Content-addressed cache for LLM responses.
+
+Responses are keyed by model, prompt hash, temperature and tool set. A small
+in-memory LRU sits in front of a size-bounded on-disk store, and every stage
+has its own time to live. Stages without a TTL are never cached.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from google.genai.types import FunctionCall
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+LLM_CACHE = os.getenv("LLM_CACHE", "")
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "cache/llm")
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+LLM_CACHE_DISK_BYTES = int(os.getenv("LLM_CACHE_DISK_BYTES", str(64 * 1024 * 1024)))
+
+# Time to live in seconds for the deterministic stages
+STAGE_TTLS = {
+    "analyzer": 10 * 60,
+    "scene": 10 * 60,
+    "transcription": 60 * 60,
+}
+
+class CachedResponse:
+    """Stored response exposing the same fields callers read from a Gemini response"""
+
+    def __init__(self, text: Optional[str], function_calls: Optional[list[FunctionCall]] = None):
+        self.text = text
+        self.function_calls = function_calls or None
+        self.usage_metadata = None
+        self.candidates = []
+
+    @classmethod
+    def from_response(cls, response) -> 'CachedResponse':
+        return cls(response.text, list(response.function_calls or []))
+
+    def to_dict(self):
+        return {
+            "text": self.text,
+            "function_calls": [{"name": call.name, "args": call.args} for call in self.function_calls or []]
+        }
+
+    @classmethod
+    def from_dict(cls, data) -> 'CachedResponse':
+        function_calls = [FunctionCall(name=call["name"], args=call["args"]) for call in data.get("function_calls", [])]
+        return cls(data.get("text"), function_calls)
+
+def _digest_part(part) -> bytes:
+    if isinstance(part, str):
+        return part.encode("utf-8")
+    if hasattr(part, "model_dump_json"):
+        return part.model_dump_json(exclude_none=True).encode("utf-8")
+    return repr(part).encode("utf-8")
+
+def make_cache_key(model: str, prompt, temperature: float, tools=None, response_schema=None) -> str:
+    """Hash everything that changes the model output"""
+    prompt_hash = hashlib.sha256()
+    for part in prompt if isinstance(prompt, list) else [prompt]:
+        prompt_hash.update(_digest_part(part))
+
+    tool_set = sorted(_digest_part(tool_tuple[1]).decode("utf-8") for tool_tuple in tools or [])
+    key_data = json.dumps({
+        "model": model,
+        "prompt": prompt_hash.hexdigest(),
+        "temperature": temperature,
+        "tools": tool_set,
+        "response_schema": _digest_part(response_schema).decode("utf-8") if response_schema else None
+    }, sort_keys=True)
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Two-tier response cache: in-memory LRU backed by a directory of JSON files"""
+
+    def __init__(self, max_entries=LLM_CACHE_MEMORY_ENTRIES, directory=LLM_CACHE_DIR, max_disk_bytes=LLM_CACHE_DISK_BYTES):
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory else None
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, tuple[float, CachedResponse]] = OrderedDict()
+        # Guards the in-memory tier; the disk tier has its own lock so file
+        # I/O never holds up memory lookups on the gateway loop
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str, ttl: float) -> Optional[CachedResponse]:
+        """Return the cached response for key if it is younger than ttl seconds"""
+        now = time.time()
+        response = self._get_memory(key, ttl, now)
+        return response if response is not None else self._get_disk(key, ttl, now)
+
+    def put(self, key: str, response: CachedResponse):
+        """Store a response in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+        self._write_disk(key, now, response)
+
+    async def get_async(self, key: str, ttl: float) -> Optional[CachedResponse]:
+        """get() for the gateway loop; the disk tier is read in a worker thread"""
+        now = time.time()
+        response = self._get_memory(key, ttl, now)
+        if response is not None:
+            return response
+        return await asyncio.to_thread(self._get_disk, key, ttl, now)
+
+    async def put_async(self, key: str, response: CachedResponse):
+        """put() for the gateway loop; the disk tier is written in a worker thread"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+        await asyncio.to_thread(self._write_disk, key, now, response)
+
+    def _get_memory(self, key, ttl, now) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            stored_at, response = entry
+            if now - stored_at <= ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return response
+            del self._memory[key]
+            return None
+
+    def _get_disk(self, key, ttl, now) -> Optional[CachedResponse]:
+        # File I/O happens outside the lock, memory lookups don't wait for it
+        entry = self._read_disk(key, ttl, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, response = entry
+            self._remember(key, stored_at, response)
+            self.disk_hits += 1
+            return response
+
+    def _remember(self, key, stored_at, response):
+        self._memory[key] = (stored_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _read_disk(self, key, ttl, now) -> Optional[tuple[float, CachedResponse]]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Error reading LLM cache entry {key}: {e}")
+            return None
+
+        stored_at = data.get("stored_at", 0)
+        if now - stored_at > ttl:
+            return None
+        return stored_at, CachedResponse.from_dict(data["response"])
+
+    def _write_disk(self, key, stored_at, response):
+        if not self.directory:
+            return
+        with self._disk_lock:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                disk_bytes = self._get_disk_bytes()
+                path = self._path(key)
+                old_size = path.stat().st_size if path.exists() else 0
+                payload = json.dumps({"stored_at": stored_at, "response": response.to_dict()}, ensure_ascii=False)
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(payload)
+                self._disk_bytes = disk_bytes - old_size + path.stat().st_size
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._trim_disk()
+            except Exception as e:
+                logger.warning(f"Error writing LLM cache entry {key}: {e}")
+
+    def _get_disk_bytes(self):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(path.stat().st_size for path in self.directory.glob("*.json"))
+        return self._disk_bytes
+
+    def _trim_disk(self):
+        """Delete the oldest files until the store fits into max_disk_bytes"""
+        files = sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in files)
+        for path in files:
+            if total <= self.max_disk_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+            self.evictions += 1
+        self._disk_bytes = total
+
+    def clear(self):
+        """Drop all cached responses"""
+        with self._lock:
+            self._memory.clear()
+        with self._disk_lock:
+            if self.directory and self.directory.exists():
+                for path in self.directory.glob("*.json"):
+                    path.unlink(missing_ok=True)
+            self._disk_bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and current sizes"""
+        with self._disk_lock:
+            disk_bytes = self._get_disk_bytes() if self.directory and self.directory.exists() else 0
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "enabled": bool(LLM_CACHE),
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_bytes": disk_bytes
+            }
+
+response_cache = ResponseCache()
+
+def get_stage_ttl(stage: Optional[str]) -> Optional[float]:
+    """Return the TTL for a stage, or None if the stage is not cached"""
+    return STAGE_TTLS.get(stage)
+
+def get_cache_stats():
+    return response_cache.stats()
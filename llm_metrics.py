@@ -0,0 +1,127 @@
+"""
+Rolling per-stage telemetry for LLM calls.
+
+Every generate_response call records its stage label, wall time, time spent
+waiting on the rate limiter, prompt size and token counts. The last
+LLM_METRICS_WINDOW calls of each stage are kept for p50/p95/p99 summaries.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+LLM_METRICS_WINDOW = int(os.getenv("LLM_METRICS_WINDOW", "500"))
+
+class CallRecord:
+    def __init__(self, stage: str, wall_time: float, queue_wait: float, prompt_chars: int,
+                 input_tokens: Optional[int] = None, output_tokens: Optional[int] = None,
+                 cached_tokens: Optional[int] = None, cache_hit: bool = False, error: bool = False):
+        self.stage = stage
+        self.wall_time = wall_time
+        self.queue_wait = queue_wait
+        self.prompt_chars = prompt_chars
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cached_tokens = cached_tokens
+        self.cache_hit = cache_hit
+        self.error = error
+        self.timestamp = time.time()
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "wall_time": self.wall_time,
+            "queue_wait": self.queue_wait,
+            "prompt_chars": self.prompt_chars,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_hit": self.cache_hit,
+            "error": self.error,
+            "timestamp": self.timestamp
+        }
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def _distribution(values: list[float]):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "mean": sum(values) / len(values),
+        "max": values[-1]
+    }
+
+class LLMMetrics:
+    """In-process store of recent LLM calls, grouped by stage"""
+
+    def __init__(self, window=LLM_METRICS_WINDOW):
+        self.window = window
+        self._records: dict[str, deque[CallRecord]] = {}
+        self._totals: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, record: CallRecord):
+        with self._lock:
+            records = self._records.get(record.stage)
+            if records is None:
+                records = deque(maxlen=self.window)
+                self._records[record.stage] = records
+            records.append(record)
+            self._totals[record.stage] = self._totals.get(record.stage, 0) + 1
+
+    def summary(self):
+        """Per-stage percentiles over the rolling window"""
+        with self._lock:
+            snapshot = {stage: list(records) for stage, records in self._records.items()}
+            totals = dict(self._totals)
+
+        result = {}
+        for stage, records in snapshot.items():
+            result[stage] = {
+                "total_calls": totals[stage],
+                "window_calls": len(records),
+                "errors": sum(1 for record in records if record.error),
+                "cache_hits": sum(1 for record in records if record.cache_hit),
+                "wall_time": _distribution([record.wall_time for record in records]),
+                "queue_wait": _distribution([record.queue_wait for record in records]),
+                "prompt_chars": _distribution([record.prompt_chars for record in records]),
+                "input_tokens": _distribution([record.input_tokens for record in records]),
+                "output_tokens": _distribution([record.output_tokens for record in records]),
+                "cached_tokens": _distribution([record.cached_tokens for record in records])
+            }
+        return result
+
+    def recent(self, limit=50):
+        """The most recent calls across all stages, newest last"""
+        with self._lock:
+            records = [record for stage_records in self._records.values() for record in stage_records]
+        records.sort(key=lambda record: record.timestamp)
+        return [record.to_dict() for record in records[-limit:]]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._totals.clear()
+
+llm_metrics = LLMMetrics()
+
+def prompt_length(prompt) -> int:
+    """Number of text characters in a prompt (string or list of parts)"""
+    if isinstance(prompt, str):
+        return len(prompt)
+    return sum(len(part) for part in prompt if isinstance(part, str))
+
+def get_llm_metrics():
+    return llm_metrics.summary()
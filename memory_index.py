@@ -0,0 +1,257 @@
+"""
+Nearest-neighbour indexes over the rows of a MemoryStore matrix.
+
+ExactIndex compares the queries with every row. IVFIndex clusters the rows
+with spherical k-means and compares every query only with the rows of its own
+nprobe closest clusters; below MEMORY_INDEX_MIN_SIZE rows it searches exactly,
+which is faster at that size anyway. Clusters are trained on a background
+thread, searches keep using the previous clusters (or exact search) until the
+new ones are ready. Indexes only keep row numbers, the vectors stay in the
+store's matrix.
+"""
+
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+MEMORY_INDEX = os.getenv("MEMORY_INDEX", "ivf")
+MEMORY_INDEX_MIN_SIZE = int(os.getenv("MEMORY_INDEX_MIN_SIZE", "2000"))
+MEMORY_INDEX_NPROBE = int(os.getenv("MEMORY_INDEX_NPROBE", "8"))
+
+def exact_scores(matrix: np.ndarray, queries: np.ndarray, threshold: float) -> tuple[np.ndarray, np.ndarray]:
+    """Rows whose similarity to any query exceeds threshold, with that best similarity"""
+    if len(matrix) == 0 or len(queries) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    similarities = (matrix @ queries.T).max(axis=1)
+    rows = np.flatnonzero(similarities > threshold)
+    return rows, similarities[rows]
+
+def exact_search(matrix: np.ndarray, queries: np.ndarray, threshold: float) -> np.ndarray:
+    """Rows whose similarity to any query exceeds threshold"""
+    return exact_scores(matrix, queries, threshold)[0]
+
+class ExactIndex:
+    kind = "exact"
+
+    def add(self, row: int, vector: np.ndarray):
+        pass
+
+    def remove(self, row: int):
+        pass
+
+    def move(self, old_row: int, new_row: int):
+        pass
+
+    def search(self, matrix: np.ndarray, queries: np.ndarray, threshold: float) -> np.ndarray:
+        return exact_search(matrix, queries, threshold)
+
+    def score(self, matrix: np.ndarray, queries: np.ndarray, threshold: float) -> tuple[np.ndarray, np.ndarray]:
+        return exact_scores(matrix, queries, threshold)
+
+    def state(self) -> dict:
+        return {}
+
+    @classmethod
+    def from_state(cls, state: dict, size: int) -> 'ExactIndex':
+        return cls()
+
+class IVFIndex:
+    """
+    Inverted file index: k-means clusters with an array of rows per cluster.
+
+    add, remove, move and search are called under the store's lock. Changes
+    made while the clusters are trained in the background are logged and
+    replayed onto the new assignment when it is installed.
+    """
+    kind = "ivf"
+
+    def __init__(self, min_size=MEMORY_INDEX_MIN_SIZE, nprobe=MEMORY_INDEX_NPROBE, iterations=10, seed=0):
+        self.min_size = min_size
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: list[np.ndarray] = []
+        # Row -> cluster, -1 for rows that aren't indexed
+        self.labels = np.empty(0, dtype=np.int64)
+        self.trained_size = 0
+        self._training: Optional[threading.Thread] = None
+        self._trained = None
+        self._changes: list[tuple] = []
+
+    def needs_training(self, size: int) -> bool:
+        # Clusters are rebuilt when the store has doubled since training
+        return size >= self.min_size and (self.centroids is None or size > 2 * self.trained_size)
+
+    def train(self, matrix: np.ndarray):
+        """Train on matrix and install the clusters right away"""
+        self.wait()
+        self._changes = []
+        self._install(*self._fit(matrix, len(matrix)))
+
+    def wait(self):
+        """Finish a background training and install its clusters"""
+        if self._training is not None:
+            self._training.join()
+            self._install_trained()
+
+    def _start_training(self, matrix: np.ndarray):
+        # Rows below size are only changed through remove and move, which are
+        # logged from here on, so the thread can read them without a copy
+        size = len(matrix)
+        self._changes = []
+        self._trained = None
+
+        def run():
+            self._trained = self._fit(matrix, size)
+
+        self._training = threading.Thread(target=run, daemon=True)
+        self._training.start()
+
+    def _install_trained(self):
+        if self._training is None or self._training.is_alive():
+            return
+        self._training = None
+        if self._trained is not None:
+            self._install(*self._trained)
+            self._trained = None
+
+    def _fit(self, matrix: np.ndarray, size: int) -> tuple[np.ndarray, np.ndarray, int]:
+        cluster_count = max(1, int(np.sqrt(size)))
+        rng = np.random.default_rng(self.seed)
+        sample = matrix[np.sort(rng.choice(size, min(size, cluster_count * 64), replace=False))]
+        centroids = sample[rng.choice(len(sample), cluster_count, replace=False)].copy()
+        for _ in range(self.iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(labels, kind="stable")
+            clusters, starts = np.unique(labels[order], return_index=True)
+            # Empty clusters keep their centroid
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[clusters] = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        centroids = centroids.astype(np.float32)
+        labels = np.concatenate([np.argmax(matrix[start:min(start + 8192, size)] @ centroids.T, axis=1)
+                                 for start in range(0, size, 8192)]) if size else np.empty(0, dtype=np.int64)
+        return centroids, labels.astype(np.int64), size
+
+    def _install(self, centroids: np.ndarray, labels: np.ndarray, size: int):
+        self.centroids = centroids
+        self.labels = labels
+        self.trained_size = size
+        changes, self._changes = self._changes, []
+        for change in changes:
+            if change[0] == "add":
+                self._set_label(change[1], int(np.argmax(self.centroids @ change[2])))
+            elif change[0] == "remove":
+                self._set_label(change[1], -1)
+            else:
+                label = self.labels[change[1]] if change[1] < len(self.labels) else -1
+                self._set_label(change[1], -1)
+                self._set_label(change[2], label)
+        self._build_lists()
+
+    def _set_label(self, row: int, label: int):
+        if row >= len(self.labels):
+            if label < 0:
+                return
+            grown = np.full(max(row + 1, 2 * len(self.labels)), -1, dtype=np.int64)
+            grown[:len(self.labels)] = self.labels
+            self.labels = grown
+        self.labels[row] = label
+
+    def _build_lists(self):
+        rows = np.flatnonzero(self.labels >= 0)
+        order = rows[np.argsort(self.labels[rows], kind="stable")]
+        counts = np.bincount(self.labels[rows], minlength=len(self.centroids))
+        self.lists = np.split(order, np.cumsum(counts)[:-1])
+
+    def add(self, row: int, vector: np.ndarray):
+        if self._training is not None:
+            self._changes.append(("add", row, np.array(vector)))
+        if self.centroids is None:
+            return
+        label = int(np.argmax(self.centroids @ vector))
+        self._set_label(row, label)
+        self.lists[label] = np.append(self.lists[label], row)
+
+    def remove(self, row: int):
+        if self._training is not None:
+            self._changes.append(("remove", row))
+        if row < len(self.labels) and self.labels[row] >= 0:
+            label = self.labels[row]
+            self.lists[label] = self.lists[label][self.lists[label] != row]
+            self.labels[row] = -1
+
+    def move(self, old_row: int, new_row: int):
+        if self._training is not None:
+            self._changes.append(("move", old_row, new_row))
+        if old_row < len(self.labels) and self.labels[old_row] >= 0:
+            label = self.labels[old_row]
+            rows = self.lists[label]
+            rows[rows == old_row] = new_row
+            self.labels[old_row] = -1
+            self._set_label(new_row, label)
+
+    def search(self, matrix: np.ndarray, queries: np.ndarray, threshold: float) -> np.ndarray:
+        return self.score(matrix, queries, threshold)[0]
+
+    def score(self, matrix: np.ndarray, queries: np.ndarray, threshold: float) -> tuple[np.ndarray, np.ndarray]:
+        self._install_trained()
+        if self._training is None and self.needs_training(len(matrix)):
+            self._start_training(matrix)
+        if len(matrix) < self.min_size or self.centroids is None:
+            return exact_scores(matrix, queries, threshold)
+        if len(queries) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # Every query is only compared with the rows of its own closest clusters
+        nprobe = min(self.nprobe, len(self.centroids))
+        probed = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        found_rows, found_similarities = [], []
+        for query, labels in zip(queries, probed):
+            rows = np.concatenate([self.lists[label] for label in labels])
+            similarities = matrix[rows] @ query
+            relevant = similarities > threshold
+            found_rows.append(rows[relevant])
+            found_similarities.append(similarities[relevant])
+        rows = np.concatenate(found_rows)
+        similarities = np.concatenate(found_similarities)
+
+        # Keep the best similarity of rows found by several queries
+        order = np.lexsort((-similarities, rows))
+        rows, similarities = rows[order], similarities[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        return rows[first], similarities[first]
+
+    def state(self) -> dict:
+        if self.centroids is None:
+            return {}
+        return {
+            "centroids": self.centroids,
+            "assignment": self.labels,
+            "trained_size": np.array(self.trained_size)
+        }
+
+    @classmethod
+    def from_state(cls, state: dict, size: int) -> 'IVFIndex':
+        index = cls()
+        if "centroids" not in state:
+            return index
+        index.centroids = np.asarray(state["centroids"], dtype=np.float32)
+        index.trained_size = int(state["trained_size"])
+        index.labels = np.full(size, -1, dtype=np.int64)
+        assignment = np.asarray(state["assignment"], dtype=np.int64)[:size]
+        index.labels[:len(assignment)] = assignment
+        index._build_lists()
+        return index
+
+INDEX_TYPES = {
+    ExactIndex.kind: ExactIndex,
+    IVFIndex.kind: IVFIndex,
+}
+
+def create_index(kind: str = MEMORY_INDEX):
+    """New empty index of the configured kind"""
+    return INDEX_TYPES.get(kind, ExactIndex)()
@@ -0,0 +1,119 @@
+"""
+Ranking of recalled memories for the character prompt.
+
+Memories whose similarity to the recent messages clears min_similarity are
+ranked by
+
+    similarity + recency_weight * recency + importance_weight * importance
+
+where recency halves every MEMORY_RECENCY_HALF_LIFE newer memories and
+importance is the 0..1 value given when the memory was stored. The best
+top_k are kept as long as they fit into budget characters of prompt, so the
+prompt stays bounded however large the campaign memory grows.
+
+Every setting has an environment default and can be overridden per character
+through its memory_settings.
+"""
+
+import os
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_RETRIEVAL_SETTINGS = {
+    "top_k": int(os.getenv("MEMORY_TOP_K", "12")),
+    "budget": int(os.getenv("MEMORY_PROMPT_BUDGET", "2000")),
+    "min_similarity": float(os.getenv("MEMORY_MIN_SIMILARITY", "0.61")),
+    "recency_weight": float(os.getenv("MEMORY_RECENCY_WEIGHT", "0.1")),
+    "importance_weight": float(os.getenv("MEMORY_IMPORTANCE_WEIGHT", "0.1")),
+}
+MEMORY_RECENCY_HALF_LIFE = float(os.getenv("MEMORY_RECENCY_HALF_LIFE", "50"))
+
+# Characters a memory costs on top of its text in the prompt list
+ITEM_OVERHEAD = len("\n - ")
+
+def validate_settings(overrides) -> dict:
+    """
+    Check and coerce per-character overrides.
+
+    Raises ValueError unless overrides is a dict of known keys with
+    non-negative numbers; None values are dropped.
+    """
+    if not isinstance(overrides, dict):
+        raise ValueError("memory_settings must be an object")
+    settings = {}
+    for key, value in overrides.items():
+        if key not in DEFAULT_RETRIEVAL_SETTINGS:
+            raise ValueError(f"Unknown memory setting '{key}'")
+        if value is None:
+            continue
+        try:
+            if isinstance(value, bool):
+                raise TypeError()
+            number = type(DEFAULT_RETRIEVAL_SETTINGS[key])(value)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"Memory setting '{key}' must be a number")
+        if not number >= 0:
+            raise ValueError(f"Memory setting '{key}' must not be negative")
+        settings[key] = number
+    return settings
+
+def load_settings(overrides) -> dict:
+    """
+    Valid entries of saved overrides.
+
+    Entries that validate_settings() rejects are dropped with a warning, so a
+    bad value in a save file can't break memory retrieval at turn time.
+    """
+    if not overrides:
+        return {}
+    if not isinstance(overrides, dict):
+        logger.warning(f"Ignoring memory_settings that are not an object: {overrides!r}")
+        return {}
+    settings = {}
+    for key, value in overrides.items():
+        try:
+            settings.update(validate_settings({key: value}))
+        except ValueError as e:
+            logger.warning(f"Ignoring saved memory setting: {e}")
+    return settings
+
+def resolve_settings(overrides=None) -> dict:
+    """Environment defaults with the known keys of overrides applied"""
+    settings = dict(DEFAULT_RETRIEVAL_SETTINGS)
+    for key, value in (overrides or {}).items():
+        if key in settings and value is not None:
+            settings[key] = type(settings[key])(value)
+    return settings
+
+def recency(age: int) -> float:
+    """1.0 for the newest memory, halved every MEMORY_RECENCY_HALF_LIFE memories"""
+    return 0.5 ** (age / MEMORY_RECENCY_HALF_LIFE)
+
+def rank_memories(candidates, settings) -> list[str]:
+    """
+    Pick the memories for the prompt.
+
+    candidates are (item, similarity, age, importance) tuples, settings come
+    from resolve_settings(). Returns items best first.
+    """
+    scored = []
+    for item, similarity, age, importance in candidates:
+        score = (similarity
+                 + settings["recency_weight"] * recency(age)
+                 + settings["importance_weight"] * importance)
+        scored.append((score, item))
+    scored.sort(key=lambda entry: entry[0], reverse=True)
+
+    selected = []
+    remaining = settings["budget"]
+    for _, item in scored:
+        if len(selected) >= settings["top_k"]:
+            break
+        cost = len(item) + ITEM_OVERHEAD
+        # A long memory that doesn't fit leaves room for shorter ones below it
+        if cost <= remaining:
+            selected.append(item)
+            remaining -= cost
+    return selected
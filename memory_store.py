@@ -0,0 +1,166 @@
+"""
+Character memory with a row-aligned embedding matrix.
+
+MemoryStore behaves like the set of strings it replaces (add, discard, in,
+len, iteration) and keeps a contiguous float32 matrix with one normalized
+embedding per item. New items are embedded lazily in one batch on the next
+search; removing an item moves the last row into its slot, so retrieval is a
+single slice and matrix product. Searches go through a memory_index index,
+which is kept in sync with the rows and saved with the matrix next to the
+game save.
+"""
+
+import json
+import threading
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from memory_index import INDEX_TYPES, create_index
+
+def _default_encoder(texts: list[str]) -> np.ndarray:
+    # Loaded here so the store can be created without loading the model
+    from vector_compare import encode_many
+    return encode_many(texts)
+
+class MemoryStore:
+    def __init__(self, items: Iterable[str] = (), encoder: Optional[Callable[[list[str]], np.ndarray]] = None):
+        self._encoder = encoder or _default_encoder
+        self._items: list[str] = []
+        self._rows: dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        # Rows whose embedding has not been computed yet
+        self._pending: set[int] = set()
+        self._index = create_index()
+        self._lock = threading.RLock()
+        for item in items:
+            self.add(item)
+
+    def add(self, item: str):
+        with self._lock:
+            if item in self._rows:
+                return
+            self._rows[item] = len(self._items)
+            self._items.append(item)
+            self._pending.add(len(self._items) - 1)
+
+    def discard(self, item: str):
+        with self._lock:
+            row = self._rows.pop(item, None)
+            if row is None:
+                return
+            last = len(self._items) - 1
+            if row != last:
+                # Move the last item into the freed row
+                moved = self._items[last]
+                self._items[row] = moved
+                self._rows[moved] = row
+                # A pending last row has no vector yet and may lie past the matrix
+                if self._matrix is not None and last not in self._pending:
+                    self._matrix[row] = self._matrix[last]
+                self._index.remove(row)
+                self._index.move(last, row)
+                if last in self._pending:
+                    self._pending.add(row)
+                else:
+                    self._pending.discard(row)
+            else:
+                self._index.remove(row)
+            self._pending.discard(last)
+            self._items.pop()
+
+    def clear(self):
+        with self._lock:
+            self._items = []
+            self._rows = {}
+            self._matrix = None
+            self._pending = set()
+            self._index = create_index()
+
+    def __contains__(self, item) -> bool:
+        return item in self._rows
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._items))
+
+    def embeddings(self) -> np.ndarray:
+        """The embedding matrix, one row per item in iteration order"""
+        with self._lock:
+            if self._pending:
+                self._embed_pending()
+            if self._matrix is None:
+                return np.empty((0, 0), dtype=np.float32)
+            return self._matrix[:len(self._items)]
+
+    def _embed_pending(self):
+        rows = sorted(self._pending)
+        vectors = np.asarray(self._encoder([self._items[row] for row in rows]), dtype=np.float32)
+        self._ensure_capacity(len(self._items), vectors.shape[1])
+        self._matrix[rows] = vectors
+        self._pending.clear()
+        for row in rows:
+            self._index.add(row, self._matrix[row])
+
+    def _ensure_capacity(self, size: int, dimension: int):
+        if self._matrix is not None and self._matrix.shape[0] >= size:
+            return
+        capacity = max(size, 2 * (self._matrix.shape[0] if self._matrix is not None else 16))
+        matrix = np.zeros((capacity, dimension), dtype=np.float32)
+        if self._matrix is not None:
+            matrix[:self._matrix.shape[0]] = self._matrix
+        self._matrix = matrix
+
+    def search(self, queries: np.ndarray, threshold: float) -> set[str]:
+        """Items whose cosine similarity to any query row exceeds threshold"""
+        return set(self.score(queries, threshold))
+
+    def score(self, queries: np.ndarray, threshold: float) -> dict[str, float]:
+        """Best similarity to any query row of every item above threshold"""
+        with self._lock:
+            if not self._items or len(queries) == 0:
+                return {}
+            matrix = self.embeddings()
+            queries = np.asarray(queries, dtype=np.float32)
+            rows, similarities = self._index.score(matrix, queries, threshold)
+            return {self._items[row]: float(similarity) for row, similarity in zip(rows, similarities)}
+
+    def save(self, path: str, model: str = ""):
+        """Write items, embeddings and index to an .npz file; model names the encoder"""
+        with self._lock:
+            index_state = {f"index_{key}": value for key, value in self._index.state().items()}
+            np.savez(path, items=np.array(json.dumps(self._items)), matrix=self.embeddings(),
+                     model=np.array(model), index_kind=np.array(self._index.kind), **index_state)
+
+    def load(self, path: str, model: str = "") -> bool:
+        """
+        Restore embeddings and index saved by save().
+
+        Returns False and keeps the store unchanged when the file doesn't hold
+        exactly the current items or was written for another model; they are
+        embedded again on the next search.
+        """
+        with np.load(path) as data:
+            saved_model = str(data["model"]) if "model" in data.files else ""
+            if saved_model != model:
+                return False
+            items = json.loads(str(data["items"]))
+            with self._lock:
+                if len(items) != len(self._items) or set(items) != set(self._items):
+                    return False
+                self._items = items
+                self._rows = {item: row for row, item in enumerate(items)}
+                self._pending = set()
+                self._matrix = np.array(data["matrix"], dtype=np.float32) if items else None
+                index = create_index()
+                if str(data["index_kind"]) == index.kind:
+                    state = {key[len("index_"):]: data[key] for key in data.files if key.startswith("index_")}
+                    index = INDEX_TYPES[index.kind].from_state(state, len(items))
+                else:
+                    for row in range(len(items)):
+                        index.add(row, self._matrix[row])
+                self._index = index
+                return True
@@ -1,35 +1,64 @@
 # Determine which character should act first
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from app_socket import send_socket_message
-from ai_utils import generate_response
-from character import Character, get_active_characters, get_character_by_id, get_characters
+from ai_utils import generate_response, get_request_api_key
+from cancellation import CancellationToken, TurnCancelled, cancel_turns, start_turn
+from character import Character, build_group_prompt, build_table_rules_prompt, get_active_characters, get_character_by_id, get_characters
 from character_tools import build_dialogue_messages_list
-from dialog_history import DialogueMessage, append_to_dialog_history
-from update_scene import do_update_scene
+from dialog_history import DialogueMessage, append_to_dialog_history, get_dialogue_fingerprint, get_dialogue_history
+from post_turn import post_turn_queue
+from single_flight import SingleFlight
+from turn_selector import select_acting_character
+from update_scene import flush_scene_updates, get_current_scene, schedule_scene_update
 from queue import Queue
 from google.genai.types import FunctionDeclaration, Tool, Schema
 
-character_to_act: str | None = None
+# "analyzer" picks the character and generates its reply in two requests,
+# "single_call" does both in one structured-output request
+TURN_MODE = os.getenv("TURN_MODE", "analyzer")
+# Choose the next character (and with SPECULATIVE_DRAFTS also write its reply)
+# as soon as the GM message arrives; used by gm_continue if the history is unchanged
+SPECULATIVE_TURNS = os.getenv("SPECULATIVE_TURNS")
+SPECULATIVE_DRAFTS = os.getenv("SPECULATIVE_DRAFTS")
+# Round mode: replies drafted at the same time, and an optional revision pass
+ROUND_MAX_PARALLEL = int(os.getenv("ROUND_MAX_PARALLEL", "3"))
+ROUND_REVISE = os.getenv("ROUND_REVISE")
 
-def request_character_response(character_id: str):
-    global character_to_act
-    if not character_to_act:
-        character_to_act = character_id
+# Concurrent Continue requests for the same history share one turn
+_turn_flight = SingleFlight()
 
-def process_character(character: Character):
-    result = character.generate_response()
-    if not result:
+def process_character(character: Character, cancel_token: CancellationToken | None = None, api_key=None):
+    if not character.active:
         return False
-    text = result.text
-        
+    # Streamed deltas and the final message share this id
+    message_id = str(uuid.uuid4())
+    result, function_calls = character.draft_response(message_id, cancel_token, api_key)
+    if not result or not result.text:
+        return False
+    # The reply is in history and on the clients before its speech and tools start
+    publish_character_reply(character, result.text, message_id, cancel_token, api_key)
+    character.handle_reply(result.text, function_calls, cancel_token, api_key)
+
+def publish_character_reply(character: Character, text: str, message_id: str,
+                            cancel_token: CancellationToken | None = None, api_key=None):
+    if cancel_token:
+        cancel_token.raise_if_cancelled()
+
     # Add character response to game_state messages
-    message = DialogueMessage(character.name, text, character.avatar, character.id)
+    message = DialogueMessage(character.name, text, character.avatar, character.id, id=message_id)
     append_to_dialog_history(message)
     
     
     # output character response to the chat
     send_socket_message('new_message', message.to_dict())
 
-    do_update_scene(character.name, text)
+    # Scene updates are batched and run in the background, the GM can continue
+    schedule_scene_update(character.name, text, cancel_token, api_key)
+    return message
 
 request_character_response_declaration = Tool(function_declarations=[FunctionDeclaration(
     name="request_character_response",
@@ -47,8 +76,22 @@ request_character_response_declaration = Tool(function_declarations=[FunctionDec
     )
 )])
 
-def analyzer_process(prompt: str):
-    global character_to_act
+def get_fallback_character(characters: dict[str, Character]) -> Character:
+    """The group leader, or the first character if there is none"""
+    character_item = next((char for char in characters.items() if char[1].is_leader), None)
+    if character_item:
+        return character_item[1]  # Get the Character object from the tuple
+    first_char_id = list(characters.keys())[0]
+    return get_character_by_id(first_char_id)
+
+def choose_acting_character(prompt: str, cancel_token: CancellationToken | None = None, api_key=None) -> Character:
+    """Ask the analyzer which character reacts, falling back to the leader"""
+    # Collect the choice locally, so concurrent turns can't overwrite each other
+    chosen_ids: list[str] = []
+
+    def request_character_response(character_id: str):
+        if not chosen_ids:
+            chosen_ids.append(character_id)
     
     # Pass the tool function to generate_response
     generate_response(
@@ -57,34 +100,30 @@ def analyzer_process(prompt: str):
         tools=[
             (request_character_response, request_character_response_declaration),
         ],
-        loggerOn=False
+        loggerOn=False,
+        stage="analyzer",
+        api_key=api_key,
+        cancel_token=cancel_token
     )
 
-    print("GOT CHARACTER TO ACT: ", character_to_act)
+    character_id = chosen_ids[0] if chosen_ids else None
+    print("GOT CHARACTER TO ACT: ", character_id)
 
     characters = get_active_characters()
     print("characters: ", characters)
-    character_id = character_to_act
-    character_to_act = None
     print("character_id: ", character_id)
     character = get_character_by_id(character_id)
 
     print("character_id: ", character_id)
     if not character:
-        # find leader in characters or first character
-        character_item = next((char for char in characters.items() if char[1].is_leader), None)
-        if character_item:
-            character = character_item[1]  # Get the Character object from the tuple
-        else:
-            first_char_id = list(characters.keys())[0]
-            character = get_character_by_id(first_char_id)
+        character = get_fallback_character(characters)
     print("Using character_id: ", character.id)
+    return character
 
-    process_character(character)
-    
-    
+def analyzer_process(prompt: str, cancel_token: CancellationToken | None = None, api_key=None):
+    process_character(choose_acting_character(prompt, cancel_token, api_key), cancel_token, api_key)
 
-def decide_acting_character_for_master():
+def build_master_analyzer_prompt():
     active_characters = get_active_characters()
     # Add character information to the prompt
     characters_info = ""
@@ -115,7 +154,290 @@ def decide_acting_character_for_master():
                "# Message history:\n"
                f"{build_dialogue_messages_list()}"
                )
-    
-    analyzer_process(prompt)
-    
+    return prompt
+
+def choose_character_locally() -> Character | None:
+    """The character the last message obviously addresses, without an LLM call"""
+    character = select_acting_character(get_dialogue_history(), list(get_active_characters().values()))
+    if character:
+        print("Selected character locally: ", character.id)
+    return character
+
+def choose_character_for_master(cancel_token: CancellationToken | None = None, api_key=None) -> Character:
+    return choose_character_locally() or choose_acting_character(build_master_analyzer_prompt(), cancel_token, api_key)
+
+def decide_acting_character_for_master(cancel_token: CancellationToken | None = None, api_key=None):
+    character = choose_character_locally()
+    if character:
+        return process_character(character, cancel_token, api_key)
+    analyzer_process(build_master_analyzer_prompt(), cancel_token, api_key)
+
+def build_turn_schema(active_characters: dict[str, Character]) -> Schema:
+    return Schema(
+        type="OBJECT",
+        properties={
+            "character_id": Schema(
+                type="STRING",
+                description="The ID of the character who reacts",
+                enum=list(active_characters)
+            ),
+            "message": Schema(
+                type="STRING",
+                description="The reply of that character"
+            )
+        },
+        required=["character_id", "message"]
+    )
+
+def build_turn_prompt(active_characters: dict[str, Character]):
+    """Static instructions and the per-turn context of a single-call turn"""
+    static_prompt = ("You are the players of a RPG campaign, each controlling one character of the group.\n"
+                     "Characters speak in turns and don't interrupt each other.\n"
+                     "A character who has already responded doesn't respond again.\n"
+                     "Analyze the message history and choose the character who is most suitable to react.\n"
+                     "If a suitable character cannot be determined, let the group leader act.\n"
+                     "Then write the reply of that character, following its role and the rules below.\n"
+                     "Answer with the character's ID and its reply.\n\n"
+                     f"{build_table_rules_prompt()}")
+
+    characters_info = ""
+    for char in active_characters.values():
+        leader_status = "Group Leader" if char.is_leader else "Group Member"
+        characters_info += (f"# Character {char.name} ({leader_status}), id: {char.id}\n"
+                            f"{char.build_role_prompt()}"
+                            f"{char.build_state_prompt(char.get_prompt_memory())}")
+
+    prompt = ("# Other characters in the group:\n"
+              f"{build_group_prompt()}\n\n"
+              f"{characters_info}"
+              "# Current game context:\n"
+              f"{get_current_scene()}\n\n"
+              "# Message history:\n"
+              f"{build_dialogue_messages_list()}\n")
+    return static_prompt, prompt
+
+def resolve_turn_single_call(cancel_token: CancellationToken | None = None, api_key=None):
+    """Choose the acting character and write its reply with one request"""
+    active_characters = get_active_characters()
+    if not active_characters:
+        return False
+
+    static_prompt, prompt = build_turn_prompt(active_characters)
+    result = generate_response(prompt, temperature=0.85, stage="turn", static_prefix=static_prompt,
+                               cache_owner="turn", response_schema=build_turn_schema(active_characters),
+                               api_key=api_key, cancel_token=cancel_token)
+
+    try:
+        turn = json.loads(result.text)
+        character_id = turn.get("character_id")
+        text = (turn.get("message") or "").strip()
+    except (TypeError, ValueError, AttributeError) as e:
+        print(f"Invalid single-call turn response, using the analyzer instead: {e}")
+        return decide_acting_character_for_master(cancel_token, api_key)
+
+    print("GOT CHARACTER TO ACT: ", character_id)
+    character = active_characters.get(character_id) or get_fallback_character(active_characters)
+    if not text:
+        # The model picked a character but wrote nothing, let it speak on its own
+        return process_character(character, cancel_token, api_key)
+
+    publish_character_reply(character, text, str(uuid.uuid4()), cancel_token, api_key)
+    character.handle_reply(text, cancel_token=cancel_token, api_key=api_key)
+
+class _Speculation:
+    """Acting character, and optionally its draft reply, computed before gm_continue"""
+
+    def __init__(self, api_key=None):
+        # The GM's key, the speculation thread has no request context
+        self.api_key = api_key
+        self.key = None
+        self.character: Character | None = None
+        self.draft = None
+        self.done = threading.Event()
+        self.cancel_token = CancellationToken()
+
+_speculation_lock = threading.Lock()
+_speculation: _Speculation | None = None
+
+def get_turn_key():
+    """The history and scene a turn is computed from"""
+    return get_dialogue_fingerprint(), get_current_scene()
+
+def speculate_turn():
+    """Start choosing the next acting character in the background (SPECULATIVE_TURNS)"""
+    global _speculation
+    if not SPECULATIVE_TURNS or TURN_MODE == "single_call":
+        return None
+    speculation = _Speculation(get_request_api_key())
+    with _speculation_lock:
+        previous, _speculation = _speculation, speculation
+    if previous:
+        # The history changed, stop working on the old one
+        previous.cancel_token.cancel()
+    threading.Thread(target=_run_speculation, args=(speculation,), name="turn-speculation", daemon=True).start()
+    return speculation
+
+def _run_speculation(speculation: _Speculation):
+    try:
+        # Let the previous reply's scene update land first
+        flush_scene_updates()
+        post_turn_queue.join()
+        speculation.key = get_turn_key()
+        speculation.character = choose_character_for_master(speculation.cancel_token, speculation.api_key)
+        if SPECULATIVE_DRAFTS and speculation.character:
+            result, function_calls = speculation.character.draft_response(cancel_token=speculation.cancel_token,
+                                                                          api_key=speculation.api_key)
+            if result and result.text:
+                speculation.draft = (result.text, function_calls)
+    except TurnCancelled:
+        print("Speculative turn cancelled")
+    except Exception as e:
+        print(f"Speculative turn failed: {e}")
+    finally:
+        speculation.done.set()
+
+def take_speculation(cancel_token: CancellationToken | None = None) -> _Speculation | None:
+    """
+    Return the speculation for the current history, or None if there is none or it is stale.
+
+    Cancelling cancel_token, the token of the turn taking it, also cancels
+    the speculation and stops waiting for it with TurnCancelled.
+    """
+    global _speculation
+    with _speculation_lock:
+        speculation, _speculation = _speculation, None
+    if speculation is None:
+        return None
+    if cancel_token:
+        cancel_token.add_callback(speculation.cancel_token.cancel)
+    if speculation.key is None or speculation.key == get_turn_key():
+        # Still running for this history, waiting is faster than starting over
+        while not speculation.done.wait(0.05):
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+    if cancel_token:
+        cancel_token.raise_if_cancelled()
+    if speculation.key != get_turn_key() or not speculation.character or not speculation.character.active:
+        print("Dropping stale speculative turn")
+        speculation.cancel_token.cancel()
+        return None
+    return speculation
+
+def cancel_speculation():
+    global _speculation
+    with _speculation_lock:
+        speculation, _speculation = _speculation, None
+    if speculation:
+        speculation.cancel_token.cancel()
+
+def play_speculation(speculation: _Speculation, cancel_token: CancellationToken | None = None, api_key=None):
+    character = speculation.character
+    print("Using speculative character_id: ", character.id)
+    if not speculation.draft:
+        return process_character(character, cancel_token, api_key)
+    text, function_calls = speculation.draft
+    publish_character_reply(character, text, str(uuid.uuid4()), cancel_token, api_key)
+    character.handle_reply(text, function_calls, cancel_token, api_key)
+
+def resolve_turn(cancel_token: CancellationToken | None = None, api_key=None):
+    """
+    Play one turn for the current history.
+
+    api_key is the requesting session's key; it is passed on explicitly
+    because the scene update and other follow-up work run in other threads.
+    """
+    if TURN_MODE == "single_call":
+        return resolve_turn_single_call(cancel_token, api_key)
+    speculation = take_speculation(cancel_token)
+    if speculation:
+        return play_speculation(speculation, cancel_token, api_key)
+    return decide_acting_character_for_master(cancel_token, api_key)
+
+def get_round_order(characters: list[Character]) -> list[Character]:
+    """The group leader speaks first, the others keep the party order"""
+    return sorted(characters, key=lambda char: not char.is_leader)
+
+def revise_round_reply(character: Character, draft: str, earlier_replies: list[DialogueMessage],
+                       cancel_token: CancellationToken | None = None, api_key=None) -> str:
+    """Cheap second pass: adjust a draft to the replies published before it"""
+    earlier_text = "\n".join(f"{message.sender}: {message.message}" for message in earlier_replies)
+    prompt = (f"You are {character.name}, a RPG player. You wrote a reply before hearing the others.\n"
+              "If the reply repeats or contradicts what was said before it, rewrite it briefly in the same voice.\n"
+              "Otherwise return it unchanged. Return only the reply.\n\n"
+              "# Said before your reply:\n"
+              f"{earlier_text}\n\n"
+              "# Your reply:\n"
+              f"{draft}\n")
+    result = generate_response(prompt, temperature=0.5, stage="revision", api_key=api_key, cancel_token=cancel_token)
+    return result.text.strip() if result and result.text and result.text.strip() else draft
+
+def run_round(character_ids: list[str] | None = None, cancel_token: CancellationToken | None = None, api_key=None):
+    """
+    Let several characters reply to the same history.
+
+    Replies are drafted concurrently (at most ROUND_MAX_PARALLEL at a time),
+    then published in round order. With ROUND_REVISE set, every reply after
+    the first gets a short second pass that sees the replies before it.
+    The drafts run in worker threads, so the session's key is resolved here.
+    """
+    api_key = api_key or get_request_api_key()
+    active_characters = get_active_characters()
+    characters = [active_characters[char_id] for char_id in character_ids if char_id in active_characters] \
+        if character_ids else list(active_characters.values())
+    if not characters:
+        return []
+
+    with ThreadPoolExecutor(max_workers=ROUND_MAX_PARALLEL, thread_name_prefix="round") as executor:
+        drafts = {char.id: executor.submit(char.draft_response, cancel_token=cancel_token, api_key=api_key)
+                  for char in characters}
+
+    published: list[DialogueMessage] = []
+    for character in get_round_order(characters):
+        try:
+            result, function_calls = drafts[character.id].result()
+        except TurnCancelled:
+            raise
+        except Exception as e:
+            print(f"Error drafting round reply for {character.name}: {e}")
+            continue
+        if not result or not result.text:
+            continue
+
+        text = result.text
+        if ROUND_REVISE and published:
+            text = revise_round_reply(character, text, published, cancel_token, api_key)
+        published.append(publish_character_reply(character, text, str(uuid.uuid4()), cancel_token, api_key))
+        character.handle_reply(text, function_calls, cancel_token, api_key)
+    return published
+
+def _run_cancellable(fn, *args, **kwargs):
+    """Run a turn function with a new cancellation token"""
+    return fn(*args, cancel_token=start_turn(), **kwargs)
+
+def continue_round(character_ids: list[str] | None = None):
+    """Run a round for the current history, or join the round already running for it"""
+    try:
+        _, shared = _turn_flight.do(("round", get_dialogue_fingerprint()), _run_cancellable, run_round, character_ids,
+                                    api_key=get_request_api_key())
+    except TurnCancelled:
+        print("Round cancelled")
+        return
+    if shared:
+        print("Joined round already in progress")
+
+def continue_turn():
+    """Run a turn for the current history, or join the turn already running for it"""
+    try:
+        # Resolved here, in the socket handler, while the session's request context exists
+        _, shared = _turn_flight.do(get_dialogue_fingerprint(), _run_cancellable, resolve_turn,
+                                    api_key=get_request_api_key())
+    except TurnCancelled:
+        print("Turn cancelled")
+        return
+    if shared:
+        print("Joined turn already in progress")
 
+def cancel_turn() -> int:
+    """Cancel running turns, their queued post-turn work and the pending speculation"""
+    cancel_speculation()
+    return cancel_turns()
@@ -0,0 +1,328 @@
+"""
+Local stand-in for the Gemini endpoint that generate_response targets.
+
+Serves generateContent, streamGenerateContent and cachedContents in the
+Gemini REST format so the whole gm_continue -> character -> tools -> scene
+pipeline can run offline, for benchmarks and load tests.
+
+Replies come from, in order:
+  1. scripted rules (--script), matched by substring or regex against the prompt
+  2. recorded responses (--replay), matched by prompt hash
+  3. an upstream server (--upstream), optionally recorded with --record
+  4. a generated default: text, a function call to the first declared tool
+     with arguments built from its schema, or JSON for a response schema
+
+Usage:
+    python mock_llm_server.py --port 3069 --latency lognormal:-0.5,0.4 --seed 1
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from typing import Any, Optional
+
+from aiohttp import ClientSession, web
+
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+class LatencyModel:
+    """
+    Random delay in seconds, described as "<kind>:<params>".
+
+    fixed:0.5            always 0.5 s
+    uniform:0.2,1.5      uniform between 0.2 and 1.5 s
+    normal:0.8,0.2       normal with mean 0.8 and deviation 0.2 (clamped at 0)
+    lognormal:-0.5,0.4   lognormal with mu -0.5 and sigma 0.4
+    """
+
+    def __init__(self, spec: str, rng: random.Random):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(value) for value in params.split(",") if value]
+        self.rng = rng
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"Invalid latency spec: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(*self.params))
+        return self.rng.lognormvariate(*self.params)
+
+def _prompt_text(contents) -> str:
+    """Flatten request contents to the text used for matching"""
+    texts = []
+    for content in contents or []:
+        for part in content.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"])
+    return "\n".join(texts)
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / 4)) if text else 0
+
+class MockResponder:
+    """Builds Gemini-format replies for a request"""
+
+    def __init__(self, rng: random.Random, script: Optional[list[dict]] = None,
+                 recordings: Optional[dict[str, dict]] = None):
+        self.rng = rng
+        self.script = script or []
+        self.recordings = recordings or {}
+        self.counter = 0
+
+    def sample_schema(self, schema: dict, name: str = "value") -> Any:
+        """Build a value that satisfies a (Gemini-style) schema"""
+        schema_type = str(schema.get("type", "STRING")).upper()
+        if schema.get("enum"):
+            return self.rng.choice(schema["enum"])
+        if schema_type == "OBJECT":
+            properties = schema.get("properties", {})
+            return {key: self.sample_schema(value, key) for key, value in properties.items()}
+        if schema_type == "ARRAY":
+            return [self.sample_schema(schema.get("items", {}), name)]
+        if schema_type == "INTEGER":
+            return self.rng.randint(0, 10)
+        if schema_type == "NUMBER":
+            return round(self.rng.random(), 3)
+        if schema_type == "BOOLEAN":
+            return self.rng.random() < 0.5
+        return f"mock {name} {self.counter}"
+
+    def scripted_content(self, text: str) -> Optional[dict]:
+        for rule in self.script:
+            pattern = rule.get("match", "")
+            if rule.get("regex"):
+                matched = re.search(pattern, text) is not None
+            else:
+                matched = pattern in text
+            if matched:
+                parts = []
+                if rule.get("text") is not None:
+                    parts.append({"text": rule["text"]})
+                if rule.get("function_call"):
+                    parts.append({"functionCall": rule["function_call"]})
+                return {"parts": parts}
+        return None
+
+    def _generated(self, body: dict, tools: list[dict]) -> dict:
+        config = body.get("generationConfig", {})
+        if config.get("responseSchema"):
+            value = self.sample_schema(config["responseSchema"])
+            return {"parts": [{"text": json.dumps(value, ensure_ascii=False)}]}
+
+        parts = [{"text": f"Mock response {self.counter}."}]
+        declarations = [declaration for tool in tools for declaration in tool.get("functionDeclarations", [])]
+        if declarations:
+            declaration = declarations[0]
+            args = self.sample_schema(declaration.get("parameters", {"type": "OBJECT"}))
+            parts.append({"functionCall": {"name": declaration["name"], "args": args}})
+        return {"parts": parts}
+
+    def respond(self, model: str, body: dict, text: str, tools: list[dict]) -> dict:
+        """Return a full generateContent response for the request"""
+        self.counter += 1
+        recorded = self.recordings.get(prompt_hash(text))
+        if recorded is not None:
+            return recorded
+
+        content = self.scripted_content(text) or self._generated(body, tools)
+        output_text = "".join(part.get("text", "") for part in content["parts"])
+        prompt_tokens = _estimate_tokens(text)
+        output_tokens = _estimate_tokens(output_text)
+        return {
+            "candidates": [{
+                "content": {"role": "model", "parts": content["parts"]},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens
+            },
+            "modelVersion": model
+        }
+
+def split_into_chunks(response: dict, chunk_chars: int) -> list[dict]:
+    """Split a response into streamed chunks; function calls go in the last chunk"""
+    candidate = response["candidates"][0]
+    parts = candidate["content"]["parts"]
+    text = "".join(part.get("text", "") for part in parts)
+    calls = [part for part in parts if "functionCall" in part]
+    pieces = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+
+    chunks = []
+    for index, piece in enumerate(pieces):
+        last = index == len(pieces) - 1
+        chunk_parts = ([{"text": piece}] if piece else []) + (calls if last else [])
+        chunk = {"candidates": [{"content": {"role": "model", "parts": chunk_parts}, "index": 0}],
+                 "modelVersion": response.get("modelVersion")}
+        if last:
+            chunk["candidates"][0]["finishReason"] = "STOP"
+            chunk["usageMetadata"] = response.get("usageMetadata")
+        chunks.append(chunk)
+    return chunks
+
+class MockLLMServer:
+    def __init__(self, responder: MockResponder, latency: LatencyModel, chunk_delay: LatencyModel,
+                 chunk_chars: int = 24, upstream: Optional[str] = None, record_path: Optional[str] = None):
+        self.responder = responder
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_chars = chunk_chars
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.record_path = record_path
+        self.cached_contents: dict[str, dict] = {}
+        self.request_count = 0
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/{version}/models/{model_action}", self.handle_model_action)
+        app.router.add_post("/{version}/cachedContents", self.handle_create_cache)
+        app.router.add_delete("/{version}/cachedContents/{cache_id}", self.handle_delete_cache)
+        app.router.add_get("/mock/stats", self.handle_stats)
+        return app
+
+    def _resolve_request(self, body: dict) -> tuple[str, list[dict]]:
+        """Prompt text and tools, including any referenced cached content"""
+        text = _prompt_text(body.get("contents"))
+        tools = list(body.get("tools", []))
+        cached = self.cached_contents.get(body.get("cachedContent", ""))
+        if cached:
+            text = _prompt_text(cached.get("contents")) + text
+            tools = list(cached.get("tools", [])) + tools
+        return text, tools
+
+    async def _reply(self, request: web.Request, model: str, body: dict) -> dict:
+        text, tools = self._resolve_request(body)
+        scripted_or_recorded = self.responder.scripted_content(text) or prompt_hash(text) in self.responder.recordings
+        if self.upstream and not scripted_or_recorded:
+            response = await self._proxy(request, body)
+            self._record(text, response)
+            return response
+        await asyncio.sleep(self.latency.sample())
+        return self.responder.respond(model, body, text, tools)
+
+    async def _proxy(self, request: web.Request, body: dict) -> dict:
+        # Always ask upstream for the full response; streaming is re-chunked locally
+        path = request.path.replace(":streamGenerateContent", ":generateContent")
+        headers = {key: value for key, value in request.headers.items()
+                   if key.lower() in ("x-goog-api-key", "authorization", "content-type")}
+        async with ClientSession() as session:
+            async with session.post(self.upstream + path, json=body, headers=headers) as upstream_response:
+                return await upstream_response.json()
+
+    def _record(self, text: str, response: dict):
+        self.responder.recordings[prompt_hash(text)] = response
+        if self.record_path:
+            with open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"prompt_hash": prompt_hash(text), "response": response}, ensure_ascii=False) + "\n")
+
+    async def handle_model_action(self, request: web.Request):
+        model, _, action = request.match_info["model_action"].partition(":")
+        body = await request.json()
+        self.request_count += 1
+
+        if action == "generateContent":
+            return web.json_response(await self._reply(request, model, body))
+
+        if action == "streamGenerateContent":
+            response = await self._reply(request, model, body)
+            stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await stream.prepare(request)
+            for index, chunk in enumerate(split_into_chunks(response, self.chunk_chars)):
+                if index:
+                    await asyncio.sleep(self.chunk_delay.sample())
+                await stream.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+            await stream.write_eof()
+            return stream
+
+        raise web.HTTPNotFound(text=f"Unsupported action: {action}")
+
+    async def handle_create_cache(self, request: web.Request):
+        body = await request.json()
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        ttl = float(str(body.get("ttl", "3600s")).rstrip("s"))
+        self.cached_contents[name] = body
+        expire_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl))
+        return web.json_response({
+            "name": name,
+            "model": body.get("model"),
+            "displayName": body.get("displayName"),
+            "expireTime": expire_time,
+            "usageMetadata": {"totalTokenCount": _estimate_tokens(_prompt_text(body.get("contents")))}
+        })
+
+    async def handle_delete_cache(self, request: web.Request):
+        self.cached_contents.pop(f"cachedContents/{request.match_info['cache_id']}", None)
+        return web.json_response({})
+
+    async def handle_stats(self, request: web.Request):
+        return web.json_response({
+            "requests": self.request_count,
+            "cached_contents": len(self.cached_contents)
+        })
+
+def load_script(path: Optional[str]) -> list[dict]:
+    """Load scripted rules from a JSON list"""
+    if not path:
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_recordings(path: Optional[str]) -> dict[str, dict]:
+    """Load recorded responses from a JSONL file written with --record"""
+    recordings = {}
+    if not path:
+        return recordings
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                recordings[record["prompt_hash"]] = record["response"]
+    return recordings
+
+def create_server(latency="fixed:0", chunk_delay="fixed:0", chunk_chars=24, seed=None,
+                  script_path=None, replay_path=None, upstream=None, record_path=None) -> MockLLMServer:
+    rng = random.Random(seed)
+    responder = MockResponder(rng, load_script(script_path), load_recordings(replay_path))
+    return MockLLMServer(responder, LatencyModel(latency, rng), LatencyModel(chunk_delay, rng),
+                         chunk_chars=chunk_chars, upstream=upstream, record_path=record_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Gemini API for offline benchmarks")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=3069)
+    parser.add_argument("--latency", default="fixed:0", help="Response latency, e.g. fixed:0.5, uniform:0.2,1.5, normal:0.8,0.2, lognormal:-0.5,0.4")
+    parser.add_argument("--chunk-delay", default="fixed:0.02", help="Delay between streamed chunks, same format as --latency")
+    parser.add_argument("--chunk-chars", type=int, default=24, help="Characters per streamed chunk")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for deterministic latencies and generated replies")
+    parser.add_argument("--script", help="JSON list of rules: {match, regex?, text?, function_call?}")
+    parser.add_argument("--replay", help="JSONL file of recorded responses to serve by prompt hash")
+    parser.add_argument("--upstream", help="Forward unmatched requests to this Gemini endpoint")
+    parser.add_argument("--record", help="Append upstream responses to this JSONL file")
+    args = parser.parse_args()
+
+    server = create_server(args.latency, args.chunk_delay, args.chunk_chars, args.seed,
+                           args.script, args.replay, args.upstream, args.record)
+    logger.info(f"Mock LLM server listening on http://{args.host}:{args.port}")
+    web.run_app(server.build_app(), host=args.host, port=args.port, print=None)
+
+if __name__ == '__main__':
+    main()
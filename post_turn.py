@@ -0,0 +1,92 @@
+"""
+Background queues for the work that follows a character's reply.
+
+Tool calls, the scene rewrite and text to speech don't change the reply the
+GM reads, so they run after the message is published and the GM can continue
+right away. Every queue has one worker thread, which keeps its tasks in
+submission order (scene updates are applied in message order). Progress is
+reported with post_turn_status events. Tasks of a cancelled turn are skipped.
+"""
+
+import itertools
+import queue
+import threading
+
+from app_socket import send_socket_message
+from cancellation import CancellationToken, TurnCancelled
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+class BackgroundQueue:
+    """Runs submitted tasks one by one on a daemon worker thread"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: queue.Queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, task_name: str, fn, *args, cancel_token: CancellationToken | None = None, **kwargs) -> int:
+        """Queue fn(*args, **kwargs) and return the task id; it is skipped if cancel_token is cancelled first"""
+        task_id = next(self._ids)
+        self._ensure_worker()
+        self._tasks.put((task_id, task_name, fn, args, kwargs, cancel_token))
+        self._notify(task_id, task_name, "queued")
+        return task_id
+
+    def pending(self) -> int:
+        """Number of tasks queued or running"""
+        return self._tasks.unfinished_tasks
+
+    def join(self):
+        """Block until every queued task has finished"""
+        self._tasks.join()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=f"{self.name}-worker", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            task_id, task_name, fn, args, kwargs, cancel_token = self._tasks.get()
+            if cancel_token and cancel_token.cancelled:
+                self._finish(task_id, task_name, "cancelled")
+                continue
+            self._notify(task_id, task_name, "started")
+            try:
+                fn(*args, **kwargs)
+                status, error = "completed", None
+            except TurnCancelled:
+                status, error = "cancelled", None
+            except Exception as e:
+                logger.error(f"Error in {self.name} task {task_name}: {e}", exc_info=True)
+                status, error = "error", str(e)
+            self._finish(task_id, task_name, status, error)
+
+    def _finish(self, task_id, task_name, status, error=None):
+        # Report before task_done, so join() also waits for the last event
+        try:
+            self._notify(task_id, task_name, status, error, finished=True)
+        finally:
+            self._tasks.task_done()
+
+    def _notify(self, task_id, task_name, status, error=None, finished=False):
+        data = {
+            'queue': self.name,
+            'id': task_id,
+            'task': task_name,
+            'status': status,
+            'pending': self.pending() - 1 if finished else self.pending()
+        }
+        if error:
+            data['error'] = error
+        send_socket_message('post_turn_status', data)
+
+# Tool calls and scene updates
+post_turn_queue = BackgroundQueue("post-turn")
+# Speech has its own queue, so playing audio doesn't hold up the scene update
+speech_queue = BackgroundQueue("speech")
@@ -0,0 +1,120 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Callable, Optional
+
+# Lower value is served first
+STAGE_PRIORITIES = {
+    "character": 0,
+    "turn": 0,
+    "revision": 0,
+    "transcription": 0,
+    "analyzer": 1,
+    "tools": 2,
+    "scene": 3,
+}
+DEFAULT_PRIORITY = 1
+
+def get_stage_priority(stage: Optional[str]) -> int:
+    """Map a pipeline stage label to its queue priority"""
+    return STAGE_PRIORITIES.get(stage, DEFAULT_PRIORITY)
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute: float, capacity: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now: float) -> bool:
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until(self, count: float, now: float) -> float:
+        """Seconds until count tokens will have accumulated"""
+        self.refill(now)
+        missing = count - self.tokens
+        return max(0.0, missing / self.rate)
+
+class _KeyQueue:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.dispatcher: Optional[asyncio.Task] = None
+
+class PriorityRateLimiter:
+    """
+    Per-key token buckets with a priority queue of waiting requests.
+
+    Runs on an asyncio loop: waiting requests await a future instead of
+    sleeping in a thread. When a request has to queue, on_queued is called with
+    the key, the stage, the queue depth and the estimated wait in seconds.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: int,
+                 on_queued: Optional[Callable[[str, Optional[str], int, float], None]] = None):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity
+        self.on_queued = on_queued
+        self._queues: dict[str, _KeyQueue] = {}
+        self._sequence = itertools.count()
+
+    def _get_queue(self, key: str) -> _KeyQueue:
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = _KeyQueue(TokenBucket(self.rate_per_minute, self.capacity))
+            self._queues[key] = queue
+        return queue
+
+    def queue_depth(self, key: str) -> int:
+        """Number of requests waiting for a token on key"""
+        queue = self._queues.get(key)
+        if queue is None:
+            return 0
+        return sum(1 for _, _, future in queue.waiters if not future.done())
+
+    async def acquire(self, key: str, stage: Optional[str] = None) -> float:
+        """Wait for a token on key and return the seconds spent waiting"""
+        queue = self._get_queue(key)
+        now = time.monotonic()
+        # Fast path: nobody is waiting and a token is available
+        if not queue.waiters and queue.bucket.try_take(now):
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(queue.waiters, (get_stage_priority(stage), next(self._sequence), future))
+        depth = self.queue_depth(key)
+        eta = queue.bucket.time_until(depth, now)
+        if self.on_queued:
+            self.on_queued(key, stage, depth, eta)
+
+        if queue.dispatcher is None or queue.dispatcher.done():
+            queue.dispatcher = asyncio.create_task(self._dispatch(queue))
+
+        await future
+        return time.monotonic() - now
+
+    async def _dispatch(self, queue: _KeyQueue):
+        """Hand out tokens to waiters in priority order as they refill"""
+        while queue.waiters:
+            # Drop waiters whose requests were cancelled
+            while queue.waiters and queue.waiters[0][2].done():
+                heapq.heappop(queue.waiters)
+            if not queue.waiters:
+                break
+            now = time.monotonic()
+            if queue.bucket.try_take(now):
+                _, _, future = heapq.heappop(queue.waiters)
+                future.set_result(None)
+            else:
+                await asyncio.sleep(queue.bucket.time_until(1, now))
@@ -0,0 +1,91 @@
+"""
+Structured scene: where the group is and what it can see.
+
+The scene LLM call returns small patches (move, add/remove object, add/remove
+character) that are applied here; the text form is only rendered for prompts
+and the scene_updated event. Free text set by the GM or loaded from an old save
+is kept as the description until the group moves.
+"""
+
+from typing import Optional
+
+class SceneState:
+    def __init__(self, location: str = "", area: str = "", objects: Optional[list[str]] = None,
+                 characters: Optional[list[str]] = None, description: str = ""):
+        self.location = location
+        self.area = area
+        self.objects = list(objects or [])
+        self.characters = list(characters or [])
+        self.description = description
+
+    def to_dict(self):
+        return {
+            "location": self.location,
+            "area": self.area,
+            "objects": list(self.objects),
+            "characters": list(self.characters),
+            "description": self.description
+        }
+
+    @classmethod
+    def from_dict(cls, data) -> 'SceneState':
+        return cls(
+            location=data.get("location", ""),
+            area=data.get("area", ""),
+            objects=data.get("objects", []),
+            characters=data.get("characters", []),
+            description=data.get("description", "")
+        )
+
+    def copy(self) -> 'SceneState':
+        return SceneState.from_dict(self.to_dict())
+
+    def render(self) -> str:
+        """Scene text for prompts and clients"""
+        lines = []
+        if self.description:
+            lines.append(self.description)
+        if self.location or self.area:
+            place = ", ".join(part for part in (self.location, self.area) if part)
+            lines.append(f"You are in {place}.")
+        if self.objects:
+            lines.append("Here you can see:")
+            lines.extend(f"- {item}" for item in self.objects)
+        if self.characters:
+            lines.append(f"Also here: {', '.join(self.characters)}.")
+        return "\n".join(lines)
+
+    def apply(self, patch: dict) -> bool:
+        """Apply one patch; returns True if the scene changed"""
+        op = patch.get("op")
+        if op == "move":
+            location = patch.get("location") or self.location
+            area = patch.get("area", "")
+            if (location, area) == (self.location, self.area):
+                return False
+            # Nothing seen at the old place is visible anymore
+            self.location, self.area = location, area
+            self.objects, self.characters, self.description = [], [], ""
+            return True
+        if op in ("add_object", "add_character"):
+            items = self.objects if op == "add_object" else self.characters
+            name = (patch.get("name") or "").strip()
+            if not name or _find(items, name) is not None:
+                return False
+            items.append(name)
+            return True
+        if op in ("remove_object", "remove_character"):
+            items = self.objects if op == "remove_object" else self.characters
+            index = _find(items, patch.get("name") or "")
+            if index is None:
+                return False
+            del items[index]
+            return True
+        return False
+
+def _find(items: list[str], name: str) -> Optional[int]:
+    name = name.strip().lower()
+    for index, item in enumerate(items):
+        if item.lower() == name:
+            return index
+    return None
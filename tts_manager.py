@@ -203,7 +203,7 @@ class TTSManager:
             self.last_error = error_msg
             raise
 
-    def synthesize_and_play_speech(self, text, selected_voice, speech_rate, speech_volume):
+    def synthesize_and_play_speech(self, text, selected_voice, speech_rate, speech_volume, cancel_token=None):
         """Process and play text directly without batching
         
         Args:
@@ -211,19 +211,29 @@ class TTSManager:
             selected_voice: Voice ID to use
             speech_rate: Speed of speech (float multiplier)
             speech_volume: Volume level (0.0 to 1.0)
+            cancel_token: CancellationToken that skips or stops playback when cancelled
         """
         # Process all text at once
         audio = self._generate_audio(text, selected_voice, speech_rate, speech_volume)
         print(f"Audio generated")
+        if cancel_token and cancel_token.cancelled:
+            print("Speech cancelled, not playing")
+            return
         if audio is not None:
             if self.play_in_ui:
                 # Send to UI for playback
                 print("Sending audio to UI")
                 self._send_audio_to_ui(audio, text)
             else:
-                # Play locally using sounddevice
+                # Play locally using sounddevice, cancelling stops the playback
                 sd.play(audio.numpy(), self.sample_rate, device=self.audio_device)
-                sd.wait()
+                if cancel_token:
+                    cancel_token.add_callback(sd.stop)
+                try:
+                    sd.wait()
+                finally:
+                    if cancel_token:
+                        cancel_token.remove_callback(sd.stop)
             print("Finished speaking text")
             
     def _encode_audio_to_base64(self, audio_tensor):
@@ -287,7 +297,7 @@ class TTSManager:
         except Exception as e:
             print(f"Error sending audio to UI: {str(e)}")
 
-    def process_text_directly(self, text, rate=None, volume=None, voice=None):
+    def process_text_directly(self, text, rate=None, volume=None, voice=None, cancel_token=None):
         """Process text directly
         
         Args:
@@ -295,6 +305,7 @@ class TTSManager:
             rate: Speed of speech (float multiplier)
             volume: Volume level (0.0 to 1.0)
             voice: Voice ID to use
+            cancel_token: CancellationToken of the turn the text belongs to
         """
         # Set default values if not provided
         speech_rate = rate if rate is not None else self.rate
@@ -311,14 +322,22 @@ class TTSManager:
             selected_voice = self.speakers[0]
             print(f"No voice specified, using {selected_voice}")
 
-        # Acquire lock to ensure only one text is processed at a time
-        with self.tts_lock:
-            try:
-                self.synthesize_and_play_speech(text, selected_voice, speech_rate, speech_volume)
-            except Exception as e:
-                print(f"Error processing speech: {str(e)}")
+        # Acquire lock to ensure only one text is processed at a time,
+        # giving up when the turn is cancelled while waiting
+        while not self.tts_lock.acquire(timeout=0.1):
+            if cancel_token and cancel_token.cancelled:
+                print("Speech cancelled while waiting for the TTS lock")
+                return
+        try:
+            if cancel_token and cancel_token.cancelled:
+                return
+            self.synthesize_and_play_speech(text, selected_voice, speech_rate, speech_volume, cancel_token)
+        except Exception as e:
+            print(f"Error processing speech: {str(e)}")
+        finally:
+            self.tts_lock.release()
 
-    def speak_text(self, text, rate=None, volume=None, voice=None):
+    def speak_text(self, text, rate=None, volume=None, voice=None, cancel_token=None):
         """Convert text to speech immediately
         
         Args:
@@ -326,6 +345,7 @@ class TTSManager:
             rate: Speed of speech (float multiplier, default is 1.0)
             volume: Volume level (0.0 to 1.0)
             voice: Voice ID to use
+            cancel_token: CancellationToken that skips or stops the speech when cancelled
         
         Returns:
             None
@@ -334,7 +354,7 @@ class TTSManager:
             return
         
         # Process text directly
-        self.process_text_directly(text, rate, volume, voice)
+        self.process_text_directly(text, rate, volume, voice, cancel_token)
 
     def _generate_audio(self, text, voice, rate=1.0, volume=1.0):
         """Generate audio for text with the specified parameters"""
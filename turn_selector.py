@@ -0,0 +1,108 @@
+"""
+Local choice of the acting character, tried before the analyzer LLM call.
+
+The last message is scored against every active character:
+- naming the character (full name or first name) is the strong signal, a race
+  or class alias ("the dwarf") counts when only one character matches it
+- embedding similarity between the message and the character's profile
+- recent speaker order: whoever just spoke doesn't answer themselves
+
+A character is only chosen when its score clears LOCAL_SELECTOR_MIN_SCORE and
+beats the runner-up by LOCAL_SELECTOR_MARGIN; otherwise the analyzer decides.
+With a single active character there is nothing to decide.
+"""
+
+import os
+import re
+import numpy as np
+
+LOCAL_TURN_SELECTOR = os.getenv("LOCAL_TURN_SELECTOR", "1")
+LOCAL_SELECTOR_MIN_SCORE = float(os.getenv("LOCAL_SELECTOR_MIN_SCORE", "0.8"))
+LOCAL_SELECTOR_MARGIN = float(os.getenv("LOCAL_SELECTOR_MARGIN", "0.3"))
+
+NAME_SCORE = 1.0
+FIRST_NAME_SCORE = 0.9
+ALIAS_SCORE = 0.6
+EMBEDDING_WEIGHT = 0.3
+LAST_SPEAKER_PENALTY = 0.6
+RECENT_SPEAKER_PENALTY = 0.1
+RECENT_WINDOW = 4
+
+def _mentions(text: str, phrase: str) -> bool:
+    phrase = phrase.strip()
+    if len(phrase) < 3:
+        return False
+    return re.search(rf"(?<!\w){re.escape(phrase)}(?!\w)", text, re.IGNORECASE) is not None
+
+def name_scores(text: str, characters) -> dict[str, float]:
+    """Score how directly the text addresses each character by name or alias"""
+    scores = {}
+    for char in characters:
+        if _mentions(text, char.name):
+            scores[char.id] = NAME_SCORE
+        elif _mentions(text, char.name.split()[0] if char.name.split() else ""):
+            scores[char.id] = FIRST_NAME_SCORE
+        else:
+            scores[char.id] = 0.0
+
+    # A race or class only identifies a character if nobody else shares it
+    for attribute in ("race", "char_class"):
+        values = [getattr(char, attribute, "").strip().lower() for char in characters]
+        for char, value in zip(characters, values):
+            if value and values.count(value) == 1 and _mentions(text, value):
+                scores[char.id] = max(scores[char.id], ALIAS_SCORE)
+    return scores
+
+def speaker_penalties(history, characters) -> dict[str, float]:
+    """Penalise characters who spoke last or recently"""
+    penalties = {char.id: 0.0 for char in characters}
+    recent = [message.character_id for message in history[-RECENT_WINDOW:]]
+    for position, character_id in enumerate(reversed(recent)):
+        if character_id not in penalties:
+            continue
+        if position == 0:
+            penalties[character_id] += LAST_SPEAKER_PENALTY
+        else:
+            penalties[character_id] += RECENT_SPEAKER_PENALTY
+    return penalties
+
+def _profile(char) -> str:
+    intentions = "; ".join(getattr(char, "intentions", []) or [])
+    return f"{char.name}, {char.race} {char.char_class}. {char.personality} {intentions}"
+
+def embedding_scores(text: str, characters) -> dict[str, float]:
+    """Cosine similarity between the text and each character's profile"""
+    # Loaded here so the model is only touched when a name signal exists
+    from vector_compare import encode_many
+    # Profiles rarely change, so they are served from the embedding cache
+    embeddings = encode_many([text] + [_profile(char) for char in characters])
+    similarities = embeddings[1:] @ embeddings[0]
+    return {char.id: float(similarity) for char, similarity in zip(characters, np.clip(similarities, 0.0, 1.0))}
+
+def select_acting_character(history, characters, embed=embedding_scores):
+    """
+    Return the character the last message obviously addresses, or None.
+
+    history is the dialogue message list, characters the active characters.
+    """
+    if not LOCAL_TURN_SELECTOR or not history or not characters:
+        return None
+    if len(characters) == 1:
+        return characters[0]
+
+    last_message = history[-1]
+    scores = name_scores(last_message.message or "", characters)
+    if max(scores.values()) == 0.0:
+        # Nobody is addressed, leave the choice to the analyzer
+        return None
+
+    penalties = speaker_penalties(history, characters)
+    similarities = embed(last_message.message, characters) if embed else {}
+    for char in characters:
+        scores[char.id] += EMBEDDING_WEIGHT * similarities.get(char.id, 0.0) - penalties[char.id]
+
+    ranked = sorted(characters, key=lambda char: scores[char.id], reverse=True)
+    best, runner_up = ranked[0], ranked[1]
+    if scores[best.id] < LOCAL_SELECTOR_MIN_SCORE or scores[best.id] - scores[runner_up.id] < LOCAL_SELECTOR_MARGIN:
+        return None
+    return best
@@ -360,6 +360,25 @@ const ChatArea: React.FC = observer(() => {
             >
               Continue
             </button>
+
+            <button 
+              className={`btn ${styles.btnSecondary} ms-2`}
+              onClick={() => chatStore.playRound()}
+              disabled={chatStore.isThinking}
+              title="Let every active character reply once"
+            >
+              Round
+            </button>
+
+            {chatStore.isTurnActive && (
+              <button 
+                className={`btn ${styles.btnSecondary} ms-2`}
+                onClick={() => chatStore.cancelTurn()}
+                title="Stop the current turn"
+              >
+                Stop
+              </button>
+            )}
           </div>
         </div>
       </div>
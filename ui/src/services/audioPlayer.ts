@@ -14,6 +14,7 @@ export class AudioPlayer {
     private audioContext = new AudioContext();
     private gainNode: GainNode;
     private isPlaying = false;
+    private currentSource: AudioBufferSourceNode | null = null;
     
     constructor() {
         this.gainNode = this.audioContext.createGain();
@@ -37,6 +38,21 @@ export class AudioPlayer {
               this.playNextAudio();
             }
           });
+
+        // A cancelled turn drops its queued speech and stops what is playing
+        socketService.on('turn_cancelled', () => {
+            this.stop();
+        });
+    }
+
+    stop() {
+        this.audioQueue = [];
+        if (this.currentSource) {
+            this.currentSource.onended = null;
+            this.currentSource.stop();
+            this.currentSource = null;
+        }
+        this.isPlaying = false;
     }
 
     playNextAudio = async () => {
@@ -97,9 +113,11 @@ export class AudioPlayer {
             console.log("Setting onended");
             source.onended = () => {
                 console.log("Playing next audio");
+                this.currentSource = null;
                 this.playNextAudio();
             };
             
+            this.currentSource = source;
             source.start();
         } catch (error) {
           console.error('Error playing audio:', error);
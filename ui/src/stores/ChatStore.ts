@@ -28,6 +28,12 @@ class ChatStore {
   // Messages
   messages: Message[] = [];
   isThinking: boolean = false;
+  // Character replies still arriving as message_delta events
+  streamingMessageIds: string[] = [];
+  // Streams cut off by a cancelled turn; their late deltas are ignored
+  droppedStreamIds: Set<string> = new Set();
+  // Tool calls, scene updates and speech still running after the last reply
+  backgroundTasks: Record<string, number> = {};
   
   // Persona
   currentPersonaId: string = '';
@@ -58,8 +64,19 @@ class ChatStore {
     // Listen for new messages (separate from regular message events)
     socketService.on('new_message', (data) => {
       console.log('New message:', data);
+      // A streamed message is replaced by its final version
+      const streamedIndex = this.messages.findIndex(m => m.id === data.id);
+      if (streamedIndex !== -1) {
+        this.messages.splice(streamedIndex, 1);
+      }
+      this.finishStream(data.id);
       this.addMessage(data);
     });
+
+    // Listen for streamed character reply chunks
+    socketService.on('message_delta', (data) => {
+      this.appendMessageDelta(data);
+    });
     
     // Listen for loading messages in bulk (e.g., when loading a saved game)
     socketService.on('load_messages', ({messages}) => {
@@ -82,6 +99,18 @@ class ChatStore {
     
     socketService.on('thinking_ended', () => {
       this.setThinking(false);
+      // The turn is over, a stream without its final message was cut off
+      this.discardStreamedMessages();
+    });
+
+    socketService.on('turn_cancelled', () => {
+      this.setThinking(false);
+      this.discardStreamedMessages();
+    });
+
+    // Listen for background post-turn work
+    socketService.on('post_turn_status', (data) => {
+      this.setBackgroundTasks(data.queue, data.pending);
     });
 
     // Listen for notification events
@@ -139,6 +168,16 @@ class ChatStore {
     
     this.setThinking(true);
   }
+
+  playRound() {
+    socketService.sendEvent('gm_round');
+
+    this.setThinking(true);
+  }
+
+  cancelTurn() {
+    socketService.sendEvent('cancel_turn');
+  }
   
   addMessage(message: any) {
     // Generate a unique ID if not provided
@@ -161,6 +200,49 @@ class ChatStore {
     }
   }
   
+  appendMessageDelta(delta: any) {
+    if (this.droppedStreamIds.has(delta.id)) return;
+    const message = this.messages.find(m => m.id === delta.id);
+    if (message) {
+      message.content += delta.delta;
+      return;
+    }
+    this.streamingMessageIds.push(delta.id);
+    this.addMessage({
+      id: delta.id,
+      sender: delta.sender,
+      message: delta.delta,
+      character_id: delta.character_id,
+      avatar: delta.avatar
+    });
+  }
+  
+  finishStream(id: string) {
+    this.streamingMessageIds = this.streamingMessageIds.filter(streamId => streamId !== id);
+  }
+
+  // Remove partial replies whose final message will never arrive
+  discardStreamedMessages() {
+    if (this.streamingMessageIds.length === 0) return;
+    const dropped = new Set(this.streamingMessageIds);
+    dropped.forEach(id => this.droppedStreamIds.add(id));
+    this.messages = this.messages.filter(m => !dropped.has(m.id));
+    this.streamingMessageIds = [];
+  }
+
+  // A turn is running until its replies have finished streaming
+  get isTurnActive() {
+    return this.isThinking || this.streamingMessageIds.length > 0;
+  }
+
+  setBackgroundTasks(queue: string, pending: number) {
+    this.backgroundTasks = { ...this.backgroundTasks, [queue]: pending };
+  }
+
+  get hasBackgroundTasks() {
+    return Object.values(this.backgroundTasks).some(pending => pending > 0);
+  }
+
   setThinking(isThinking: boolean) {
     this.isThinking = isThinking;
     
@@ -1,72 +1,247 @@
 import os
+import threading
+import numpy as np
 from app_socket import send_socket_message
-from ai_utils import generate_response
+from ai_utils import generate_response, get_request_api_key
+from cancellation import CancellationToken, TurnCancelled
 from logger_config import logger
+from post_turn import post_turn_queue
+from scene_state import SceneState
+from google.genai.types import FunctionDeclaration, Tool, Schema
 
-_current_scene = ""
+_current_scene = SceneState()
+_scene_lock = threading.Lock()
 
 language = os.getenv("LANGUAGE")
 
+# Messages arriving within SCENE_UPDATE_DELAY seconds share one update,
+# a batch is sent early once it holds SCENE_UPDATE_MAX_MESSAGES messages
+SCENE_UPDATE_DELAY = float(os.getenv("SCENE_UPDATE_DELAY", "3"))
+SCENE_UPDATE_MAX_MESSAGES = int(os.getenv("SCENE_UPDATE_MAX_MESSAGES", "4"))
+# Messages less similar than this to every scene change example are skipped, empty disables the gate
+SCENE_GATE_THRESHOLD = os.getenv("SCENE_GATE_THRESHOLD", "0.3")
+
+# What a message that changes the scene looks like
+SCENE_CHANGE_EXAMPLES = [
+    "We go to the tavern.",
+    "I walk north along the road.",
+    "We enter the cave and climb down the stairs.",
+    "Let's leave the town and head to the forest.",
+    "You see a chest, a torch on the wall and a locked door.",
+    "A stranger walks into the room.",
+    "I pick up the sword from the table.",
+    "The bridge collapses behind us.",
+]
+
+def _name_declaration(name, description, name_description):
+    return Tool(function_declarations=[FunctionDeclaration(
+        name=name,
+        description=description,
+        parameters=Schema(
+            type="OBJECT",
+            properties={
+                "name": Schema(type="STRING", description=name_description)
+            },
+            required=["name"]
+        )
+    )])
+
+move_to_declaration = Tool(function_declarations=[FunctionDeclaration(
+    name="move_to",
+    description="The group arrived at another place. Everything seen at the old place is forgotten.",
+    parameters=Schema(
+        type="OBJECT",
+        properties={
+            "location": Schema(type="STRING", description="Settlement or region, e.g. the city of Kadera"),
+            "area": Schema(type="STRING", description="Place inside the location, e.g. the tavern")
+        },
+        required=["location"]
+    )
+)])
+add_object_declaration = _name_declaration("add_object", "An object the group can now see", "Short description of the object")
+remove_object_declaration = _name_declaration("remove_object", "An object that is gone or was taken", "The object as listed in the scene")
+add_character_declaration = _name_declaration("add_character", "Someone outside the group who is now here", "Who it is")
+remove_character_declaration = _name_declaration("remove_character", "Someone outside the group who left", "The character as listed in the scene")
+
 def set_current_scene(scene: str):
-    global _current_scene
-    _current_scene = scene
+    """Replace the scene with free text, e.g. edited by the GM"""
+    set_scene_state(SceneState(description=scene))
 
 def get_current_scene():
-    return _current_scene
+    with _scene_lock:
+        return _current_scene.render()
 
-def update_scene(old_scene: str, message: str):
-    message_string = message.replace('\n', ' ')
-    old_scene_string = old_scene.replace('\n', ' ')
+def set_scene_state(state: SceneState):
+    global _current_scene
+    with _scene_lock:
+        _current_scene = state
+
+def get_scene_state() -> SceneState:
+    with _scene_lock:
+        return _current_scene.copy()
+
+def apply_scene_patches(patches: list[dict]) -> list[dict]:
+    """Apply patches to the current scene; returns the ones that changed it"""
+    with _scene_lock:
+        return [patch for patch in patches if _current_scene.apply(patch)]
+
+def update_scene(old_scene: str, message: str, cancel_token: CancellationToken | None = None,
+                 api_key=None) -> list[dict]:
+    """Ask the LLM how the messages change the scene; returns the patches"""
+    message_string = "\n    ".join(line.strip() for line in message.splitlines() if line.strip())
+    old_scene_string = "\n    ".join(old_scene.splitlines()) or "Unknown"
     prompt = f"""
     You are an assistant for a RPG game.
-    {"Use Russian language for your response" if language == "ru" else ""}
-    You receive a message and update the scene description with new details about objects that players can see.
-    Try to rephrase the text to make it shorter.
-    Don't add anything that is not in the message.
-    Don't add anything from your self.
-    Track character movements.
-    "You are heading to..." means that you need to update the location name.
-
-    Example:
-    You are in <area>. In <place>.
-    Here you can see:
-    <object>.
-    <object>.
-
-    New message:
+    {"Use Russian language for names and descriptions" if language == "ru" else ""}
+    You receive new messages and track the scene the players are in.
+    Call move_to when the group arrives at another place.
+    Call add_object and remove_object for objects players can see, add_character and remove_character for people and creatures that are not in the group.
+    Keep names short. Don't add anything that is not in the messages.
+    "You are heading to..." is not an arrival yet.
+    If nothing changes, don't call any function.
+
+    New messages:
     {message_string}
 
     Current scene:
     {old_scene_string}
-
-    Updated scene text:
     """
+
+    patches: list[dict] = []
+
+    def move_to(location: str, area: str = ""):
+        patches.append({"op": "move", "location": location, "area": area})
+
+    def add_object(name: str):
+        patches.append({"op": "add_object", "name": name})
+
+    def remove_object(name: str):
+        patches.append({"op": "remove_object", "name": name})
+
+    def add_character(name: str):
+        patches.append({"op": "add_character", "name": name})
+
+    def remove_character(name: str):
+        patches.append({"op": "remove_character", "name": name})
+
+    generate_response(prompt, temperature=0.4, stage="scene", api_key=api_key, cancel_token=cancel_token, tools=[
+        (move_to, move_to_declaration),
+        (add_object, add_object_declaration),
+        (remove_object, remove_object_declaration),
+        (add_character, add_character_declaration),
+        (remove_character, remove_character_declaration),
+    ])
+    return patches
     
-    result = generate_response(prompt, temperature=0.7)
-    
-    return result
-    
-def do_update_scene(sender, message):
+def do_update_scene(sender, message, cancel_token: CancellationToken | None = None, api_key=None):
+    _apply_scene_update(f"{sender}: {message}", cancel_token, api_key)
+
+def _apply_scene_update(messages: str, cancel_token: CancellationToken | None = None, api_key=None):
     # Emit scene_updating event to notify clients
     send_socket_message('scene_updating', {'status': 'started'})
-    logger.info(f"Updating scene from {sender}: {message}")
+    logger.info(f"Updating scene from {messages}")
     
     try:
-        # Update scene based on message
-        result = update_scene(get_current_scene(), f"{sender}: {message}")
-        
-        # Check if scene was actually updated
-        text = result.text
-        if text != get_current_scene():
-            set_current_scene(text)
-            # Emit scene_updated event to clients with the full scene object
-            logger.info(f"Scene updated to {text}")
-            send_socket_message('scene_updated', {'scene': text})
+        # Ask for patches to the scene based on the messages
+        patches = update_scene(get_current_scene(), messages, cancel_token, api_key)
+        if cancel_token and cancel_token.cancelled:
+            raise TurnCancelled()
+
+        # Patches are applied to the latest scene, so a GM edit meanwhile is kept
+        applied = apply_scene_patches(patches)
+        if applied:
+            state = get_scene_state()
+            text = state.render()
+            # Emit scene_updated event to clients with the text, the state and the changes
+            logger.info(f"Scene updated with {applied}")
+            send_socket_message('scene_updated', {'scene': text, 'state': state.to_dict(), 'patch': applied})
         
+    except TurnCancelled:
+        logger.info(f"Scene update from {messages} cancelled")
+        send_socket_message('scene_updating', {'status': 'cancelled'})
+        return
     except Exception as e:
         # Notify clients of update error
         logger.error(f"Error updating scene: {e}")
         send_socket_message('scene_updating', {'status': 'error', 'message': str(e)})
     
     # Notify clients that scene updating is complete
-    send_socket_message('scene_updating', {'status': 'completed'})
\ No newline at end of file
+    send_socket_message('scene_updating', {'status': 'completed'})
+
+def scene_relevance(message: str) -> float:
+    """Highest cosine similarity between the message and the scene change examples"""
+    # Loaded here so importing this module doesn't load the embedding model
+    from vector_compare import encode_many
+    # The examples come from the embedding cache after the first call
+    embeddings = encode_many(SCENE_CHANGE_EXAMPLES + [message])
+    return float(np.max(embeddings[:-1] @ embeddings[-1]))
+
+def may_change_scene(message: str) -> bool:
+    """Cheap gate in front of the LLM scene update"""
+    if not SCENE_GATE_THRESHOLD:
+        return True
+    try:
+        return scene_relevance(message) >= float(SCENE_GATE_THRESHOLD)
+    except Exception as e:
+        logger.warning(f"Scene gate failed, updating anyway: {e}")
+        return True
+
+class SceneUpdateBatcher:
+    """
+    Collects character messages and updates the scene once per batch.
+
+    The batch is flushed SCENE_UPDATE_DELAY seconds after its first message or
+    as soon as it holds SCENE_UPDATE_MAX_MESSAGES. The update itself runs on
+    post_turn_queue, where messages that don't pass the gate or belong to a
+    cancelled turn are dropped first. Each message keeps the API key of the
+    session it came from, the timer and queue threads have no request context.
+    """
+
+    def __init__(self, delay=SCENE_UPDATE_DELAY, max_messages=SCENE_UPDATE_MAX_MESSAGES, gate=may_change_scene):
+        self.delay = delay
+        self.max_messages = max_messages
+        self.gate = gate
+        self._pending: list[tuple[str, str, CancellationToken | None, str | None]] = []
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+
+    def add(self, sender: str, message: str, cancel_token: CancellationToken | None = None, api_key=None):
+        with self._lock:
+            self._pending.append((sender, message, cancel_token, api_key))
+            if len(self._pending) < self.max_messages and self.delay > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.delay, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Queue the update for the collected messages right away"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if batch:
+            post_turn_queue.submit("scene", self._update, batch)
+
+    def _update(self, batch):
+        entries = [entry for entry in batch if not (entry[2] and entry[2].cancelled)]
+        entries = [entry for entry in entries if self.gate(entry[1])]
+        if not entries:
+            logger.info(f"Skipping scene update, {len(batch)} message(s) don't change the scene")
+            return
+        messages = "\n".join(f"{sender}: {message}" for sender, message, _, _ in entries)
+        # The latest turn's token can stop the update, and its session pays for it
+        _, _, cancel_token, api_key = entries[-1]
+        _apply_scene_update(messages, cancel_token, api_key)
+
+scene_batcher = SceneUpdateBatcher()
+
+def schedule_scene_update(sender: str, message: str, cancel_token: CancellationToken | None = None, api_key=None):
+    """Add a message to the next batched scene update, with the caller's API key unless one is given"""
+    scene_batcher.add(sender, message, cancel_token, api_key or get_request_api_key())
+
+def flush_scene_updates():
+    scene_batcher.flush()
@@ -1,25 +1,41 @@
 import numpy as np
 from sentence_transformers import SentenceTransformer
 
-cache = {}
+from embedding_cache import EMBEDDING_MODEL, embedding_cache
 
-model = SentenceTransformer('all-MiniLM-L6-v2')
+model = SentenceTransformer(EMBEDDING_MODEL)
 
-def compare_with_base(base_phrase, input_text):
-    base_embedding = cache.get(base_phrase)
-    input_embedding = cache.get(input_text)
+def _embed(text: str) -> np.ndarray:
+    embedding = embedding_cache.get(text)
+    if embedding is None:
+        embedding = model.encode(text, convert_to_tensor=False)
+        embedding = embedding / np.linalg.norm(embedding)
+        embedding_cache.put(text, embedding)
+    return embedding
 
-    if base_embedding is None:
-        base_embedding = model.encode(base_phrase, convert_to_tensor=False)
-        base_embedding = base_embedding / np.linalg.norm(base_embedding)
-        cache[base_phrase] = base_embedding
+def compare_with_base(base_phrase, input_text):
+    base_embedding = _embed(base_phrase)
+    input_embedding = _embed(input_text)
 
-    if input_embedding is None:
-        input_embedding = model.encode(input_text, convert_to_tensor=False)
-        input_embedding = input_embedding / np.linalg.norm(input_embedding)
-        cache[input_text] = input_embedding
-    
     # Calculate cosine similarity directly
     cosine_similarity = np.dot(base_embedding, input_embedding)
-    
-    return cosine_similarity
\ No newline at end of file
+
+    return cosine_similarity
+
+def encode_many(texts: list[str]) -> np.ndarray:
+    """Normalized embeddings of texts as rows, encoding the uncached ones in one batch"""
+    if not texts:
+        return np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    found = {}
+    for text in dict.fromkeys(texts):
+        embedding = embedding_cache.get(text)
+        if embedding is not None:
+            found[text] = embedding
+    missing = [text for text in dict.fromkeys(texts) if text not in found]
+    if missing:
+        embeddings = model.encode(missing, convert_to_numpy=True, normalize_embeddings=True)
+        for text, embedding in zip(missing, embeddings):
+            embedding_cache.put(text, embedding)
+            found[text] = embedding
+    # Rows come from this call, not the cache, so an eviction in between can't lose one
+    return np.stack([found[text] for text in texts])